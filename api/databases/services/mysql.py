@@ -39,7 +39,7 @@ class FastcpSqlService(object):
 
         return False
 
-    def setup_db(self, user: str, password: str, dbname: str) -> None:
+    def setup_db(self, user: str, password: str, dbname: str, exists_ok: bool = False) -> None:
         """Setup DB.
 
         Creates a MySQL user using the provided username and given password, creates the database, and grants priviliges to
@@ -49,17 +49,22 @@ class FastcpSqlService(object):
             user (str): The username string.
             password (str): The plain text password.
             dbname (str): The database name.
+            exists_ok (bool): Don't fail if the user or the database already exist, so an interrupted setup can be
+                              run again. The password of existing users is updated.
 
         Returns:
             bool: True on success and False otherwise
         """
 
         # SQL statement
+        if_not_exists = 'IF NOT EXISTS ' if exists_ok else ''
         res_1 = self._execute_sql(
-            f"CREATE USER '{user}'@'localhost' IDENTIFIED BY '{password}'")
+            f"CREATE USER {if_not_exists}'{user}'@'localhost' IDENTIFIED BY '{password}'")
         res_2 = self._execute_sql(
-            f"CREATE USER '{user}'@'%' IDENTIFIED BY '{password}'")
-        res_3 = self._execute_sql(f"CREATE DATABASE {dbname}")
+            f"CREATE USER {if_not_exists}'{user}'@'%' IDENTIFIED BY '{password}'")
+        if exists_ok:
+            self.update_password(user, password)
+        res_3 = self._execute_sql(f"CREATE DATABASE {if_not_exists}{dbname}")
         res_4 = self._execute_sql(
             f"GRANT ALL PRIVILEGES ON {dbname}.* TO '{user}'@'localhost'")
         res_5 = self._execute_sql(
@@ -24,6 +24,9 @@ class RenameFileSerializer(ValidPathSerializer):
 class RemoteUploadSerializer(ValidPathSerializer):
     path = serializers.CharField(required=False)
     remote_url = serializers.URLField()
+    checksum = serializers.CharField(required=False)
+    algorithm = serializers.ChoiceField(
+        choices=(('md5', 'MD5'), ('sha1', 'SHA-1'), ('sha256', 'SHA-256')), default='sha256')
 
     def validate(self, data):
         path = data.get('path')
@@ -50,8 +53,47 @@ class FileUploadSerializer(ValidPathSerializer):
     path = serializers.CharField(required=False)
 
 
+class UploadCreateSerializer(ValidPathSerializer):
+    """Defines fields required to start a resumable upload."""
+    path = serializers.CharField()
+    name = serializers.CharField(max_length=255)
+    size = serializers.IntegerField(min_value=0)
+
+    def validate_name(self, value):
+        if '/' in value or value in ['.', '..']:
+            raise serializers.ValidationError('The file name is invalid.')
+        return value
+
+
+class UploadFinalizeSerializer(serializers.Serializer):
+    """Defines fields required to finalize a resumable upload."""
+    checksum = serializers.CharField(required=False)
+    algorithm = serializers.ChoiceField(
+        choices=(('md5', 'MD5'), ('sha1', 'SHA-1'), ('sha256', 'SHA-256')), default='sha256')
+
+
 class ReadFileSerializer(ValidPathSerializer):
-    """Defines fields required to read a file's content."""
+    """Defines fields required to read a file's content.
+
+    Large files can be read in windows, either by byte offset (offset and length), by line
+    (line and lines) or from the end of the file (tail).
+    """
+    path = serializers.CharField()
+    offset = serializers.IntegerField(required=False, min_value=0)
+    length = serializers.IntegerField(required=False, min_value=1, max_value=10000000)
+    line = serializers.IntegerField(required=False, min_value=1)
+    lines = serializers.IntegerField(required=False, min_value=1, max_value=100000)
+    tail = serializers.IntegerField(required=False, min_value=1, max_value=100000)
+
+
+class FollowFileSerializer(ValidPathSerializer):
+    """Defines fields required to follow a file, lines is the number of existing lines to send first."""
+    path = serializers.CharField()
+    lines = serializers.IntegerField(default=0, min_value=0, max_value=10000)
+
+
+class WatchDirectorySerializer(ValidPathSerializer):
+    """Defines fields required to watch a directory."""
     path = serializers.CharField()
 
 
@@ -72,10 +114,37 @@ class DeleteItemSerializer(serializers.Serializer):
     paths = serializers.CharField()
 
 
+class FileEditSerializer(serializers.Serializer):
+    """Defines a single edit, the text replaces length characters at offset."""
+    offset = serializers.IntegerField(min_value=0)
+    length = serializers.IntegerField(min_value=0)
+    text = serializers.CharField(allow_blank=True, trim_whitespace=False)
+
+
 class FileUpdateSerializer(ValidPathSerializer):
-    """Defines fields required to update a file's content."""
+    """Defines fields required to update a file's content.
+
+    Either the whole content or a list of edits to the version identified by etag is required.
+    """
     path = serializers.CharField()
-    content = serializers.CharField()
+    content = serializers.CharField(required=False, allow_blank=True, trim_whitespace=False)
+    edits = serializers.JSONField(required=False)
+    etag = serializers.CharField(required=False)
+
+    def validate_edits(self, value):
+        s = FileEditSerializer(data=value, many=True)
+        if not s.is_valid():
+            raise serializers.ValidationError('The edits are invalid.')
+        return s.validated_data
+
+    def validate(self, data):
+        if ('content' in data) == ('edits' in data):
+            raise serializers.ValidationError({
+                'content': 'Either the content or the edits are required.'})
+        if 'edits' in data and not data.get('etag'):
+            raise serializers.ValidationError({
+                'etag': 'The ETag of the edited version is required.'})
+        return data
 
 
 class ItemCreateSerializer(ValidPathSerializer):
@@ -1,6 +1,25 @@
 import os
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from core.models import RemoteFetch
+from core.utils.downloader import Downloader, DownloadError
+from core.utils.tasks import run_in_background
 from .base_service import BaseService
-import requests
+
+
+# A pending or running fetch that hasn't reported any progress for this long is considered dead,
+# e.g. its worker was restarted
+FETCH_STALE_AFTER = timedelta(minutes=5)
+
+
+class FetchInProgressError(Exception):
+    """Raised when another fetch is already saving a file to the same destination."""
+
+    def __init__(self, fetch: object):
+        super().__init__(f'{fetch.dest_path} is already being fetched.')
+        self.fetch = fetch
 
 
 class FileUploadService(BaseService):
@@ -26,38 +45,138 @@ class FileUploadService(BaseService):
         f = validated_data.get('file')
         dest_path = os.path.join(path, f.name)
         if self.is_allowed(path, user) and not os.path.exists(dest_path):
-            with open(dest_path, 'wb+') as destination:
-                for chunk in f.chunks():
-                    destination.write(chunk)    
+            if not self.move_into_place(f, dest_path):
+                with open(dest_path, 'wb+') as destination:
+                    for chunk in f.chunks():
+                        destination.write(chunk)    
             
             self.fix_ownership(dest_path)
             return True
         return False
 
+    def move_into_place(self, f, dest_path: str) -> bool:
+        """Move an uploaded file into place.
+        
+        If the upload handler already wrote the file to disk on the same filesystem as the destination,
+        the file is hard linked into place instead of being copied. The link never replaces an existing
+        file and the temporary name is removed once the uploaded file is closed.
+        
+        Args:
+            f (object): The uploaded file object.
+            dest_path (str): The destination path of the file.
+        
+        Returns:
+            bool: True if the file was moved and False if it needs to be copied.
+        """
+        if not hasattr(f, 'temporary_file_path'):
+            return False
+        
+        try:
+            os.chmod(f.temporary_file_path(), 0o644)
+            os.link(f.temporary_file_path(), dest_path)
+        except (OSError, IOError, PermissionError):
+            return False
+        
+        f.close()
+        return True
+
     
-    def remote_upload(self, validated_data) -> bool:
+    def remote_upload(self, validated_data) -> object:
         """Process remote upload.
         
+        The remote file is fetched in the background, so the request returns as soon as the fetch
+        is queued. The progress can be followed through the returned remote fetch object.
+        
         Args:
             validated_data (dict): Validated data dict from serializer (api.filemanager.serializers.RemoteUploadSerializer)
         
         Returns:
-            bool: True on success and False otherwise.
+            object: The remote fetch model object on success and None otherwise.
+
+        Raises:
+            FetchInProgressError: If another fetch is saving a file to the same destination, they
+                                  would share the part file.
         """
         path = validated_data.get('path')
         user = self.request.user
         
         remote_url = validated_data.get('remote_url')
-        dest_path = os.path.join(path, os.path.basename(remote_url))
+        name = os.path.basename(remote_url)
         
         # Check if allowed
         if self.is_allowed(path, user):
-            with requests.get(remote_url, stream=True, timeout=30) as res:
-                # Check status code
-                if res.status_code == 200:
-                    with open(dest_path, 'wb') as f:
-                        for chunk in res.iter_content(chunk_size=(1024*1024)):
-                            f.write(chunk)
-                
-                    return True
-        return False
\ No newline at end of file
+            key = RemoteFetch.destination_key(os.path.join(path, name))
+            while True:
+                try:
+                    # The unique active_key holds across the worker processes
+                    with transaction.atomic():
+                        fetch = RemoteFetch.objects.create(
+                            user=user,
+                            url=remote_url,
+                            path=path,
+                            name=name,
+                            checksum=validated_data.get('checksum'),
+                            algorithm=validated_data.get('algorithm'),
+                            active_key=key
+                        )
+                    break
+                except IntegrityError:
+                    active = RemoteFetch.objects.filter(active_key=key).first()
+                    if active is None:
+                        # It has just ended
+                        continue
+                    if active.updated >= timezone.now() - FETCH_STALE_AFTER:
+                        raise FetchInProgressError(active)
+                    # Only if it hasn't reported any progress in the meantime
+                    RemoteFetch.objects.filter(pk=active.pk, updated=active.updated).update(
+                        status='failed', error='The fetch stopped reporting progress.', active_key=None)
+            run_in_background(self.fetch_remote, fetch.pk)
+            return fetch
+        return None
+
+    def fetch_remote(self, fetch_id) -> bool:
+        """Fetch a remote file.
+        
+        Downloads the file of a remote fetch and records the progress as well as the result. A
+        failed fetch leaves its partial data behind, so fetching the same URL again resumes it.
+        
+        Args:
+            fetch_id (str): The UUID of the remote fetch.
+        
+        Returns:
+            bool: True on success and False otherwise.
+        """
+        fetch = RemoteFetch.objects.get(pk=fetch_id)
+        fetch.status = 'running'
+        fetch.save(update_fields=['status', 'updated'])
+        
+        def progress(received, size):
+            RemoteFetch.objects.filter(pk=fetch_id).update(
+                received=received, size=size, updated=timezone.now())
+        
+        downloader = Downloader(
+            fetch.url,
+            fetch.dest_path,
+            connections=settings.FASTCP_REMOTE_FETCH_CONNECTIONS,
+            progress=progress
+        )
+        try:
+            downloader.download(checksum=fetch.checksum, algorithm=fetch.algorithm)
+            fetch.status = 'completed'
+        except DownloadError as e:
+            fetch.status = 'failed'
+            fetch.error = str(e)
+        except Exception as e:
+            # Nobody waits on the background task, the fetch must not be left running
+            fetch.status = 'failed'
+            fetch.error = f'The file cannot be fetched: {e}'
+        
+        fetch.size = downloader.size
+        fetch.received = downloader.received
+        fetch.active_key = None
+        fetch.save()
+        
+        if fetch.status == 'completed':
+            self.fix_ownership(fetch.dest_path)
+            return True
+        return False
@@ -0,0 +1,71 @@
+from django.conf import settings
+from core.utils import filesystem as cpfs
+from core.utils import watchers
+from core.utils.http import async_sse_stream, sse_stream
+import os
+from .base_service import BaseService
+
+
+class FollowFileService(BaseService):
+    """Follow a file.
+
+    Streams the lines appended to a file, typically one of the logs in the logs directory of the user,
+    as server-sent events. All of the clients following the same file share a single reader.
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    def follow(self, validated_data: dict, asynchronous: bool = False, max_duration: float = None,
+               offset: int = None) -> object:
+        """Follow a file.
+
+        Each batch of lines carries the offset of its end in the file as its event ID. A client that
+        reconnects with one of them resumes from that offset, and gets the lines written while it was
+        away instead of the last lines of the file.
+
+        Args:
+            validated_data (dict): Validated data from serializer (api.filemanager.serializers.FollowFileSerializer)
+            asynchronous (bool): Return an async iterator, used when served over ASGI.
+            max_duration (float): Seconds after which a synchronous stream ends, see core.utils.http.sse_stream.
+            offset (int): Offset to resume from, the Last-Event-ID of a client that reconnects.
+
+        Returns:
+            object: An iterator of the event stream on success and None on failure.
+        """
+        user = self.request.user
+        path = validated_data.get('path')
+        if not path:
+            return None
+
+        # The follower opens the target of a symlink, so that's the path that must be allowed
+        path = os.path.realpath(path)
+        if not (self.is_allowed(path, user) and os.path.isfile(path)):
+            return None
+
+        subscription = watchers.follow(path)
+        # The lines after this position are pushed to the subscription
+        position = subscription.offset
+        initial = []
+        try:
+            data = b''
+            if offset is not None:
+                if position is not None and offset < position:
+                    start = max(offset, position - cpfs.MAX_LINE_WINDOW)
+                    data, _, _ = cpfs.read_bytes(path, start, position - start)
+                    if start > offset:
+                        # Too far behind, only the last complete lines are sent
+                        data = data[data.find(b'\n') + 1:]
+            elif validated_data.get('lines'):
+                data, start, _, _ = cpfs.tail_lines(path, validated_data.get('lines'))
+                if position is not None:
+                    data = data[:max(0, position - start)]
+            if data:
+                initial.append(('lines', data.decode('utf-8', errors='replace').splitlines()))
+        except (OSError, IOError, PermissionError):
+            pass
+
+        if asynchronous:
+            return async_sse_stream(subscription, initial, keepalive=settings.FASTCP_SSE_KEEPALIVE, last_id=position)
+        return sse_stream(subscription, initial, keepalive=settings.FASTCP_SSE_KEEPALIVE, max_duration=max_duration,
+                          last_id=position)
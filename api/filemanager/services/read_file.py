@@ -3,6 +3,14 @@ import os
 from .base_service import BaseService
 
 
+# Fields that select a window of the file
+WINDOW_FIELDS = ['offset', 'length', 'line', 'lines', 'tail']
+
+# Window size if only the start of the window is provided
+DEFAULT_LINES = 200
+DEFAULT_LENGTH = 1024 * 1024
+
+
 class ReadFileService(BaseService):
     """Read a file.
         
@@ -12,21 +20,21 @@ class ReadFileService(BaseService):
     def __init__(self, request):
         self.request = request
     
-    def read_file(self, validated_data: dict) -> str:
+    def read_file(self, validated_data: dict) -> dict:
         """Read file.
         
-        Reads the file for the provided path and returns the content.
+        Reads the file for the provided path and returns the content along with its ETag, which
+        can be sent back when the file is saved to detect changes made in the meantime.
         
         Args:
             validated_data (dict): Validated data from serializer (api.filemanager.serializers.ReadFileSerializer)
         
         Returns:
-            Content string on success and None on failure.
+            dict: The content and the ETag on success and None on failure.
         """
         
         user = self.request.user
         path = validated_data.get('path')
-        content = None
     
         if path and self.is_allowed(path, user) and os.path.exists(path):
             PATH_INFO = cpfs.get_path_info(path)
@@ -37,9 +45,66 @@ class ReadFileService(BaseService):
             if PATH_INFO.get('size') <= 10000000:
                 try:
                     with open(path, 'rb') as f:
+                        etag = cpfs.file_etag(os.fstat(f.fileno()))
                         content = f.read()
-                    content = content.decode('utf-8')
+                    return {
+                        'content': content.decode('utf-8'),
+                        'etag': etag
+                    }
                 except UnicodeDecodeError as e:
                     pass
                 
-        return content
\ No newline at end of file
+        return None
+
+    def read_window(self, validated_data: dict) -> dict:
+        """Read a window of a file.
+        
+        Reads a part of a file without loading the rest of it, so the size of the file doesn't matter.
+        The window is selected with tail (last N lines), line and lines (N lines starting at a line
+        number), or offset and length (a byte range).
+        
+        Args:
+            validated_data (dict): Validated data from serializer (api.filemanager.serializers.ReadFileSerializer)
+        
+        Returns:
+            dict: The content of the window along with its byte offsets, whether the lines were cut
+                  at DEFAULT_LENGTH bytes, the file size and the ETag of the file on success and None
+                  on failure.
+        """
+        user = self.request.user
+        path = validated_data.get('path')
+        
+        if not (path and self.is_allowed(path, user) and os.path.isfile(path)):
+            return None
+        
+        try:
+            truncated = False
+            if validated_data.get('tail'):
+                data, start, end, truncated = cpfs.tail_lines(
+                    path, validated_data.get('tail'), max_bytes=DEFAULT_LENGTH)
+            elif validated_data.get('line'):
+                data, start, end, truncated = cpfs.read_lines(
+                    path, validated_data.get('line') - 1, validated_data.get('lines', DEFAULT_LINES),
+                    max_bytes=DEFAULT_LENGTH)
+            else:
+                data, start, end = cpfs.read_bytes(
+                    path, validated_data.get('offset', 0), validated_data.get('length', DEFAULT_LENGTH))
+            stat = os.stat(path)
+        except (OSError, IOError, PermissionError):
+            return None
+        
+        return {
+            # Byte windows may split a multi-byte character at the edges
+            'content': data.decode('utf-8', errors='replace'),
+            'offset': start,
+            'end': end,
+            'size': stat.st_size,
+            # The lines were cut at DEFAULT_LENGTH bytes
+            'truncated': truncated,
+            'etag': cpfs.file_etag(stat)
+        }
+
+    @staticmethod
+    def is_window(validated_data: dict) -> bool:
+        """Checks either a window of the file is requested or the whole file."""
+        return any(validated_data.get(key) is not None for key in WINDOW_FIELDS)
@@ -0,0 +1,211 @@
+import hashlib
+import os
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import Upload
+from .base_service import BaseService
+
+
+# Size of the blocks read from the request body and from the part file
+READ_SIZE = 1024 * 1024
+
+# Upload sessions that haven't received any data for this long are discarded
+UPLOAD_EXPIRY = timedelta(days=7)
+
+
+def merge_range(ranges: list, start: int, end: int) -> list:
+    """Merge a byte range.
+
+    Adds the [start, end) range to a sorted list of non-overlapping ranges and merges the
+    ranges that overlap or touch each other.
+
+    Args:
+        ranges (list): A sorted list of [start, end) pairs.
+        start (int): Start of the new range.
+        end (int): End of the new range (exclusive).
+
+    Returns:
+        list: The merged and sorted list of ranges.
+    """
+    merged = []
+    for r_start, r_end in sorted(ranges + [[start, end]]):
+        if merged and r_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], r_end)
+        else:
+            merged.append([r_start, r_end])
+    return merged
+
+
+class ResumableUploadService(BaseService):
+    """Resumable upload.
+
+    Handles the upload sessions that allow large files to be uploaded in chunks. Every chunk is
+    written at its explicit offset in a part file that lives in the destination directory, so
+    chunks can be sent in parallel and an interrupted upload can be resumed. Once all of the
+    bytes are received, the part file is renamed into place.
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    def get_upload(self, upload_id) -> object:
+        """Get an upload session.
+
+        Args:
+            upload_id (str): The UUID of the upload session.
+
+        Returns:
+            object: The upload model object if the user owns it, otherwise None.
+        """
+        user = self.request.user
+        uploads = Upload.objects.filter(pk=upload_id)
+        if not user.is_superuser:
+            uploads = uploads.filter(user=user)
+        return uploads.first()
+
+    def discard_expired(self) -> None:
+        """Delete the upload sessions of the user that have been abandoned."""
+        expired = Upload.objects.filter(
+            user=self.request.user, updated__lt=timezone.now() - UPLOAD_EXPIRY)
+        for upload in expired:
+            self.abort(upload)
+
+    def create_upload(self, validated_data: dict) -> object:
+        """Create an upload session.
+
+        Creates the part file in the destination directory and allocates its full size, so that
+        chunks can be written at any offset.
+
+        Args:
+            validated_data (dict): Validated data from serializer (api.filemanager.serializers.UploadCreateSerializer)
+
+        Returns:
+            object: The upload model object on success and None otherwise.
+        """
+        user = self.request.user
+        path = validated_data.get('path')
+        name = validated_data.get('name')
+        size = validated_data.get('size')
+
+        if not self.is_allowed(path, user) or os.path.exists(os.path.join(path, name)):
+            return None
+
+        self.discard_expired()
+        upload = Upload(user=user, path=path, name=name, size=size)
+        try:
+            fd = os.open(upload.part_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            try:
+                os.ftruncate(fd, size)
+            finally:
+                os.close(fd)
+        except (OSError, IOError, PermissionError):
+            return None
+
+        upload.save()
+        return upload
+
+    def write_chunk(self, upload: object, offset: int, stream: object, length: int) -> object:
+        """Write a chunk.
+
+        Streams the chunk from the request body straight into the part file at the provided
+        offset. The chunk is never held in memory as a whole.
+
+        Args:
+            upload (object): The upload model object.
+            offset (int): Offset of the chunk in the file.
+            stream (object): A file-like object to read the chunk from.
+            length (int): Length of the chunk in bytes.
+
+        Returns:
+            object: The updated upload model object on success and None otherwise.
+        """
+        if offset < 0 or length < 0 or offset + length > upload.size:
+            return None
+
+        written = 0
+        try:
+            fd = os.open(upload.part_path, os.O_WRONLY)
+            try:
+                while written < length:
+                    data = stream.read(min(READ_SIZE, length - written))
+                    if not data:
+                        break
+                    os.pwrite(fd, data, offset + written)
+                    written += len(data)
+            finally:
+                os.close(fd)
+        except (OSError, IOError, PermissionError):
+            return None
+
+        # An interrupted chunk is still kept, the client resumes from the reported offset
+        if written:
+            with transaction.atomic():
+                upload = Upload.objects.select_for_update().get(pk=upload.pk)
+                upload.ranges = merge_range(upload.ranges, offset, offset + written)
+                first = upload.ranges[0]
+                upload.offset = first[1] if first[0] == 0 else 0
+                upload.save(update_fields=['ranges', 'offset', 'updated'])
+
+        if written < length:
+            return None
+        return upload
+
+    def finalize(self, upload: object, validated_data: dict) -> bool:
+        """Finalize an upload.
+
+        Verifies the checksum of the received file if one was provided and moves the part file
+        into place. The rename is atomic and it never replaces a file that already exists.
+
+        Args:
+            upload (object): The upload model object.
+            validated_data (dict): Validated data from serializer (api.filemanager.serializers.UploadFinalizeSerializer)
+
+        Returns:
+            bool: True on success and False otherwise.
+        """
+        if upload.size and not upload.is_complete:
+            return False
+
+        checksum = validated_data.get('checksum')
+        try:
+            if checksum:
+                digest = hashlib.new(validated_data.get('algorithm'))
+                with open(upload.part_path, 'rb') as f:
+                    for block in iter(lambda: f.read(READ_SIZE), b''):
+                        digest.update(block)
+                if digest.hexdigest() != checksum.lower():
+                    return False
+
+            try:
+                os.link(upload.part_path, upload.dest_path)
+                os.remove(upload.part_path)
+            except FileExistsError:
+                return False
+            except OSError:
+                # The filesystem doesn't support hard links
+                if os.path.exists(upload.dest_path):
+                    return False
+                os.rename(upload.part_path, upload.dest_path)
+        except (OSError, IOError, PermissionError):
+            return False
+
+        self.fix_ownership(upload.dest_path)
+        upload.delete()
+        return True
+
+    def abort(self, upload: object) -> None:
+        """Abort an upload.
+
+        Deletes the part file as well as the upload session.
+
+        Args:
+            upload (object): The upload model object.
+        """
+        try:
+            os.remove(upload.part_path)
+        except (OSError, IOError, PermissionError):
+            pass
+        upload.delete()
@@ -1,38 +1,98 @@
 from core.utils import filesystem as cpfs
+import fcntl
 import os
 from .base_service import BaseService
 
 
+class StaleFileError(Exception):
+    """Raised when the file has been changed since the version the update is based on."""
+
+    def __init__(self, etag: str):
+        super().__init__('The file has been modified since it was read.')
+        self.etag = etag
+
+
+def apply_edits(content: str, edits: list) -> str:
+    """Apply edits.
+
+    Applies a list of edits to the content. Each edit replaces `length` characters at `offset`
+    with `text`, and all of the offsets refer to the original content, so the edits can be sent
+    in any order as long as they don't overlap.
+
+    Args:
+        content (str): The original content.
+        edits (list): A list of dicts with offset, length and text keys.
+
+    Returns:
+        str: The updated content.
+
+    Raises:
+        ValueError: If an edit is out of bounds or the edits overlap.
+    """
+    edits = sorted(edits, key=lambda edit: edit.get('offset'))
+    parts = []
+    pos = 0
+    for edit in edits:
+        offset = edit.get('offset')
+        end = offset + edit.get('length')
+        if offset < pos or end > len(content):
+            raise ValueError('The edits overlap or are out of bounds.')
+        parts.append(content[pos:offset])
+        parts.append(edit.get('text'))
+        pos = end
+    parts.append(content[pos:])
+    return ''.join(parts)
+
+
 class UpdateFileService(BaseService):
     """Update file.
-    
-    This class updates a file on the disk using the provided content.
+
+    This class updates a file on the disk using the provided content, or a list of edits to the
+    current content. The new content is written to a temporary file and renamed over the original
+    one, so the file is never left half written. If the ETag of the version the changes are based
+    on is provided, the update is rejected when the file has been changed since.
     """
-    
+
     def __init__(self, request):
         self.request = request
-    
-    def update_file(self, validated_data: dict) -> bool:
+
+    def update_file(self, validated_data: dict) -> str:
         """Update file.
-        
+
         Args:
-            validated_data (dict): Serializer's validated data that contains the updated content as well as file path.
-        
+            validated_data (dict): Validated data from serializer (api.filemanager.serializers.FileUpdateSerializer)
+
         Returns:
-            bool: True if file update succeeds and False on failure.
+            str: The ETag of the updated file on success and None on failure.
+
+        Raises:
+            StaleFileError: If the file has been modified since the provided ETag.
         """
         user = self.request.user
         path = validated_data.get('path')
-        
-        if path and os.path.exists(path) and self.is_allowed(path, user):
-            try: 
-                data = validated_data.get('content')
-                with open(path, 'wb') as f:
-                    f.write(data.encode())
-                
-                self.fix_ownership(path)
-                return True
-            except UnicodeDecodeError as e:
-                pass
-        
-        return False
\ No newline at end of file
+        etag = validated_data.get('etag')
+
+        if not (path and os.path.isfile(path) and self.is_allowed(path, user)):
+            return None
+
+        try:
+            with open(path, 'rb') as f:
+                # Concurrent saves of the same file are serialized, the ones that wait
+                # see the new version once they get the lock and fail the precondition
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                stat = os.stat(path)
+                if etag and etag != cpfs.file_etag(stat):
+                    raise StaleFileError(cpfs.file_etag(stat))
+
+                edits = validated_data.get('edits')
+                if edits is not None:
+                    content = apply_edits(f.read().decode('utf-8'), edits)
+                else:
+                    content = validated_data.get('content')
+
+                # The owner and the permissions of the file are kept as they are
+                cpfs.atomic_write(path, content.encode(), mode=stat.st_mode & 0o7777,
+                                  uid=stat.st_uid, gid=stat.st_gid)
+                return cpfs.file_etag(os.stat(path))
+        except (UnicodeDecodeError, ValueError, OSError, IOError, PermissionError):
+            return None
@@ -0,0 +1,38 @@
+from django.conf import settings
+from core.utils import watchers
+from core.utils.http import async_sse_stream, sse_stream
+import os
+from .base_service import BaseService
+
+
+class WatchDirectoryService(BaseService):
+    """Watch a directory.
+
+    Streams the changes of the entries of a directory as server-sent events, so the file manager only
+    reloads a listing when something has actually changed. All of the clients watching the same
+    directory share a single watch.
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    def watch(self, validated_data: dict, asynchronous: bool = False) -> object:
+        """Watch a directory.
+
+        Args:
+            validated_data (dict): Validated data from serializer (api.filemanager.serializers.WatchDirectorySerializer)
+            asynchronous (bool): Return an async iterator, used when served over ASGI.
+
+        Returns:
+            object: An iterator of the event stream on success and None on failure.
+        """
+        user = self.request.user
+        path = os.path.realpath(validated_data.get('path'))
+
+        if not (path.startswith(os.path.join(settings.FILE_MANAGER_ROOT, ''))
+                and self.is_owner(path, user) and os.path.isdir(path)):
+            return None
+
+        subscription = watchers.watch_directory(path)
+        stream = async_sse_stream if asynchronous else sse_stream
+        return stream(subscription, keepalive=settings.FASTCP_SSE_KEEPALIVE)
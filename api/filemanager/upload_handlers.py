@@ -0,0 +1,80 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+
+from .services.base_service import BaseService
+
+
+class DestinationUploadedFile(UploadedFile):
+    """Destination uploaded file.
+
+    A file that has been streamed into a temporary file inside the destination directory. It can be
+    moved into place with a rename, no data needs to be copied.
+    """
+
+    def temporary_file_path(self):
+        """Return the full path of this file."""
+        return self.file.name
+
+    def close(self):
+        try:
+            return self.file.close()
+        except FileNotFoundError:
+            # The file was moved or deleted before the tempfile could unlink it.
+            pass
+
+
+class DestinationUploadHandler(FileUploadHandler):
+    """Destination upload handler.
+
+    Django's default handlers spool large uploads to /tmp, which often is a different filesystem,
+    and the upload service then copies every byte again to the destination. If the destination
+    directory is provided in the query string and the user is allowed to write there, this handler
+    streams the uploaded file directly into a hidden temporary file in that directory. Otherwise it
+    steps aside and the default handlers take over.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.destination = None
+        self.file = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        path = self.request.GET.get('path')
+        if (path and path.startswith(settings.FILE_MANAGER_ROOT) and os.path.isdir(path)
+                and BaseService().is_allowed(path, self.request.user)):
+            self.destination = path
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = None
+        if self.destination:
+            self.file = tempfile.NamedTemporaryFile(
+                prefix='.', suffix='.upload', dir=self.destination)
+            raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.file is None:
+            return raw_data
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        if self.file is None:
+            return None
+        self.file.flush()
+        self.file.seek(0)
+        return DestinationUploadedFile(
+            file=self.file,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra
+        )
+
+    def upload_interrupted(self):
+        if self.file is not None:
+            self.file.close()
@@ -1,28 +1,45 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.exceptions import NotFound
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from core.models import RemoteFetch
 from . import serializers
 from rest_framework.parsers import MultiPartParser
 from .services.delete_items import DeleteItemsService
 from .services.list_files import ListFileService
 from .services.extract_archive import ExtractArchiveService
 from .services.generate_archive import GenerateArchiveService
-from .services.update_file import UpdateFileService
+from .services.update_file import StaleFileError, UpdateFileService
 from .services.create_item import CreateItemService
 from .services.read_file import ReadFileService
+from .services.follow_file import FollowFileService
+from .services.watch_directory import WatchDirectoryService
 from .services.move_items import MoveDataService
-from .services.file_upload import FileUploadService
+from .services.file_upload import FetchInProgressError, FileUploadService
+from .services.resumable_upload import ResumableUploadService
 from .services.rename_item import RenameItemService
 from .services.update_permissions import UpdatePermissionService
+from .upload_handlers import DestinationUploadHandler
 
 
 class UploadFileView(APIView):
     """Upload Files.
     
-    This view allows the users to upload files using file manager or using HTTP API.
+    This view allows the users to upload files using file manager or using HTTP API. If the destination
+    path is also provided in the query string, the upload is streamed directly into the destination
+    directory instead of being spooled to /tmp first.
     """
     http_method_names = ['post']
     parser_classes = [MultiPartParser]
+
+    def initialize_request(self, request, *args, **kwargs):
+        """Upload handlers can only be changed before the request body is parsed."""
+        request.upload_handlers.insert(0, DestinationUploadHandler(request))
+        return super().initialize_request(request, *args, **kwargs)
     
     def post(self, request, *args, **kwargss):
         """Handle file upload"""
@@ -39,6 +56,126 @@ class UploadFileView(APIView):
                 'error': 'File cannot be uploaded to the specified location.'
             }, status=status.HTTP_400_BAD_REQUEST)
 
+class CreateUploadView(APIView):
+    """Create Upload.
+
+    This view starts a resumable upload session. The file content is then sent in chunks to the
+    upload session view.
+    """
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        """Create an upload session"""
+        s = serializers.UploadCreateSerializer(data=request.data)
+        if not s.is_valid():
+            return Response(s.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        upload = ResumableUploadService(request).create_upload(s.validated_data)
+        if upload:
+            location = reverse('api:filemanager:upload', kwargs={'upload_id': upload.pk})
+            return Response({
+                'id': upload.pk,
+                'offset': upload.offset,
+                'size': upload.size
+            }, status=status.HTTP_201_CREATED, headers={'Location': location})
+        else:
+            return Response({
+                'error': 'Upload cannot be started at the specified location.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+
+class UploadView(APIView):
+    """Upload Session.
+
+    This view receives the chunks of a resumable upload. Every chunk is sent as the raw body of a
+    PATCH request with its position in the Upload-Offset header, so chunks can be sent in parallel.
+    A HEAD request returns the number of contiguous bytes received so far, which is the offset an
+    interrupted upload should resume from.
+    """
+    http_method_names = ['head', 'get', 'patch', 'delete']
+
+    def get_upload(self, request, upload_id):
+        upload = ResumableUploadService(request).get_upload(upload_id)
+        if not upload:
+            raise NotFound('The upload session was not found.')
+        return upload
+
+    def upload_headers(self, upload):
+        return {
+            'Upload-Offset': str(upload.offset),
+            'Upload-Length': str(upload.size),
+            'Cache-Control': 'no-store'
+        }
+
+    def head(self, request, *args, **kwargs):
+        """Get the upload offset"""
+        upload = self.get_upload(request, kwargs.get('upload_id'))
+        return Response(headers=self.upload_headers(upload))
+
+    def get(self, request, *args, **kwargs):
+        """Get the upload status along with the received ranges"""
+        upload = self.get_upload(request, kwargs.get('upload_id'))
+        return Response({
+            'id': upload.pk,
+            'offset': upload.offset,
+            'size': upload.size,
+            'ranges': upload.ranges
+        }, headers=self.upload_headers(upload))
+
+    def patch(self, request, *args, **kwargs):
+        """Write a chunk"""
+        upload = self.get_upload(request, kwargs.get('upload_id'))
+        try:
+            offset = int(request.headers.get('Upload-Offset'))
+            length = int(request.headers.get('Content-Length'))
+        except (TypeError, ValueError):
+            return Response({
+                'error': 'Upload-Offset and Content-Length headers are required.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        upload = ResumableUploadService(request).write_chunk(upload, offset, request.stream, length)
+        if upload:
+            return Response(status=status.HTTP_204_NO_CONTENT, headers=self.upload_headers(upload))
+        else:
+            return Response({
+                'error': 'The chunk cannot be written.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+    def delete(self, request, *args, **kwargs):
+        """Abort the upload"""
+        upload = self.get_upload(request, kwargs.get('upload_id'))
+        ResumableUploadService(request).abort(upload)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class FinalizeUploadView(APIView):
+    """Finalize Upload.
+
+    This view verifies a completed upload and moves the file into place.
+    """
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        """Finalize the upload"""
+        s = serializers.UploadFinalizeSerializer(data=request.data)
+        if not s.is_valid():
+            return Response(s.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        service = ResumableUploadService(request)
+        upload = service.get_upload(kwargs.get('upload_id'))
+        if not upload:
+            raise NotFound('The upload session was not found.')
+
+        if service.finalize(upload, s.validated_data):
+            return Response({
+                'message': 'File has been successfully uploaded.'
+            })
+        else:
+            return Response({
+                'error': 'The upload is incomplete, the checksum does not match or the file already exists.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+
 class RemoteUpload(APIView):
     """Remote Upload.
     
@@ -52,16 +189,50 @@ class RemoteUpload(APIView):
         if not s.is_valid():
             return Response(s.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
         
-        if FileUploadService(request).remote_upload(s.validated_data):
+        try:
+            fetch = FileUploadService(request).remote_upload(s.validated_data)
+        except FetchInProgressError as e:
             return Response({
-                'message': 'File has been successfully fetched.'
-            })
+                'error': str(e),
+                'id': e.fetch.pk
+            }, status=status.HTTP_409_CONFLICT)
+        if fetch:
+            return Response({
+                'message': 'File is being fetched.',
+                'id': fetch.pk
+            }, status=status.HTTP_202_ACCEPTED)
         else:
             return Response({
                 'error': 'File cannot be fetched to the specified location.'
             }, status=status.HTTP_400_BAD_REQUEST)
 
 
+class RemoteFetchView(APIView):
+    """Remote Fetch.
+    
+    Returns the progress of a remote fetch.
+    """
+    http_method_names = ['get']
+    
+    def get(self, request, *args, **kwargs):
+        fetches = RemoteFetch.objects.filter(pk=kwargs.get('fetch_id'))
+        if not request.user.is_superuser:
+            fetches = fetches.filter(user=request.user)
+        fetch = fetches.first()
+        if not fetch:
+            raise NotFound('The remote fetch was not found.')
+        
+        return Response({
+            'id': fetch.pk,
+            'url': fetch.url,
+            'path': fetch.dest_path,
+            'status': fetch.status,
+            'size': fetch.size,
+            'received': fetch.received,
+            'error': fetch.error
+        })
+
+
 class MoveItemsView(APIView):
     """Move Items.
     
@@ -94,17 +265,26 @@ class FileObjectView(APIView):
     def get(self, request, *args, **kwargs):
         """Read a file.
         
-        This method attempts to read the contents of a file from the disk and returns the content.
+        This method attempts to read the contents of a file from the disk and returns the content. Large
+        files can be read in windows, see api.filemanager.serializers.ReadFileSerializer.
         """
         s = serializers.ReadFileSerializer(data=request.GET)
         if not s.is_valid():
             return Response(s.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
         
-        content = ReadFileService(request).read_file(s.validated_data)
-        if content is not None:
-            return Response({
-                'content': content
-            })
+        service = ReadFileService(request)
+        if service.is_window(s.validated_data):
+            window = service.read_window(s.validated_data)
+            if window is not None:
+                return Response(window)
+            else:
+                return Response({
+                    'content': 'File not available for reading.'
+                }, status=status.HTTP_400_BAD_REQUEST)
+        
+        data = service.read_file(s.validated_data)
+        if data is not None:
+            return Response(data, headers={'ETag': data.get('etag')})
         else:
             return Response({
                 'content': 'File not available for editing.'
@@ -132,22 +312,109 @@ class FileObjectView(APIView):
     def put(self, request, *args, **kwargs):
         """Update File
         
-        This method attempts to update the contents of a file on the disk.
+        This method attempts to update the contents of a file on the disk. The ETag of the version
+        that was edited can be sent in the etag field or in the If-Match header, and the update is
+        rejected with 412 if the file has been changed since.
         """
-        s = serializers.FileUpdateSerializer(data=request.POST)
+        data = request.data.copy()
+        if 'etag' not in data and request.headers.get('If-Match'):
+            data['etag'] = request.headers.get('If-Match')
+        s = serializers.FileUpdateSerializer(data=data)
         if not s.is_valid():
             return Response(s.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
         
-        if UpdateFileService(request).update_file(s.validated_data):
+        try:
+            etag = UpdateFileService(request).update_file(s.validated_data)
+        except StaleFileError as e:
             return Response({
-                'message': 'File has been updated.'
-            })
+                'error': 'The file has been modified since it was opened.',
+                'etag': e.etag
+            }, status=status.HTTP_412_PRECONDITION_FAILED)
+        
+        if etag:
+            return Response({
+                'message': 'File has been updated.',
+                'etag': etag
+            }, headers={'ETag': etag})
         else:
             return Response({
                 'content': 'File cannot be updated.'
             }, status=status.HTTP_400_BAD_REQUEST)
 
 
+def event_stream_response(stream) -> StreamingHttpResponse:
+    """Wrap an event stream in a response that proxies don't buffer or cache."""
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class FollowFileView(APIView):
+    """Follow File.
+    
+    Streams the lines appended to a file as server-sent events. Log rotation is followed, and a
+    rotate or truncate event is sent when the file is replaced or truncated.
+    """
+    http_method_names = ['get']
+    
+    def get(self, request, *args, **kwargs):
+        s = serializers.FollowFileSerializer(data=request.GET)
+        if not s.is_valid():
+            return Response(s.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        
+        # Under ASGI, the stream waits on the event loop instead of holding a thread. Under WSGI, it
+        # holds a worker, so it's ended before the worker times out and the client reconnects
+        asynchronous = isinstance(request._request, ASGIRequest)
+        # A client that reconnects resumes from the offset of the last lines it got
+        last_event_id = request.META.get('HTTP_LAST_EVENT_ID', '')
+        stream = FollowFileService(request).follow(
+            s.validated_data, asynchronous=asynchronous,
+            max_duration=None if asynchronous else settings.FASTCP_SSE_WSGI_MAX_DURATION,
+            offset=int(last_event_id) if last_event_id.isdigit() else None)
+        if stream is None:
+            return Response({
+                'error': 'File not available for following.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        return event_stream_response(stream)
+
+
+class WatchDirectoryView(APIView):
+    """Watch Directory.
+    
+    Streams the changes of a directory as server-sent events: an entry was added, removed or modified,
+    the directory itself is gone, or changes were missed (overflow) and the listing should be reloaded.
+    Only available under ASGI, every open file manager would hold a WSGI worker otherwise. A HEAD request
+    tells the client whether the streams are served without opening one.
+    """
+    http_method_names = ['get', 'head']
+    
+    def head(self, request, *args, **kwargs):
+        if not isinstance(request._request, ASGIRequest):
+            return self.unsupported()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    def get(self, request, *args, **kwargs):
+        if not isinstance(request._request, ASGIRequest):
+            return self.unsupported()
+
+        s = serializers.WatchDirectorySerializer(data=request.GET)
+        if not s.is_valid():
+            return Response(s.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        
+        stream = WatchDirectoryService(request).watch(s.validated_data, asynchronous=True)
+        if stream is None:
+            return Response({
+                'error': 'Directory not available for watching.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        return event_stream_response(stream)
+    
+    def unsupported(self):
+        return Response({
+            'error': 'Watching directories requires the ASGI server.'
+        }, status=status.HTTP_501_NOT_IMPLEMENTED)
+
+
 class GenerateArchiveView(APIView):
     """Generate Archive
     
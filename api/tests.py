@@ -1,3 +1,531 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core.models import Database, Domain, Provisioning, RemoteFetch, User, Website
+from core.tests import make_certificate
+from core.utils import reloads, watchers
+from core.utils.filesystem import get_website_paths
+
+from .filemanager.services.follow_file import FollowFileService
+from .filemanager.services.file_upload import FetchInProgressError, FileUploadService
+from .filemanager.services.resumable_upload import merge_range
+from .filemanager.services.update_file import apply_edits
+from .filemanager.views import WatchDirectoryView
+from .websites.services.bulk_create import read_manifest
+from .websites.services.renewal import UNRESOLVED_ERROR, OrderLimiter, RenewalEngine
+from .websites.services.ssl import FastcpSsl
+from .websites.views import BulkCreateView, CacheSettingsView, FpmProfileView, OpcacheSettingsView, ServingModeView
+
+
+class TestResumableUpload(SimpleTestCase):
+
+    def test_merge_range(self):
+        ranges = merge_range([], 10, 20)
+        self.assertEqual(ranges, [[10, 20]])
+        ranges = merge_range(ranges, 30, 40)
+        self.assertEqual(ranges, [[10, 20], [30, 40]])
+        ranges = merge_range(ranges, 0, 10)
+        self.assertEqual(ranges, [[0, 20], [30, 40]])
+        ranges = merge_range(ranges, 15, 35)
+        self.assertEqual(ranges, [[0, 40]])
+
+
+class TestUpdateFile(SimpleTestCase):
+
+    def test_apply_edits(self):
+        content = 'first line\nsecond line\nthird line\n'
+        edits = [
+            {'offset': 23, 'length': 5, 'text': '3rd'},
+            {'offset': 0, 'length': 5, 'text': '1st'},
+            {'offset': 11, 'length': 0, 'text': 'new line\n'},
+        ]
+        self.assertEqual(apply_edits(content, edits), '1st line\nnew line\nsecond line\n3rd line\n')
+        with self.assertRaises(ValueError):
+            apply_edits(content, [{'offset': 0, 'length': 10, 'text': ''}, {'offset': 5, 'length': 1, 'text': ''}])
+        with self.assertRaises(ValueError):
+            apply_edits(content, [{'offset': 30, 'length': 10, 'text': ''}])
+
+
+class TestEventStreams(SimpleTestCase):
+
+    def test_watch_requires_asgi(self):
+        # A WSGI worker would be held for as long as the file manager is open
+        request = APIRequestFactory().get('/api/file-manager/watch-directory/', {'path': '/'})
+        force_authenticate(request, user=User(username='watcher'))
+        response = WatchDirectoryView.as_view()(request)
+        self.assertEqual(response.status_code, 501)
+
+        # The file manager asks before opening the stream and keeps refreshing on visibility
+        request = APIRequestFactory().head('/api/file-manager/watch-directory/')
+        force_authenticate(request, user=User(username='watcher'))
+        response = WatchDirectoryView.as_view()(request)
+        self.assertEqual(response.status_code, 501)
+
+    def test_follow_resume(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'access.log')
+        with open(path, 'w') as f:
+            f.write('line 1\nline 2\n')
+
+        service = FollowFileService(mock.Mock(user=User(username='follower')))
+        watcher = watchers.Watcher(poll_interval=0.05, polling=True)
+        with mock.patch.object(service, 'is_allowed', return_value=True), \
+                mock.patch('core.utils.watchers.get_watcher', return_value=watcher):
+            chunks = list(service.follow({'path': path, 'lines': 1}, max_duration=0.2))
+            self.assertEqual(chunks[0], 'id: 14\n\n')
+            self.assertEqual(chunks[1], 'event: lines\ndata: ["line 2"]\n\n')
+            self.assertEqual(chunks[-1], 'id: 14\nevent: reconnect\ndata: null\n\n')
+
+            # Written while the client reconnects, nobody follows the file
+            with open(path, 'a') as f:
+                f.write('line 3\n')
+            chunks = list(service.follow({'path': path, 'lines': 1}, max_duration=0.2, offset=14))
+            self.assertEqual(chunks[:2], ['id: 21\n\n', 'event: lines\ndata: ["line 3"]\n\n'])
+
+    def test_follow_symlink(self):
+        tmp_dir = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        target = os.path.join(tmp_dir, 'other.log')
+        open(target, 'w').close()
+        link = os.path.join(tmp_dir, 'access.log')
+        os.symlink(target, link)
+
+        # The link is allowed, the file it points to isn't
+        service = FollowFileService(mock.Mock(user=User(username='follower')))
+        with mock.patch.object(service, 'is_allowed', side_effect=lambda path, user: path == link) as is_allowed:
+            self.assertIsNone(service.follow({'path': link, 'lines': 0}))
+        is_allowed.assert_called_once_with(target, service.request.user)
+
+
+
+class TestRemoteFetch(TestCase):
+
+    def test_one_active_fetch_per_file(self):
+        user = User.objects.create(username='fetcher')
+        request = mock.Mock(user=user)
+        data = {'path': '/srv/users/fetcher/apps/site/public', 'remote_url': 'https://example.com/backup.zip',
+                'algorithm': 'sha256'}
+        service = FileUploadService(request)
+        with mock.patch.object(service, 'is_allowed', return_value=True), \
+                mock.patch('api.filemanager.services.file_upload.run_in_background') as run_in_background:
+            fetch = service.remote_upload(data)
+            # Both would write to the same part file
+            with self.assertRaises(FetchInProgressError) as cm:
+                service.remote_upload(data)
+            self.assertEqual(cm.exception.fetch.pk, fetch.pk)
+
+            # The worker was restarted before the fetch started, it's failed and replaced
+            RemoteFetch.objects.filter(pk=fetch.pk).update(updated=timezone.now() - timedelta(hours=1))
+            second = service.remote_upload(data)
+            self.assertNotEqual(second.pk, fetch.pk)
+            fetch.refresh_from_db()
+            self.assertEqual((fetch.status, fetch.active_key), ('failed', None))
+
+            # Once a fetch has ended, the destination can be fetched again
+            with mock.patch('api.filemanager.services.file_upload.Downloader') as downloader:
+                downloader.return_value.size = downloader.return_value.received = 10
+                with mock.patch.object(service, 'fix_ownership'):
+                    self.assertTrue(service.fetch_remote(second.pk))
+            self.assertIsNotNone(service.remote_upload(data))
+            self.assertEqual(run_in_background.call_count, 3)
+
+class TestBulkCreate(SimpleTestCase):
+
+    def test_read_manifest(self):
+        websites = read_manifest(
+            'owner,label,domains,php,wordpress\n'
+            'alice,shop,shop.test;www.shop.test,8.1,yes\n'
+            'bob,blog,blog.test,8.2,\n', 'csv')
+        self.assertEqual(websites, [
+            {'owner': 'alice', 'label': 'shop', 'domains': ['shop.test', 'www.shop.test'], 'php': '8.1', 'wordpress': 'yes'},
+            {'owner': 'bob', 'label': 'blog', 'domains': ['blog.test'], 'php': '8.2', 'wordpress': False},
+        ])
+        websites = read_manifest('{"websites": [{"owner": "bob", "label": "blog", "domains": "blog.test,www.blog.test"}]}', 'json')
+        self.assertEqual(websites[0]['domains'], ['blog.test', 'www.blog.test'])
+        with self.assertRaises(ValueError):
+            read_manifest('owner,label\nbob,blog\n', 'csv')
+
+
+@mock.patch('api.websites.serializers.PhpVersionListService', **{'return_value.get_php_versions.return_value': ['8.2']})
+class TestBulkCreateView(TestCase):
+
+    def setUp(self) -> None:
+        self.admin = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        self.owner = User.objects.create(username='bob', max_sites=3)
+        website = Website(user=self.owner, label='shop', php='8.2')
+        website.defer_setup = True
+        website.save()
+        Domain.objects.create(website=website, domain='shop.test')
+        Database.objects.create(user=self.owner, name='wp_db', username='wp_user')
+
+    def post(self, data, format='json'):
+        request = APIRequestFactory().post('/api/websites/bulk-create/', data, format=format)
+        force_authenticate(request, user=self.admin)
+        return BulkCreateView.as_view()(request)
+
+    def test_create(self, php_versions):
+        websites = [
+            {'owner': 'bob', 'label': 'shop!', 'domains': ['new.shop.test'], 'php': '8.2', 'wordpress': True},
+            {'owner': 'bob', 'label': 'shop?', 'domains': ['blog.test', 'www.blog.test'], 'php': '8.2'},
+        ]
+        with mock.patch('core.utils.system.run_in_background') as run_in_background, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.post({'websites': websites})
+            # Nothing is set up before the rows are committed
+            run_in_background.assert_not_called()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['provisionings']), 2)
+        # Unique slugs and database names, within the batch too
+        created = Website.objects.filter(label__in=['shop!', 'shop?']).order_by('label')
+        self.assertEqual([website.slug for website in created], ['shop-1', 'shop-2'])
+        self.assertEqual(sorted(created[1].domains.values_list('domain', flat=True)), ['blog.test', 'www.blog.test'])
+        self.assertTrue(created[0].is_wp)
+        database = Database.objects.get(name='wp_db0')
+        self.assertEqual((database.username, database.user), ('wp_user0', self.owner))
+        self.assertEqual(Provisioning.objects.filter(website__in=created).count(), 2)
+        # All of the websites are provisioned as one pipeline
+        run_in_background.assert_called_once()
+        self.assertEqual(len(run_in_background.call_args.args[1]), 2)
+
+    def test_rejected(self, php_versions):
+        websites = [
+            {'owner': 'bob', 'label': 'shop', 'domains': ['shop.test'], 'php': '8.2'},
+            {'owner': 'bob', 'label': 'one', 'domains': ['one.test'], 'php': '8.2'},
+            {'owner': 'bob', 'label': 'two', 'domains': ['two.test'], 'php': '8.2'},
+            {'owner': 'carol', 'label': 'three', 'domains': ['two.test'], 'php': '7.4'},
+        ]
+        with mock.patch('core.utils.system.run_in_background') as run_in_background, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.post({'websites': websites})
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.data['websites'][3]['php'], ['PHP 7.4 is not installed.'])
+
+        websites[3]['php'] = '8.2'
+        with mock.patch('core.utils.system.run_in_background') as run_in_background, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.post({'websites': websites})
+
+        # Every problem of the manifest is reported at once and nothing is created
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(sorted(response.data['websites']), sorted([
+            'The domain two.test is used more than once.',
+            'A website with the label shop already exists.',
+            'shop.test already exists in the database.',
+            'The SSH user carol does not exist or cannot own websites.',
+            'The allowed quota limit of 3 websites of bob would be exceeded.',
+        ]))
+        self.assertEqual(Website.objects.count(), 1)
+        self.assertFalse(Provisioning.objects.exists())
+        run_in_background.assert_not_called()
+
+    def test_invalid_manifest(self, php_versions):
+        manifest = SimpleUploadedFile('websites.csv', b'owner,label\nbob,blog\n', content_type='text/csv')
+        response = self.post({'manifest': manifest}, format='multipart')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.data['manifest'], ['The CSV manifest is missing the columns: domains, php, wordpress.'])
+        self.assertEqual(Website.objects.count(), 1)
+
+
+class TestDomainVerification(SimpleTestCase):
+
+    @override_settings(FASTCP_SSL_VERIFY_WORKERS=8, FASTCP_SSL_VERIFY_DEADLINE=0.5)
+    def test_verify_domains(self):
+        def is_resolving(domain, timeout):
+            # The probes of domains that don't resolve yet hang until they time out
+            time.sleep(timeout if domain.startswith('pending') else 0.1)
+            return not domain.startswith('pending')
+
+        domains = [f'site{i}.test' for i in range(16)] + ['pending.test']
+        website = mock.Mock()
+        website.domains.all.return_value = [mock.Mock(domain=domain) for domain in domains]
+        fcp = FastcpSsl.__new__(FastcpSsl)
+        with mock.patch.object(fcp, 'is_resolving', side_effect=is_resolving):
+            started = time.monotonic()
+            verified = fcp._verify_domains(website)
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(verified, domains[:-1])
+        self.assertLess(elapsed, 1)
+
+
+
+class TestWebsiteSettings(TestCase):
+
+    def test_serving_mode_rolled_back(self):
+        user = User.objects.create(username='serving', is_superuser=True)
+        website = Website(user=user, label='serving', php='8.2')
+        website.defer_setup = True
+        website.save()
+
+        request = APIRequestFactory().post(f'/api/websites/{website.pk}/serving-mode/', {'serving_mode': 'nginx'})
+        force_authenticate(request, user=user)
+        with mock.patch('api.websites.views.filesystem') as filesystem:
+            filesystem.create_apache_vhost.return_value = True
+            filesystem.create_nginx_vhost.side_effect = [False, True]
+            response = ServingModeView.as_view()(request, id=website.pk)
+
+        # The Apache vhost that was already removed is written again
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Website.objects.get(pk=website.pk).serving_mode, 'apache')
+        self.assertEqual(filesystem.create_apache_vhost.call_args.args[0].serving_mode, 'apache')
+        self.assertEqual(filesystem.create_nginx_vhost.call_count, 2)
+
+    def test_fpm_profile_rolled_back(self):
+        user = User.objects.create(username='profile', is_superuser=True)
+        website = Website(user=user, label='profile', php='8.2')
+        website.defer_setup = True
+        website.save()
+        profile = website.fpm_profile
+
+        request = APIRequestFactory().post(f'/api/websites/{website.pk}/fpm-profile/', {'fpm_profile': 'static', 'fpm_max_children': 8})
+        force_authenticate(request, user=user)
+        with mock.patch('api.websites.views.filesystem') as filesystem:
+            filesystem.generate_fpm_conf.side_effect = [False, True]
+            response = FpmProfileView.as_view()(request, id=website.pk)
+
+        # The previous pool is written again, and the next regeneration doesn't write the new one
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Website.objects.get(pk=website.pk).fpm_profile, profile)
+        self.assertEqual(filesystem.generate_fpm_conf.call_count, 2)
+
+    def test_rejected_config_rolled_back(self):
+        user = User.objects.create(username='rejected', is_superuser=True)
+        website = Website(user=user, label='rejected', php='8.2')
+        website.defer_setup = True
+        website.save()
+
+        def generate_fpm_conf(website):
+            reloads.scheduler.schedule(['php8.2-fpm'], 'reload')
+            return True
+
+        request = APIRequestFactory().post(f'/api/websites/{website.pk}/fpm-profile/', {'fpm_idle_timeout': 30})
+        force_authenticate(request, user=user)
+        with mock.patch('api.websites.views.filesystem') as filesystem, \
+                mock.patch.object(reloads.scheduler, 'validate', side_effect=[False, True]), \
+                mock.patch.object(reloads.scheduler, 'run', return_value=True) as run:
+            filesystem.generate_fpm_conf.side_effect = generate_fpm_conf
+            response = FpmProfileView.as_view()(request, id=website.pk)
+
+        # The pool was written but php-fpm -t failed, the settings are rolled back before responding
+        self.assertEqual(response.status_code, 400)
+        self.assertNotEqual(Website.objects.get(pk=website.pk).fpm_idle_timeout, 30)
+        self.assertEqual(filesystem.generate_fpm_conf.call_count, 2)
+        run.assert_called_once_with('php8.2-fpm', 'reload')
+
+    def test_cache_settings_rolled_back(self):
+        user = User.objects.create(username='cache', is_superuser=True)
+        website = Website(user=user, label='cache', php='8.2')
+        website.defer_setup = True
+        website.save()
+
+        request = APIRequestFactory().post(f'/api/websites/{website.pk}/cache/', {'cache_mode': 'full'})
+        force_authenticate(request, user=user)
+        with mock.patch('api.websites.views.filesystem') as filesystem:
+            filesystem.create_nginx_vhost.side_effect = [False, True]
+            response = CacheSettingsView.as_view()(request, id=website.pk)
+
+        self.assertEqual(response.status_code, 400)
+        website.refresh_from_db()
+        self.assertEqual(website.cache_mode, 'off')
+        self.assertEqual(filesystem.create_nginx_vhost.call_count, 2)
+
+    def test_opcache_settings_rolled_back(self):
+        user = User.objects.create(username='opcache', is_superuser=True)
+        website = Website(user=user, label='opcache', php='8.2')
+        website.defer_setup = True
+        website.save()
+
+        def generate_fpm_conf(website):
+            reloads.scheduler.schedule(['php8.2-fpm'], 'reload')
+            return True
+
+        request = APIRequestFactory().post(f'/api/websites/{website.pk}/opcache/', {'opcache_memory': 256})
+        force_authenticate(request, user=user)
+        with mock.patch('api.websites.views.filesystem') as filesystem, \
+                mock.patch.object(reloads.scheduler, 'validate', return_value=True), \
+                mock.patch.object(reloads.scheduler, 'run', side_effect=[False, True]) as run:
+            filesystem.generate_fpm_conf.side_effect = generate_fpm_conf
+            response = OpcacheSettingsView.as_view()(request, id=website.pk)
+
+        # PHP-FPM failed to reload with the new OPcache config, the previous one is written and loaded again
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Website.objects.get(pk=website.pk).opcache_memory, 64)
+        self.assertEqual(filesystem.generate_fpm_conf.call_args.args[0].opcache_memory, 64)
+        self.assertEqual(run.call_count, 2)
+
+    def test_opcache_preload_rejected(self):
+        user = User.objects.create(username='preload', is_superuser=True)
+        for label in ['preload', 'other']:
+            website = Website(user=user, label=label, php='8.2')
+            website.defer_setup = True
+            website.save()
+
+        request = APIRequestFactory().post(f'/api/websites/{website.pk}/opcache/', {'opcache_preload': True})
+        force_authenticate(request, user=user)
+        with mock.patch('api.websites.views.filesystem') as filesystem:
+            response = OpcacheSettingsView.as_view()(request, id=website.pk)
+
+        # The OPcache of a version is shared, the scripts of one website would be preloaded into the others
+        self.assertEqual(response.status_code, 422)
+        self.assertIn('opcache_preload', response.data)
+        self.assertFalse(Website.objects.get(pk=website.pk).opcache_preload)
+        filesystem.generate_fpm_conf.assert_not_called()
+
+
+class TestRenewalEngine(TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        settings = override_settings(NGINX_BASE_DIR=self.tmp_dir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        user = User.objects.create(username='renewal')
+        for label in ['alpha', 'beta', 'gamma', 'pending']:
+            website = Website(user=user, label=label, php='8.2')
+            website.defer_setup = True
+            website.save()
+            Domain.objects.create(website=website, domain=f'{label}.test')
+
+    def test_run(self):
+        def issue(website, domains, acme):
+            # Waiting for Let's Encrypt to validate the challenges
+            time.sleep(0.3)
+            ssl_base = get_website_paths(website).get('ssl_base')
+            os.makedirs(ssl_base)
+            with open(os.path.join(ssl_base, 'cert.chain'), 'wb') as f:
+                f.write(make_certificate(domains, 90))
+            return True
+
+        fcp = mock.Mock()
+        fcp._verify_domains.side_effect = lambda website, domains: [
+            domain for domain in domains if not domain.startswith('pending')]
+        fcp.issue.side_effect = issue
+        limit_path = os.path.join(self.tmp_dir, 'order_limit')
+        with mock.patch('api.websites.services.renewal.FastcpSsl', return_value=fcp), \
+                mock.patch('api.websites.services.renewal.FCP_ORDER_LIMIT_PATH', limit_path), \
+                mock.patch('api.websites.services.renewal.domains_updated') as domains_updated, \
+                mock.patch.object(reloads.scheduler, 'run', return_value=True) as run:
+            started = time.monotonic()
+            report = RenewalEngine(workers=4, orders=2).run()
+            elapsed = time.monotonic() - started
+
+        # One shared ACME client, two orders under the limit and one deferred to the next pass
+        fcp.get_acme.assert_called_once_with(pool_size=4)
+        self.assertEqual(len(report['activated']), 2)
+        self.assertEqual(len(report['deferred']), 1)
+        self.assertEqual([website.label for website in report['unverified']], ['pending'])
+        self.assertEqual(domains_updated.send.call_count, 2)
+        # The vhosts are left unchanged, NGINX is still reloaded once to load the new certificates
+        self.assertEqual(report['reloaded'], {'nginx': True})
+        run.assert_called_once_with('nginx', 'reload')
+        self.assertLess(elapsed, 0.6)
+
+        self.assertEqual(Website.objects.filter(has_ssl=True, ssl_not_after__isnull=False).count(), 2)
+        self.assertEqual(Domain.objects.filter(ssl=True, ssl_attempted__isnull=False).count(), 2)
+        for website in report['activated']:
+            # Renewed at a random point of the first two thirds of the last 30 days
+            self.assertLessEqual(website.ssl_not_after - website.ssl_renew_at, timedelta(days=30))
+            self.assertGreaterEqual(website.ssl_not_after - website.ssl_renew_at, timedelta(days=10))
+
+        # The domain that doesn't resolve backs off
+        pending = Domain.objects.get(domain='pending.test')
+        self.assertEqual(pending.ssl_retries, 1)
+        self.assertEqual(pending.ssl_error, UNRESOLVED_ERROR)
+        self.assertGreater(pending.ssl_next_attempt, timezone.now() + timedelta(minutes=4))
+
+        # Only the deferred website is due for the next pass, and the account has no orders left
+        engine = RenewalEngine(orders=2)
+        self.assertEqual(list(engine.due_websites()), report['deferred'])
+        self.assertLess(OrderLimiter.load(limit_path, 2, engine.window).tokens, 1)
+
+    def test_renewal_keeps_covered_domains(self):
+        website = Website.objects.get(label='alpha')
+        Domain.objects.create(website=website, domain='www.alpha.test')
+        Website.objects.filter(pk=website.pk).update(has_ssl=True, ssl_renew_at=timezone.now() - timedelta(hours=1))
+        # Both domains are on the certificate, one failed a probe of an earlier renewal attempt
+        Domain.objects.filter(website=website).update(ssl=True)
+        Domain.objects.filter(domain='www.alpha.test').update(
+            ssl_retries=1, ssl_next_attempt=timezone.now() + timedelta(hours=1))
+        Website.objects.exclude(pk=website.pk).delete()
+
+        def issue(website, domains, acme):
+            ssl_base = get_website_paths(website).get('ssl_base')
+            os.makedirs(ssl_base, exist_ok=True)
+            with open(os.path.join(ssl_base, 'cert.chain'), 'wb') as f:
+                f.write(make_certificate(domains, 90))
+            return True
+
+        fcp = mock.Mock()
+        fcp._verify_domains.side_effect = lambda website, domains: domains
+        fcp.issue.side_effect = issue
+        with mock.patch('api.websites.services.renewal.FastcpSsl', return_value=fcp), \
+                mock.patch('api.websites.services.renewal.FCP_ORDER_LIMIT_PATH', os.path.join(self.tmp_dir, 'limit')), \
+                mock.patch('api.websites.services.renewal.domains_updated'), \
+                mock.patch.object(reloads.scheduler, 'run', return_value=True):
+            report = RenewalEngine().run()
+
+        # The backing off domain is renewed too rather than dropped from the certificate
+        self.assertEqual(len(report['activated']), 1)
+        self.assertEqual(sorted(fcp.issue.call_args.args[1]), ['alpha.test', 'www.alpha.test'])
+        domain = Domain.objects.get(domain='www.alpha.test')
+        self.assertTrue(domain.ssl)
+        self.assertEqual(domain.ssl_retries, 0)
+
+    def test_failed_orders_back_off(self):
+        Website.objects.filter(label__in=['gamma', 'pending']).delete()
+
+        def issue(website, domains, acme):
+            if website.label == 'alpha':
+                raise Exception('The order is invalid.')
+            return False
+
+        fcp = mock.Mock()
+        fcp._verify_domains.side_effect = lambda website, domains: domains
+        fcp.issue.side_effect = issue
+        with mock.patch('api.websites.services.renewal.FastcpSsl', return_value=fcp), \
+                mock.patch('api.websites.services.renewal.FCP_ORDER_LIMIT_PATH', os.path.join(self.tmp_dir, 'limit')), \
+                mock.patch('api.websites.services.renewal.domains_updated') as domains_updated, \
+                mock.patch.object(reloads.scheduler, 'run', return_value=True) as run:
+            report = RenewalEngine().run()
+
+        # Nothing changed, so neither the vhosts nor NGINX are touched
+        self.assertEqual(len(report['failed']), 2)
+        self.assertEqual(sorted(report['errors']), sorted([
+            'alpha: The order is invalid.', 'beta: The certificate cannot be finalized.']))
+        self.assertEqual(report['reloaded'], {})
+        domains_updated.send.assert_not_called()
+        run.assert_not_called()
+        self.assertFalse(Website.objects.filter(has_ssl=True).exists())
+
+        alpha = Domain.objects.get(domain='alpha.test')
+        self.assertEqual((alpha.ssl, alpha.ssl_retries, alpha.ssl_error), (False, 1, 'The order is invalid.'))
+        self.assertGreater(alpha.ssl_next_attempt, timezone.now())
+        self.assertEqual(Domain.objects.get(domain='beta.test').ssl_error, 'The certificate cannot be finalized.')
+        # Both are put off until their backoff is over
+        self.assertEqual(list(RenewalEngine().due_websites()), [])
+
+    def test_acme_client_unavailable(self):
+        fcp = mock.Mock()
+        fcp.get_acme.side_effect = Exception('The directory cannot be reached.')
+        with mock.patch('api.websites.services.renewal.FastcpSsl', return_value=fcp), \
+                mock.patch('api.websites.services.renewal.FCP_ORDER_LIMIT_PATH', os.path.join(self.tmp_dir, 'limit')):
+            report = RenewalEngine().run()
+
+        # No domain was attempted, so none of them backs off
+        self.assertEqual(report['errors'], ['The ACME client cannot be created: The directory cannot be reached.'])
+        fcp._verify_domains.assert_not_called()
+        self.assertFalse(Domain.objects.filter(ssl_retries__gt=0).exists())
+        self.assertEqual(len(RenewalEngine().due_websites()), 4)
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from core.models import User
 from core.signals import create_user
+from core.utils import object_cache
 
 
 # Disallow some system usernames
@@ -13,7 +14,7 @@ class UserSearilizer(serializers.ModelSerializer):
     """
     class Meta:
         model = User
-        fields = ['id', 'username', 'date_joined', 'total_dbs', 'uid', 'is_active', 'total_sites', 'max_storage', 'storage_used', 'max_dbs', 'max_sites']
+        fields = ['id', 'username', 'date_joined', 'total_dbs', 'uid', 'is_active', 'total_sites', 'max_storage', 'storage_used', 'max_dbs', 'max_sites', 'max_object_cache_memory']
         read_only_fields = ['id', 'date_joined', 'total_dbs', 'uid', 'storage_used', 'total_sites']
     
     
@@ -28,4 +29,14 @@ class UserSearilizer(serializers.ModelSerializer):
         request = self.context['request']
         user = User.objects.create(**validated_data)
         create_user.send(sender=user, password=request.POST.get('password'))
-        return user
\ No newline at end of file
+        return user
+    
+    def update(self, instance, validated_data):
+        """Update user"""
+        memory = instance.max_object_cache_memory
+        user = super().update(instance, validated_data)
+        # The object caches of the websites are restarted with the new limit
+        if user.max_object_cache_memory != memory:
+            for website in user.websites.exclude(object_cache='off'):
+                object_cache.enable(website)
+        return user
@@ -1,17 +1,99 @@
 from rest_framework import serializers
-from core.models import Website, Domain, Database
+from core.models import Website, Domain, Database, Provisioning
 import validators
-from core import signals
 from core.models import User
-from core.utils import system
-from django.db.models import Q
+from core.utils import opcache, system
+from django.db.models import Count, Q
+from .services.get_php_versions import PhpVersionListService
 
 
 class ChangePhpVersionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Website
         fields = ['php']
+
+class FpmProfileSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Website
+        fields = ['fpm_profile', 'fpm_max_children', 'fpm_max_requests', 'fpm_idle_timeout']
+        extra_kwargs = {
+            'fpm_max_children': {'min_value': 1, 'max_value': 1000},
+            'fpm_max_requests': {'min_value': 0},
+            'fpm_idle_timeout': {'min_value': 1, 'max_value': 3600},
+        }
+
+    def validate(self, attrs):
+        profile = attrs.get('fpm_profile', getattr(self.instance, 'fpm_profile', 'auto'))
+        if profile == 'static' and not attrs.get('fpm_max_children', getattr(self.instance, 'fpm_max_children', None)):
+            raise serializers.ValidationError({'fpm_max_children': ['A static pool needs a max number of workers.']})
+        return attrs
   
+class CacheSettingsSerializer(serializers.ModelSerializer):
+    # Allowed TTL in seconds of each cache mode
+    TTL_RANGES = {
+        'micro': (1, 5),
+        'full': (60, 86400),
+    }
+    DEFAULT_TTLS = {
+        'micro': 1,
+        'full': 600,
+    }
+
+    class Meta:
+        model = Website
+        fields = ['cache_mode', 'cache_ttl']
+
+    def validate(self, attrs):
+        mode = attrs.get('cache_mode', getattr(self.instance, 'cache_mode', 'off'))
+        if mode == 'off':
+            return attrs
+
+        ttl = attrs.get('cache_ttl')
+        if ttl is None:
+            attrs['cache_ttl'] = ttl = self.DEFAULT_TTLS[mode]
+        low, high = self.TTL_RANGES[mode]
+        if not low <= ttl <= high:
+            raise serializers.ValidationError({'cache_ttl': [f'The TTL should be between {low} and {high} seconds.']})
+        return attrs
+
+class PurgeCacheSerializer(serializers.Serializer):
+    url = serializers.CharField(max_length=2048, required=False, allow_blank=True)
+
+class OpcacheSettingsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Website
+        fields = ['opcache_memory', 'opcache_max_files', 'opcache_revalidate_freq', 'opcache_validate_timestamps',
+                  'opcache_preload']
+        extra_kwargs = {
+            'opcache_memory': {'min_value': 16, 'max_value': 4096},
+            'opcache_max_files': {'min_value': 1000, 'max_value': 1000000},
+            'opcache_revalidate_freq': {'min_value': 0, 'max_value': 86400},
+        }
+
+    def validate_opcache_preload(self, value):
+        if not value:
+            return value
+
+        php = self.instance.php
+        if not opcache.supports_preload(php):
+            raise serializers.ValidationError(f'PHP {php} doesn\'t support preloading.')
+        if Website.objects.filter(php=php).exclude(pk=self.instance.pk).exists():
+            raise serializers.ValidationError(
+                f'Other websites use PHP {php}, a website can only preload its scripts if it is the only one of its PHP version.')
+        return value
+
+class ObjectCacheSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Website
+        fields = ['object_cache']
+        extra_kwargs = {'object_cache': {'required': True}}
+
+class ServingModeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Website
+        fields = ['serving_mode']
+        extra_kwargs = {'serving_mode': {'required': True}}
+
 class DomainSerializer(serializers.ModelSerializer):
     class Meta:
         model = Domain
@@ -31,8 +113,16 @@ class WebsiteSerializer(serializers.ModelSerializer):
     domains = DomainSerializer(many=True, required=False)
     class Meta:
         model = Website
-        fields = ['id', 'label', 'user', 'metadata', 'domains', 'has_ssl', 'php']
-        read_only_fields = ['id', 'has_ssl', 'root_path', 'domains', 'metadata', 'domains', 'user']
+        fields = ['id', 'label', 'user', 'metadata', 'domains', 'has_ssl', 'php', 'fpm_profile',
+                  'fpm_max_children', 'fpm_max_requests', 'fpm_idle_timeout', 'cache_mode', 'cache_ttl',
+                  'serving_mode', 'opcache_memory', 'opcache_max_files', 'opcache_revalidate_freq',
+                  'opcache_validate_timestamps', 'opcache_preload', 'object_cache', 'ssl_not_after', 'ssl_issuer',
+                  'ssl_key_type']
+        read_only_fields = ['id', 'has_ssl', 'root_path', 'domains', 'metadata', 'domains', 'user', 'fpm_profile',
+                            'fpm_max_children', 'fpm_max_requests', 'fpm_idle_timeout', 'cache_mode', 'cache_ttl',
+                            'serving_mode', 'opcache_memory', 'opcache_max_files', 'opcache_revalidate_freq',
+                            'opcache_validate_timestamps', 'opcache_preload', 'object_cache', 'ssl_not_after',
+                            'ssl_issuer', 'ssl_key_type']
         
         
     def validate_domains(self, value):
@@ -84,7 +174,11 @@ class WebsiteSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({'label': [f'The allowed quota limit of {limit_str} has reached.']})
         
         validated_data['user'] = ssh_user
-        website = Website.objects.create(**validated_data)
+        website = Website(**validated_data)
+        website.is_wp = is_wp
+        # The website is set up in the background by provision_website
+        website.defer_setup = True
+        website.save()
         
         # Create domains
         for domain in domains:
@@ -92,13 +186,9 @@ class WebsiteSerializer(serializers.ModelSerializer):
                 domain=domain
             )
         
-        # Send domains updated signal so vhost file
-        # will be created.
-        signals.domains_updated.send(sender=website)
-        
+        dbobj = None
+        dbpassword = None
         if is_wp:
-            website.is_wp = True
-            website.save()
             i = ''
             while True: 
                 dbname = f'wp_db{i}'
@@ -114,12 +204,77 @@ class WebsiteSerializer(serializers.ModelSerializer):
                 username=dbuser
             )
             dbpassword = system.rand_passwd()
-            signals.create_db.send(sender=dbobj, password=dbpassword)
-            wp_data = {
-                'dbname': dbname,
-                'dbuser': dbuser,
-                'dbpassword': dbpassword
-            }
-            signals.install_wp.send(sender=website, **wp_data)
-            
-        return website
\ No newline at end of file
+        
+        # Directories, configs, the database and WordPress are set up in the background
+        website.provisioning = system.provision_website(website, database=dbobj, dbpassword=dbpassword)
+        return website
+
+
+class ProvisioningSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Provisioning
+        fields = ['id', 'website', 'status', 'steps', 'created', 'updated']
+
+
+class BulkWebsiteSerializer(serializers.Serializer):
+    """A website of a bulk create manifest."""
+    owner = serializers.CharField(max_length=30)
+    label = serializers.CharField(max_length=30)
+    domains = serializers.ListField(child=serializers.CharField(max_length=100), allow_empty=False)
+    php = serializers.CharField(max_length=20)
+    wordpress = serializers.BooleanField(default=False)
+
+    def validate_domains(self, value):
+        domains = []
+        for domain in value:
+            domain = domain.strip().lower()
+            if not validators.domain(domain):
+                raise serializers.ValidationError(f'{domain} is not a valid domain.')
+            domains.append(domain)
+        return domains
+
+    def validate_php(self, value):
+        if value not in PhpVersionListService().get_php_versions():
+            raise serializers.ValidationError(f'PHP {value} is not installed.')
+        return value
+
+
+class BulkCreateSerializer(serializers.Serializer):
+    """Validates a bulk create manifest as a whole, with a few queries for all of the websites."""
+    websites = BulkWebsiteSerializer(many=True, allow_empty=False)
+
+    def validate_websites(self, value):
+        errors = []
+        labels = [entry['label'] for entry in value]
+        domains = [domain for entry in value for domain in entry['domains']]
+
+        for label in {label for label in labels if labels.count(label) > 1}:
+            errors.append(f'The label {label} is used more than once.')
+        for domain in {domain for domain in domains if domains.count(domain) > 1}:
+            errors.append(f'The domain {domain} is used more than once.')
+        for label in Website.objects.filter(label__in=labels).values_list('label', flat=True):
+            errors.append(f'A website with the label {label} already exists.')
+        for domain in Domain.objects.filter(domain__in=domains).values_list('domain', flat=True):
+            errors.append(f'{domain} already exists in the database.')
+
+        usernames = {entry['owner'] for entry in value}
+        owners = User.objects.filter(username__in=usernames).exclude(username='root').annotate(
+            site_count=Count('websites', distinct=True), db_count=Count('databases', distinct=True))
+        owners = {owner.username: owner for owner in owners}
+        for username in sorted(usernames - set(owners)):
+            errors.append(f'The SSH user {username} does not exist or cannot own websites.')
+
+        for username, owner in owners.items():
+            entries = [entry for entry in value if entry['owner'] == username]
+            if owner.site_count + len(entries) > owner.max_sites:
+                errors.append(f'The allowed quota limit of {owner.max_sites} websites of {username} would be exceeded.')
+            dbs = len([entry for entry in entries if entry['wordpress']])
+            if dbs and owner.db_count + dbs > owner.max_dbs:
+                errors.append(f'The allowed quota limit of {owner.max_dbs} databases of {username} would be exceeded.')
+
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        for entry in value:
+            entry['owner'] = owners[entry['owner']]
+        return value
@@ -0,0 +1,142 @@
+import csv
+import io
+import json
+
+from django.db import transaction
+from django.template.defaultfilters import slugify
+
+from core.models import Database, Domain, Website
+from core.utils import system
+
+
+# Columns of a CSV manifest, domains are separated by spaces or semicolons
+MANIFEST_COLUMNS = ['owner', 'label', 'domains', 'php', 'wordpress']
+
+
+def read_manifest(content: str, fmt: str) -> list:
+    """Read a bulk create manifest.
+
+    A JSON manifest is a list of objects, or an object with a websites list. A CSV manifest has a
+    header row with the owner, label, domains, php and wordpress columns.
+
+    Args:
+        content (str): The content of the manifest.
+        fmt (str): Either csv or json.
+
+    Returns:
+        list: A dict for each website, to be validated with api.websites.serializers.BulkCreateSerializer.
+
+    Raises:
+        ValueError: If the manifest cannot be parsed.
+    """
+    if fmt == 'json':
+        data = json.loads(content)
+        if isinstance(data, dict):
+            data = data.get('websites')
+        if not isinstance(data, list):
+            raise ValueError('A JSON manifest should be a list of websites.')
+        for entry in data:
+            if isinstance(entry, dict) and isinstance(entry.get('domains'), str):
+                entry['domains'] = entry['domains'].replace(';', ',').split(',')
+        return data
+
+    if fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(content))
+        missing = set(MANIFEST_COLUMNS) - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f'The CSV manifest is missing the columns: {", ".join(sorted(missing))}.')
+        websites = []
+        for row in reader:
+            entry = {key: (row.get(key) or '').strip() for key in MANIFEST_COLUMNS}
+            entry['domains'] = entry['domains'].replace(';', ' ').split()
+            entry['wordpress'] = entry['wordpress'] or False
+            websites.append(entry)
+        return websites
+
+    raise ValueError(f'Unsupported manifest format {fmt}.')
+
+
+class BulkCreateService(object):
+    """Bulk create websites.
+
+    Creates the website, domain and database rows of many websites with a few bulk queries, then
+    provisions all of them as one pipeline, so each affected service is reloaded once for the whole
+    batch instead of once per website.
+    """
+
+    def create(self, validated_data: dict, background: bool = True) -> list:
+        """Create the websites.
+
+        Args:
+            validated_data (dict): Validated data from serializer (api.websites.serializers.BulkCreateSerializer)
+            background (bool): Provision the websites in the background instead of waiting for them, the
+                               Provisioning objects have to be refreshed to see the results then.
+
+        Returns:
+            list: The Provisioning model objects of the websites.
+        """
+        entries = validated_data.get('websites')
+        with transaction.atomic():
+            slugs = self._slugs([entry['label'] for entry in entries])
+            Website.objects.bulk_create([Website(
+                user=entry['owner'],
+                label=entry['label'],
+                slug=slugs[entry['label']],
+                php=entry['php'],
+                is_wp=entry['wordpress']
+            ) for entry in entries])
+
+            # Not every database backend returns the primary keys of bulk inserted rows
+            websites = Website.objects.select_related('user').in_bulk(slugs.keys(), field_name='label')
+
+            Domain.objects.bulk_create([
+                Domain(website=websites[entry['label']], domain=domain)
+                for entry in entries for domain in entry['domains']
+            ])
+
+            wp_labels = [entry['label'] for entry in entries if entry['wordpress']]
+            names = self._db_names(len(wp_labels))
+            Database.objects.bulk_create([Database(
+                user=websites[label].user,
+                name=dbname,
+                username=dbuser
+            ) for label, (dbname, dbuser) in zip(wp_labels, names)])
+            databases = Database.objects.in_bulk([dbname for dbname, _ in names], field_name='name')
+            wp_databases = {label: databases[dbname] for label, (dbname, _) in zip(wp_labels, names)}
+
+            items = []
+            for entry in entries:
+                database = wp_databases.get(entry['label'])
+                dbpassword = system.rand_passwd() if database else None
+                items.append((websites[entry['label']], database, dbpassword))
+            return system.provision_websites(items, background=background)
+
+    def _slugs(self, labels: list) -> dict:
+        """Returns a unique slug for each label, like Website.save() does."""
+        taken = set(Website.objects.values_list('slug', flat=True))
+        slugs = {}
+        for label in labels:
+            base = slugify(label)
+            slug = base
+            i = 0
+            while slug in taken:
+                i += 1
+                slug = f'{base}-{i}'
+            taken.add(slug)
+            slugs[label] = slug
+        return slugs
+
+    def _db_names(self, count: int) -> list:
+        """Returns count unused (name, username) pairs for WordPress databases."""
+        taken = set()
+        for name, username in Database.objects.values_list('name', 'username'):
+            taken.update([name, username])
+        names = []
+        i = ''
+        while len(names) < count:
+            dbname = f'wp_db{i}'
+            dbuser = f'wp_user{i}'
+            if dbname not in taken and dbuser not in taken:
+                names.append((dbname, dbuser))
+            i = 0 if i == '' else i + 1
+        return names
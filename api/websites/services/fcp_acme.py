@@ -3,6 +3,8 @@ from cryptography.hazmat.primitives.asymmetric import rsa
 import josepy as jose
 import OpenSSL
 import os
+import threading
+from requests.adapters import HTTPAdapter
 from acme import challenges
 from acme import client
 from acme import crypto_util
@@ -22,13 +24,48 @@ ACC_KEY_BITS = 2048
 CERT_PKEY_BITS = 2048
 
 
+class SharedClientNetwork(client.ClientNetwork):
+    """ACME client network that can be shared by threads.
+
+    The client checks that it has a nonce left and then pops it, two threads could both pass the
+    check with a single nonce left. The lock makes the check and the pop one step.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._nonce_lock = threading.Lock()
+
+    def _get_nonce(self, url: str, new_nonce_url: str) -> str:
+        with self._nonce_lock:
+            return super()._get_nonce(url, new_nonce_url)
+
+
+class AcmeOrder(object):
+    """A placed ACME order.
+
+    Attributes:
+        order (object): ACME order resource.
+        challenges (list): The (challenge, response) of each authorization of the order.
+        priv_key (bytes): The private key of the certificate.
+        token_paths (list): The challenge HTTP path and the auth token of each authorization.
+    """
+
+    def __init__(self, order: object, priv_key: bytes) -> None:
+        self.order = order
+        self.priv_key = priv_key
+        self.challenges = []
+        self.token_paths = []
+
+
 class FastcpAcme(object):
     """FastCP ACME class
 
-    This class is responsible to generate SSL certificates using Let's Encrypt ACME API v2.0.
+    This class is responsible to generate SSL certificates using Let's Encrypt ACME API v2.0. The
+    directory and the account are loaded once, so one client can place many orders, from several
+    threads too with place_order() and finalize().
     """
 
-    def __init__(self, acc_key: str = None, regr: str = None, staging: bool = False):
+    def __init__(self, acc_key: str = None, regr: str = None, staging: bool = False, pool_size: int = 10):
         """Create ACME client.
 
         This method sets the ACME client and prepares the initial configuration.
@@ -37,6 +74,7 @@ class FastcpAcme(object):
             acc_key (str): Account key as JSON string.
             regr (str): Existing account as a JSON string if already created.
             staging (bool): Specifies either the staging directory URL should be used the production URL.
+            pool_size (int): Max number of connections kept open to the ACME server.
         """
         
         # Generate account key if not provided, otherwise load it from the
@@ -59,7 +97,8 @@ class FastcpAcme(object):
         else:
             dir_url = DIRECTORY_URL
 
-        net = client.ClientNetwork(self.acc_key, account=self.regr, user_agent=USER_AGENT)
+        net = SharedClientNetwork(self.acc_key, account=self.regr, user_agent=USER_AGENT)
+        net.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
         directory = messages.Directory.from_json(net.get(dir_url).json())
         self.client = client.ClientV2(directory, net=net)
         
@@ -142,14 +181,8 @@ class FastcpAcme(object):
         
         return chall_list
 
-    def request_ssl(self, domains: list, priv_key: str = None, chall_type='http') -> dict:
-        """Create a new SSL certificate request.
-
-        This creates a new order for an SSL certificate for the provided domains. This method doesn't
-        obtain the final SSL. It just places a request order and it returns the tokens to verify the
-        ownership of the domain. Final SSL certificate files can be obtained using get_ssl() method.
-        
-        To renew an existing certificate, the private key associated to that certificate should be provided.
+    def place_order(self, domains: list, priv_key: str = None, chall_type='http') -> AcmeOrder:
+        """Place an ACME order.
 
         Args:
             domains (list): List of domain names to get SSL cert for.
@@ -158,38 +191,75 @@ class FastcpAcme(object):
             chall_type (str): Challenge type. It defaults to HTTP challenge.
 
         Returns:
-            dict: Containing the challenge HTTP path and the auth token.
+            AcmeOrder: The order, with the challenge HTTP path and the auth token of each domain.
         """
-        
         # Create a CSR and priv key
         priv_key, csr = self._generate_csr(domains, priv_key=priv_key)
-        self.priv_key = priv_key
 
         # Place an ACME order
-        self.acme_order = self.client.new_order(csr)
+        order = AcmeOrder(self.client.new_order(csr), priv_key)
 
         # Get challenge path & token
-        self.challs_list = []
-        token_paths = []
-        for chall in self._select_chall(self.acme_order, chall_type=chall_type):
-            self.challs_list.append(chall)
+        for chall in self._select_chall(order.order, chall_type=chall_type):
             response, validation = chall.chall.response_and_validation(
                 account_key=self.acc_key)
-            self.response = response
+            order.challenges.append((chall, response))
 
             # Get challenge path
             challange_path = os.path.join(
                 challenges.HTTP01.URI_ROOT_PATH, chall.chall.encode('token'))
-            
-            # Challenge token
-            challenge_token = validation.encode()
-            
-            token_paths.append({
+
+            order.token_paths.append({
                 'path': challange_path,
-                'token': challenge_token
+                'token': validation.encode()
             })
+
+        return order
+
+    def finalize(self, order: AcmeOrder):
+        """Get the SSL certificate files of an order.
+
+        This method should be called only after completing the validation steps, i.e. placing the
+        auth tokens in webroot.
+
+        Args:
+            order (AcmeOrder): The order placed with place_order().
+
+        Returns:
+            dict: Dict containing SSL certificates and the private key, False on failure.
+        """
+        try:
+            for chall, response in order.challenges:
+                self.client.answer_challenge(chall, response)
+            order_result = self.client.poll_and_finalize(order.order)
+            return {
+                'full_chain': order_result.fullchain_pem,
+                'priv_key': order.priv_key
+            }
+        except Exception as e:
+            print(f"Error during SSL certificate request: {e}")
+            return False
+
+    def request_ssl(self, domains: list, priv_key: str = None, chall_type='http') -> dict:
+        """Create a new SSL certificate request.
+
+        This creates a new order for an SSL certificate for the provided domains. This method doesn't
+        obtain the final SSL. It just places a request order and it returns the tokens to verify the
+        ownership of the domain. Final SSL certificate files can be obtained using get_ssl() method.
         
-        return token_paths
+        To renew an existing certificate, the private key associated to that certificate should be provided.
+
+        Args:
+            domains (list): List of domain names to get SSL cert for.
+            priv_key (str): Private key as a string. If not provided, it will be generated
+                            along the CSR.
+            chall_type (str): Challenge type. It defaults to HTTP challenge.
+
+        Returns:
+            dict: Containing the challenge HTTP path and the auth token.
+        """
+        self.order = self.place_order(domains, priv_key=priv_key, chall_type=chall_type)
+        return self.order.token_paths
         
     def get_ssl(self):
         """Get SSL certificate files.
@@ -200,14 +270,4 @@ class FastcpAcme(object):
         Returns:
             dict: Dict containing SSL certificates and the private key.
         """
-        try:
-            for chall in self.challs_list:
-                self.client.answer_challenge(chall, self.response)
-            order_result = self.client.poll_and_finalize(self.acme_order)
-            return {
-                'full_chain': order_result.fullchain_pem,
-                'priv_key': self.priv_key
-            }
-        except Exception as e:
-            print(f"Error during SSL certificate request: {e}")
-            return False
\ No newline at end of file
+        return self.finalize(self.order)
@@ -0,0 +1,218 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import Website
+from core.signals import domains_updated
+from core.utils import filesystem, reloads
+from core.utils.system import record_ssl_attempt, ssl_renewal_due, update_ssl_metadata
+
+from .ssl import FCP_ORDER_LIMIT_PATH, FastcpSsl
+
+
+logger = logging.getLogger(__name__)
+
+# Error of the domains that don't answer the verification probe
+UNRESOLVED_ERROR = 'The domain is not resolving to this server.'
+
+
+class OrderLimiter(object):
+    """ACME order limiter.
+
+    Let's Encrypt allows an account a number of new orders per window of time, and gives the orders
+    back gradually as the window slides. This token bucket does the same, so the passes never place
+    more orders than the account has left. The bucket is kept in a file between the passes.
+    """
+
+    def __init__(self, orders: int, window: float, tokens: float = None, updated: float = None) -> None:
+        """Create the limiter.
+
+        Args:
+            orders (int): Max number of orders per window.
+            window (float): The window in seconds.
+            tokens (float): Orders left at the updated time, a full bucket by default.
+            updated (float): Unix time of the last update of the bucket, now by default.
+        """
+        self.capacity = max(1, orders)
+        self.rate = self.capacity / max(1, window)
+        self.tokens = self.capacity if tokens is None else max(0, min(self.capacity, tokens))
+        self.updated = time.time() if updated is None else updated
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str, orders: int, window: float) -> 'OrderLimiter':
+        """Load the bucket saved by the previous pass, a full one is returned if there's none."""
+        try:
+            with open(path, encoding='utf-8') as f:
+                state = json.load(f)
+            return cls(orders, window, tokens=float(state['tokens']), updated=float(state['updated']))
+        except (OSError, ValueError, KeyError, TypeError):
+            return cls(orders, window)
+
+    def save(self, path: str) -> None:
+        """Save the bucket for the next pass."""
+        with self._lock:
+            state = {'tokens': self.tokens, 'updated': self.updated}
+        filesystem.atomic_write(path, json.dumps(state).encode('utf-8'), mode=0o600)
+
+    def acquire(self) -> bool:
+        """Take an order from the bucket, returns False if there's none left."""
+        with self._lock:
+            now = time.time()
+            self.tokens = min(self.capacity, self.tokens + max(0, now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RenewalEngine(object):
+    """SSL renewal engine.
+
+    Gets the missing certificates of the websites and renews the ones that are due. One ACME client,
+    with one account, one directory and one connection pool, is shared by a bounded pool of threads
+    that verify the domains and place the orders, and the orders are kept under the rate limit of
+    the account. The websites that are over the limit are deferred to the next pass.
+
+    Only the domains that are due, and the ones the current certificate covers, are attempted. A
+    domain that fails is put off with an exponential backoff, see core.utils.system.record_ssl_attempt,
+    and each certificate is renewed at a random point of its renewal window. The database is updated
+    from the calling thread as the certificates arrive, and NGINX is reloaded once at the end.
+    """
+
+    def __init__(self, workers: int = 8, orders: int = 300, window: float = 10800) -> None:
+        """Create the engine.
+
+        Args:
+            workers (int): Number of websites processed concurrently.
+            orders (int): Max number of orders the account can place per window.
+            window (float): The window of the order limit in seconds.
+        """
+        self.workers = max(1, workers)
+        self.orders = orders
+        self.window = window
+
+    def run(self) -> dict:
+        """Get or renew the certificates that are due.
+
+        Returns:
+            dict: The activated, failed, unverified and deferred websites, the number of websites
+                  that have nothing due, the errors and the result of each reloaded service.
+        """
+        report = {'activated': [], 'failed': [], 'unverified': [], 'deferred': [], 'skipped': 0,
+                  'errors': [], 'reloaded': {}}
+        pending = []
+        for website in self.due_websites():
+            domains = self.due_domains(website)
+            if any(not domain.ssl for domain in domains) or (domains and ssl_renewal_due(website)):
+                pending.append((website, domains))
+        report['skipped'] = Website.objects.count() - len(pending)
+
+        if not pending:
+            return report
+
+        fcp = FastcpSsl()
+        try:
+            acme = fcp.get_acme(pool_size=self.workers)
+        except Exception as e:
+            report['errors'].append(f'The ACME client cannot be created: {e}')
+            logger.error(report['errors'][-1])
+            return report
+        limiter = OrderLimiter.load(FCP_ORDER_LIMIT_PATH, self.orders, self.window)
+
+        try:
+            with reloads.scheduler.hold():
+                with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='fastcp-ssl-renew') as executor:
+                    futures = [executor.submit(self._process, fcp, acme, limiter, website, domains)
+                               for website, domains in pending]
+                    for future in as_completed(futures):
+                        self._apply(future.result(), report)
+
+                report['reloaded'] = reloads.scheduler.flush()
+        finally:
+            limiter.save(FCP_ORDER_LIMIT_PATH)
+
+        for error in report['errors']:
+            logger.error(f'Unable to get an SSL certificate for {error}')
+        return report
+
+    def due_websites(self) -> object:
+        """Returns the websites that have a domain due for an attempt and that need a certificate.
+
+        A domain is due if it has never failed or if its backoff is over. The certificates that are
+        due for renewal are renewed even if their domains are backing off, see due_domains. The
+        websites whose certificates were written before their renewal date was stored are included,
+        so it's read.
+        """
+        now = timezone.now()
+        return Website.objects.filter(
+            Q(domains__ssl=False, domains__ssl_next_attempt__isnull=True)
+            | Q(domains__ssl=False, domains__ssl_next_attempt__lte=now)
+            | Q(domains__ssl=True, ssl_renew_at__lte=now)
+            | Q(domains__ssl=True, has_ssl=True, ssl_renew_at__isnull=True)
+        ).distinct().select_related('user').prefetch_related('domains')
+
+    def due_domains(self, website: object) -> list:
+        """Returns the domains of a website to verify and order.
+
+        The domains that are not backing off, and the ones the current certificate covers whether they
+        are backing off or not. The new certificate replaces the current one, so a covered domain left
+        out of the order would lose its certificate until its backoff is over.
+        """
+        now = timezone.now()
+        return [domain for domain in website.domains.all()
+                if domain.ssl or domain.ssl_next_attempt is None or domain.ssl_next_attempt <= now]
+
+    def _process(self, fcp: FastcpSsl, acme: object, limiter: OrderLimiter, website: object, domains: list) -> dict:
+        """Verify the due domains of a website and get its certificate, runs in a worker thread."""
+        result = {'website': website, 'due': domains, 'domains': [], 'status': 'unverified', 'error': None}
+        result['domains'] = fcp._verify_domains(website, [domain.domain for domain in domains])
+        if not result['domains']:
+            return result
+
+        if not limiter.acquire():
+            result['status'] = 'deferred'
+            return result
+
+        try:
+            result['status'] = 'activated' if fcp.issue(website, result['domains'], acme) else 'failed'
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = str(e)
+        return result
+
+    def _apply(self, result: dict, report: dict) -> None:
+        """Record the result of a website, and update its vhost if it has got a certificate."""
+        website = result['website']
+        status = result['status']
+        report[status].append(website)
+
+        verified = set(result['domains'])
+        unresolved = [domain for domain in result['due'] if domain.domain not in verified]
+        if unresolved:
+            record_ssl_attempt(unresolved, UNRESOLVED_ERROR)
+        if status not in ('activated', 'failed'):
+            return
+
+        ordered = [domain for domain in result['due'] if domain.domain in verified]
+        if status == 'activated':
+            if not website.has_ssl:
+                website.has_ssl = True
+                website.save(update_fields=['has_ssl'])
+            # Marks the domains of the certificate as having SSL too
+            update_ssl_metadata(website)
+            record_ssl_attempt(ordered)
+            domains_updated.send(sender=website, only_nginx=True)
+            # A renewed certificate is written to the same path, so its vhost doesn't change and
+            # NGINX has to be reloaded to load it. The reload is held until the end of the pass.
+            reloads.scheduler.schedule(['nginx'], 'reload')
+        else:
+            error = result['error'] or 'The certificate cannot be finalized.'
+            record_ssl_attempt(ordered, error)
+            report['errors'].append(f'{website}: {error}')
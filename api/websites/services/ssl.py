@@ -1,11 +1,14 @@
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 
 import requests
 from django.conf import settings
 
-from core.models import Domain
-from core.signals import restart_services
+from core.signals import reload_services
 from core.utils.filesystem import get_website_paths
+from core.utils.system import record_ssl_attempt, update_ssl_metadata
 
 from .fcp_acme import FastcpAcme
 
@@ -17,6 +20,28 @@ ACME_VERIFY_BASE_DIR = '/var/fastcp/well-known'
 FCP_ACME_CONFIG_DIR = '/var/fastcp/.config'
 FCP_ACCOUNT_KEY_PATH = os.path.join(FCP_ACME_CONFIG_DIR, 'account_key')
 FCP_ACCOUNT_RESOURCE_PATH = os.path.join(FCP_ACME_CONFIG_DIR, 'account_resource')
+FCP_ORDER_LIMIT_PATH = os.path.join(FCP_ACME_CONFIG_DIR, 'order_limit')
+# Max seconds a verification probe waits for a domain
+FCP_VERIFY_TIMEOUT = 5
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Returns the HTTP session of the verification probes.
+
+    The session is shared by all of the probes, so their connection pools are reused instead of
+    being set up for every website.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            workers = settings.FASTCP_SSL_VERIFY_WORKERS
+            adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+            _session = requests.Session()
+            _session.mount('https://', adapter)
+        return _session
 
 
 class FastcpSsl(object):
@@ -46,7 +71,7 @@ class FastcpSsl(object):
                 self.regr = f.read()
 
 
-    def is_resolving(self, domain: str) -> bool:
+    def is_resolving(self, domain: str, timeout: float = FCP_VERIFY_TIMEOUT) -> bool:
         """Check resolving or not.
 
         This method checks and verifies either the provided domain is resolving to the
@@ -55,13 +80,14 @@ class FastcpSsl(object):
 
         Args:
             domain (str): The domain name.
+            timeout (float): Max seconds to wait for the domain.
 
         Returns:
             bool: True on success Falase otherwise.
         """
 
         try:
-            res = requests.get(f'https://{domain}{FCP_VERIFY_PATH}', timeout=5)
+            res = get_session().get(f'https://{domain}{FCP_VERIFY_PATH}', timeout=timeout)
             if res.status_code == 200 and res.text.strip() == FCP_VERIFY_STR:
                 return True
         except (requests.RequestException, ConnectionError, TimeoutError):
@@ -70,13 +96,35 @@ class FastcpSsl(object):
         return False
 
 
-    def _verify_domains(self, website) -> list[str]:
-        """Verify which domains are resolving and return the list."""
-        verified_domains = []
-        for dom in website.domains.all():
-            if self.is_resolving(dom.domain):
-                verified_domains.append(dom.domain)
-        return verified_domains
+    def _verify_domains(self, website, domains: list = None) -> list[str]:
+        """Verify which domains are resolving and return the list.
+
+        The domains are probed concurrently, and the ones that haven't answered by the deadline of
+        the website are left out, so a few domains that don't resolve yet don't hold up the rest.
+        Only the given domain names are probed if any, all of the domains of the website otherwise.
+        """
+        if domains is None:
+            domains = [dom.domain for dom in website.domains.all()]
+        if not domains:
+            return []
+
+        deadline = time.monotonic() + settings.FASTCP_SSL_VERIFY_DEADLINE
+        executor = ThreadPoolExecutor(max_workers=min(len(domains), settings.FASTCP_SSL_VERIFY_WORKERS),
+                                      thread_name_prefix='fastcp-ssl-verify')
+        futures = {executor.submit(self._probe, domain, deadline): domain for domain in domains}
+        done, _ = wait(futures, timeout=max(0, deadline - time.monotonic()))
+        # The probes that are still running are abandoned, they time out on their own
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        return [domain for future, domain in futures.items()
+                if future in done and future.exception() is None and future.result()]
+
+    def _probe(self, domain: str, deadline: float) -> bool:
+        """Check either a domain is resolving, without waiting past the deadline."""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        return self.is_resolving(domain, timeout=min(FCP_VERIFY_TIMEOUT, remaining))
 
     def _save_account_credentials(self, acme):
         """Save ACME account key and resource if not already saved."""
@@ -88,14 +136,32 @@ class FastcpSsl(object):
         if not self.regr:
             with open(FCP_ACCOUNT_RESOURCE_PATH, 'w', encoding='utf-8') as f:
                 f.write(acme.regr.json_dumps())
+            self.regr = acme.regr.json_dumps()
+
+    def get_acme(self, pool_size: int = 10) -> FastcpAcme:
+        """Create an ACME client for the account, the account is registered if it doesn't exist yet.
+
+        Args:
+            pool_size (int): Max number of connections kept open to the ACME server.
+
+        Returns:
+            FastcpAcme: The ACME client.
+        """
+        acme = FastcpAcme(
+            staging=settings.LETSENCRYPT_IS_STAGING,
+            acc_key=self.acc_key,
+            regr=self.regr,
+            pool_size=pool_size
+        )
+        self._save_account_credentials(acme)
+        return acme
 
     def _write_challenge_tokens(self, results) -> list:
         """Write ACME challenge tokens to verification directory."""
         token_paths = []
         if results:
             base_dir = os.path.join(ACME_VERIFY_BASE_DIR, 'acme-challenge')
-            if not os.path.exists(base_dir):
-                os.makedirs(base_dir)
+            os.makedirs(base_dir, exist_ok=True)
 
             for result in results:
                 token_path = os.path.join(base_dir, os.path.basename(result.get('path')))
@@ -118,36 +184,26 @@ class FastcpSsl(object):
         with open(paths.get('cert_chain_path'), 'w', encoding='utf-8') as f:
             f.write(str(result.get('full_chain')))
 
-    def _update_domain_ssl_status(self, verified_domains):
-        """Update SSL status for verified domains."""
-        for dom in verified_domains:
-            Domain.objects.filter(domain=dom).update(ssl=True)
+    def issue(self, website, domains: list, acme: FastcpAcme) -> bool:
+        """Issue a certificate.
 
-    def get_ssl(self, website) -> bool:
-        """Get SSL.
-
-        This method attempts to get SSL certificates for the provided domain names. An SSL
-        is requested only if the domain is found to be resolving to the server IP, otherwise
-        it is excluded from the list.
-
-        First of all, SSL certs are requested from Let's Encrypt. If succeeded, SSL cert files
-        are generated and SSL vhost file is created.
+        Gets a certificate for the verified domains of a website and saves its files. Nothing is
+        written to the database and no service is reloaded, so the certificates of many websites
+        can be issued concurrently with one shared ACME client.
 
         Args:
             website (object): The website model object.
+            domains (list): The verified domains of the website.
+            acme (FastcpAcme): The ACME client.
 
         Returns:
-            bool: True on success False otherwise.
+            bool: True if the certificate files have been saved, False otherwise.
         """
         token_paths = []
-        status = False
         try:
-            verified_domains = self._verify_domains(website)
-
             # Get website paths
             paths = get_website_paths(website)
-            if not os.path.exists(paths.get('ssl_base')):
-                os.makedirs(paths.get('ssl_base'))
+            os.makedirs(paths.get('ssl_base'), exist_ok=True)
 
             if os.path.exists(paths.get('priv_key_path')):
                 with open(paths.get('priv_key_path'), 'rb') as f:
@@ -155,40 +211,56 @@ class FastcpSsl(object):
             else:
                 priv_key = None
 
-            if verified_domains:
-                acme = FastcpAcme(
-                    staging=settings.LETSENCRYPT_IS_STAGING,
-                    acc_key=self.acc_key,
-                    regr=self.regr
-                )
+            # Initiate an order
+            order = acme.place_order(domains=domains, priv_key=priv_key)
 
-                self._save_account_credentials(acme)
+            # Write the challenge token to path
+            token_paths = self._write_challenge_tokens(order.token_paths)
 
-                # Initiate an order
-                results = acme.request_ssl(domains=verified_domains, priv_key=priv_key)
+            # After the challange token is written, request SSL cert
+            result = acme.finalize(order)
+            if not result:
+                return False
 
-                # Write the challenge token to path
-                token_paths = self._write_challenge_tokens(results)
+            self._save_ssl_certificates(result, paths)
+            return True
+        finally:
+            # Remove verification files
+            for token_path in token_paths:
+                if token_path and os.path.exists(token_path):
+                    os.remove(token_path)
 
-                # After the challange token is written, request SSL cert
-                result = acme.get_ssl()
+    def get_ssl(self, website) -> bool:
+        """Get SSL.
 
-                if result:
-                    self._save_ssl_certificates(result, paths)
+        This method attempts to get SSL certificates for the provided domain names. An SSL
+        is requested only if the domain is found to be resolving to the server IP, otherwise
+        it is excluded from the list.
 
-                    # Restart NGINX
-                    restart_services.send(sender=None, services='nginx')
+        First of all, SSL certs are requested from Let's Encrypt. If succeeded, SSL cert files
+        are generated and SSL vhost file is created.
 
-                    self._update_domain_ssl_status(verified_domains)
+        Args:
+            website (object): The website model object.
+
+        Returns:
+            bool: True on success False otherwise.
+        """
+        status = False
+        try:
+            verified_domains = self._verify_domains(website)
+
+            if verified_domains:
+                if self.issue(website, verified_domains, self.get_acme()):
+                    # Reload NGINX to pick up the certificate
+                    reload_services.send(sender=None, services='nginx')
+
+                    # Marks the domains of the certificate as having SSL too
+                    update_ssl_metadata(website)
+                    record_ssl_attempt([dom for dom in website.domains.all() if dom.domain in verified_domains])
 
                 status = True
         except (OSError, ValueError, KeyError) as e:
             print(f'Error while getting SSL: {e}')
-        finally:
-            # Remove verification files
-            if token_paths:
-                for token_path in token_paths:
-                    if token_path and os.path.exists(token_path):
-                        os.remove(token_path)
 
         return status
@@ -10,9 +10,19 @@ app_name='websites'
 urlpatterns=[
     path('<int:id>/reset-password/', views.PasswordUpdateView().as_view(), name='update_password'),
     path('<int:id>/change-php/', views.ChangePHPVersion().as_view(), name='change_php'),
+    path('<int:id>/fpm-profile/', views.FpmProfileView().as_view(), name='fpm_profile'),
+    path('<int:id>/fpm-status/', views.FpmStatusView().as_view(), name='fpm_status'),
+    path('<int:id>/cache/', views.CacheSettingsView().as_view(), name='cache'),
+    path('<int:id>/opcache/', views.OpcacheSettingsView().as_view(), name='opcache'),
+    path('<int:id>/reset-opcache/', views.ResetOpcacheView().as_view(), name='reset_opcache'),
+    path('<int:id>/object-cache/', views.ObjectCacheView().as_view(), name='object_cache'),
+    path('<int:id>/serving-mode/', views.ServingModeView().as_view(), name='serving_mode'),
+    path('<int:id>/purge-cache/', views.PurgeCacheView().as_view(), name='purge_cache'),
     path('<int:id>/add-domain/', views.DomainAddView().as_view(), name='add_domain'),
     path('<int:id>/delete-domain/<int:dom_id>/', views.DeleteDomainView().as_view(), name='del_domain'),
     path('<int:id>/refresh-ssl/', views.RefreshSsl().as_view(), name='refresh_ssl'),
     path('php-versions/', views.PhpVersionsView().as_view(), name='php_versions'),
+    path('bulk-create/', views.BulkCreateView().as_view(), name='bulk_create'),
+    path('provisioning/<uuid:provisioning_id>/', views.ProvisioningView().as_view(), name='provisioning'),
     path('', include(router.urls))
 ]
\ No newline at end of file
@@ -3,26 +3,61 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from core import signals
-from core.models import Website
+from core.models import Provisioning, Website
 from core.permissions import IsAdminOrOwner
+from core.utils import filesystem, fpm, fpm_status, nginx_cache, object_cache, opcache, reloads
 from core.utils.system import ssl_expiring
 
 from . import serializers
+from .services.bulk_create import BulkCreateService, read_manifest
 from .services.get_php_versions import PhpVersionListService
 from .services.ssl import FastcpSsl
 
 
+def get_website(request: object, website_id: int) -> object:
+    """Returns the website with the given ID if the user of the request can manage it, None otherwise."""
+    if request.user.is_superuser:
+        return Website.objects.filter(id=website_id).first()
+    return Website.objects.filter(user=request.user, id=website_id).first()
+
+
+def save_and_apply(serializer: object, apply: callable) -> bool:
+    """Save the settings of a website and apply them, the previous settings are put back on failure.
+
+    The configs are rendered from the database as well, so the settings are saved first. The
+    configs are then tested and the services reloaded before returning, so a config that the reload
+    scheduler rejects and rolls back fails the settings too. If they cannot be applied, the previous
+    values are saved again and applied, so the database never disagrees with the configs.
+
+    Args:
+        serializer (object): A validated serializer of the website.
+        apply (callable): Applies the settings of the website passed to it, returns True on success.
+
+    Returns:
+        bool: True on success and False otherwise.
+    """
+    website = serializer.instance
+    previous = {field: getattr(website, field) for field in serializer.validated_data}
+    with reloads.scheduler.hold():
+        website = serializer.save()
+        if apply(website) and all(reloads.scheduler.flush().values()):
+            return True
+
+        for field, value in previous.items():
+            setattr(website, field, value)
+        website.save(update_fields=list(previous))
+        apply(website)
+        reloads.scheduler.flush()
+    return False
+
+
 class DomainAddView(APIView):
     """Add a new domain to a website."""
     http_method_names = ['post']
 
     def post(self, request, *args, **kwargs):
-        user = request.user
         website_id = kwargs.get('id')
-        if user.is_superuser:
-            website = Website.objects.filter(id=website_id).first()
-        else:
-            website = Website.objects.filter(user=user, id=website_id).first()
+        website = get_website(request, website_id)
 
         if not website:
             return Response({
@@ -54,12 +89,8 @@ class RefreshSsl(APIView):
     http_method_names = ['post']
 
     def post(self, request, *args, **kwargs):
-        user = request.user
         website_id = kwargs.get('id')
-        if user.is_superuser:
-            website = Website.objects.filter(id=website_id).first()
-        else:
-            website = Website.objects.filter(user=user, id=website_id).first()
+        website = get_website(request, website_id)
 
         if not website:
             return Response({
@@ -93,13 +124,9 @@ class DeleteDomainView(APIView):
     http_method_names = ['delete']
 
     def delete(self, request, *args, **kwargs):
-        user = request.user
         website_id = kwargs.get('id')
         dom_id = kwargs.get('dom_id')
-        if user.is_superuser:
-            website = Website.objects.filter(id=website_id).first()
-        else:
-            website = Website.objects.filter(user=user, id=website_id).first()
+        website = get_website(request, website_id)
 
         if not website:
             return Response({
@@ -143,12 +170,8 @@ class ChangePHPVersion(APIView):
         if not s.is_valid():
             return Response(s.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
 
-        user = request.user
         website_id = kwargs.get('id')
-        if user.is_superuser:
-            website = Website.objects.filter(id=website_id).first()
-        else:
-            website = Website.objects.filter(user=user, id=website_id).first()
+        website = get_website(request, website_id)
 
         if not website:
             return Response({
@@ -163,6 +186,324 @@ class ChangePHPVersion(APIView):
             'message': kwargs
         })
 
+class FpmProfileView(APIView):
+    """Get or update the PHP-FPM pool profile of a website."""
+    http_method_names = ['get', 'post']
+
+    def get(self, request, *args, **kwargs):
+        website = get_website(request, kwargs.get('id'))
+        if not website:
+            return Response({
+                'message': f'Target website with ID {kwargs.get("id")} was not found.'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        data = serializers.FpmProfileSerializer(website).data
+        data['pool'] = fpm.pool_settings(website)
+        return Response(data)
+
+    def post(self, request, *args, **kwargs):
+        website = get_website(request, kwargs.get('id'))
+        if not website:
+            return Response({
+                'message': f'Target website with ID {kwargs.get("id")} was not found.'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        s = serializers.FpmProfileSerializer(website, data=request.data, partial=True)
+        if not s.is_valid():
+            return Response(s.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        if not save_and_apply(s, filesystem.generate_fpm_conf):
+            return Response({
+                'message': 'The PHP-FPM pool cannot be updated.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'message': 'The PHP-FPM pool has been updated.',
+            'pool': fpm.pool_settings(website)
+        })
+
+class CacheSettingsView(APIView):
+    """Get or update the NGINX proxy cache mode of a website."""
+    http_method_names = ['get', 'post']
+
+    def get(self, request, *args, **kwargs):
+        website = get_website(request, kwargs.get('id'))
+        if not website:
+            return Response({
+                'message': f'Target website with ID {kwargs.get("id")} was not found.'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        return Response(serializers.CacheSettingsSerializer(website).data)
+
+    def post(self, request, *args, **kwargs):
+        website = get_website(request, kwargs.get('id'))
+        if not website:
+            return Response({
+                'message': f'Target website with ID {kwargs.get("id")} was not found.'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        s = serializers.CacheSettingsSerializer(website, data=request.data, partial=True)
+        if not s.is_valid():
+            return Response(s.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        if not save_and_apply(s, filesystem.create_nginx_vhost):
+            return Response({
+                'message': 'The cache settings cannot be applied.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if website.cache_mode == 'off':
+            nginx_cache.purge_all(website)
+        return Response({
+            'message': 'The cache settings have been updated.',
+            'cache_mode': website.cache_mode,
+            'cache_ttl': website.cache_ttl
+        })
+
+class OpcacheSettingsView(APIView):
+    """Get or update the OPcache settings of a website."""
+    http_method_names = ['get', 'post']
+
+    def get(self, request, *args, **kwargs):
+        website = get_website(request, kwargs.get('id'))
+        if not website:
+            return Response({
+                'message': f'Target website with ID {kwargs.get("id")} was not found.'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        data = serializers.OpcacheSettingsSerializer(website).data
+        data['shared'] = opcache.version_settings(website.php)
+        data['shared']['preload'] = getattr(data['shared']['preload'], 'label', None)
+        return Response(data)
+
+    def post(self, request, *args, **kwargs):
+        website = get_website(request, kwargs.get('id'))
+        if not website:
+            return Response({
+                'message': f'Target website with ID {kwargs.get("id")} was not found.'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        s = serializers.OpcacheSettingsSerializer(website, data=request.data, partial=True)
+        if not s.is_valid():
+            return Response(s.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        # The pool and the OPcache config of the version are read from the database
+        if not save_and_apply(s, filesystem.generate_fpm_conf):
+            return Response({
+                'message': 'The OPcache settings cannot be applied.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'message': 'The OPcache settings have been updated.'
+        })
+
+class ResetOpcacheView(APIView):
+    """Reset the OPcache of a website, e.g. after a deploy when the timestamps aren't validated.
+
+    The OPcache is shared by the websites of a PHP version and PHP-FPM empties it when it's
+    reloaded, so the scripts of the other websites of the version are compiled again as well.
+    """
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        website = get_website(request, kwargs.get('id'))
+
+        if not website:
+            return Response({
+                'message': f'Target website with ID {kwargs.get("id")} was not found.'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        service = f'php{website.php}-fpm'
+        reloads.scheduler.schedule([service], 'reload')
+        if reloads.scheduler.flush().get(service) is False:
+            return Response({
+                'message': 'The OPcache cannot be reset.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'message': 'The OPcache has been reset.'
+        })
+
+class ObjectCacheView(APIView):
+    """Get the stats of the object cache of a website, or turn it on or off."""
+    http_method_names = ['get', 'post']
+
+    def get(self, request, *args, **kwargs):
+        website = get_website(request, kwargs.get('id'))
+        if not website:
+            return Response({
+                'message': f'Target website with ID {kwargs.get("id")} was not found.'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        data = serializers.ObjectCacheSerializer(website).data
+        data['max_memory'] = website.user.max_object_cache_memory
+        data['stats'] = None
+        if website.object_cache != 'off':
+            try:
+                data['stats'] = object_cache.stats(website)
+            except object_cache.RedisError:
+                pass
+        return Response(data)
+
+    def post(self, request, *args, **kwargs):
+        website = get_website(request, kwargs.get('id'))
+        if not website:
+            return Response({
+                'message': f'Target website with ID {kwargs.get("id")} was not found.'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        s = serializers.ObjectCacheSerializer(website, data=request.data)
+        if not s.is_valid():
+            return Response(s.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        # A cache that cannot be started is stopped again, and one that cannot be stopped is restarted
+        applied = save_and_apply(s, lambda website: (object_cache.disable(website) if website.object_cache == 'off'
+                                                     else object_cache.enable(website)))
+        if not applied:
+            return Response({
+                'message': 'The object cache settings cannot be applied.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'message': 'The object cache settings have been updated.',
+            'object_cache': website.object_cache
+        })
+
+class ServingModeView(APIView):
+    """Switch a website between NGINX + Apache and NGINX only."""
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        website = get_website(request, kwargs.get('id'))
+
+        if not website:
+            return Response({
+                'message': f'Target website with ID {kwargs.get("id")} was not found.'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        s = serializers.ServingModeSerializer(website, data=request.data)
+        if not s.is_valid():
+            return Response(s.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        # Both vhosts are tested and reloaded together, so no request hits a backend that's going away
+        applied = save_and_apply(s, lambda website: (filesystem.create_apache_vhost(website)
+                                                     and filesystem.create_nginx_vhost(website)))
+        if not applied:
+            return Response({
+                'message': 'The serving mode cannot be applied.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'message': 'The serving mode has been updated.',
+            'serving_mode': website.serving_mode
+        })
+
+class PurgeCacheView(APIView):
+    """Purge a URL or the whole proxy cache of a website."""
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        s = serializers.PurgeCacheSerializer(data=request.data)
+        if not s.is_valid():
+            return Response(s.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        website_id = kwargs.get('id')
+        website = get_website(request, website_id)
+
+        if not website:
+            return Response({
+                'message': f'Target website with ID {website_id} was not found.'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        url = s.validated_data.get('url')
+        if url:
+            removed = nginx_cache.purge_url(website, url)
+        else:
+            removed = nginx_cache.purge_all(website)
+        return Response({
+            'message': f'{removed} cached responses have been purged.',
+            'purged': removed
+        })
+
+class FpmStatusView(APIView):
+    """Returns the saturation metrics and the slow requests of the PHP-FPM pool of a website."""
+    http_method_names = ['get']
+
+    def get(self, request, *args, **kwargs):
+        website_id = kwargs.get('id')
+        website = get_website(request, website_id)
+
+        if not website:
+            return Response({
+                'message': f'Target website with ID {website_id} was not found.'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        # Scraped by the scrape-fpm-status command, which runs from cron
+        scraper = fpm_status.get_scraper()
+        series = scraper.series(website)
+        current = scraper.is_current(series)
+
+        pool = fpm.pool_settings(website)
+        slowlog_path = filesystem.get_website_paths(website).get('slowlog_path')
+        return Response({
+            'pool': pool,
+            'current': current,
+            'message': None if current else ('There are no recent samples of the PHP-FPM pool. The '
+                                             'scrape-fpm-status command must run from cron, and the pool '
+                                             'must be running.'),
+            'status': series.last(),
+            'saturation': fpm_status.saturation(series, pool.get('max_children')),
+            'samples': series.samples(),
+            'slowlog': fpm_status.read_slowlog(slowlog_path)
+        })
+
+class ProvisioningView(APIView):
+    """Returns the status of a website provisioning and of each of its steps."""
+    http_method_names = ['get']
+
+    def get(self, request, *args, **kwargs):
+        provisionings = Provisioning.objects.filter(pk=kwargs.get('provisioning_id'))
+        if not request.user.is_superuser:
+            provisionings = provisionings.filter(website__user=request.user)
+        provisioning = provisionings.first()
+        if not provisioning:
+            return Response({
+                'message': 'The provisioning was not found.'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        return Response(serializers.ProvisioningSerializer(provisioning).data)
+
+class BulkCreateView(APIView):
+    """Create websites in bulk from a manifest.
+
+    Accepts a JSON body with a websites list, or an uploaded CSV or JSON manifest file. The websites
+    are set up in the background and the services are reloaded once for all of them.
+    """
+    http_method_names = ['post']
+    permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        manifest = request.FILES.get('manifest')
+        if manifest:
+            fmt = 'csv' if manifest.name.lower().endswith('.csv') else 'json'
+            try:
+                websites = read_manifest(manifest.read().decode('utf-8-sig'), fmt)
+            except (ValueError, UnicodeDecodeError) as e:
+                return Response({
+                    'manifest': [str(e)]
+                }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        else:
+            websites = request.data.get('websites')
+
+        s = serializers.BulkCreateSerializer(data={'websites': websites})
+        if not s.is_valid():
+            return Response(s.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        provisionings = BulkCreateService().create(s.validated_data)
+        return Response({
+            'message': f'{len(provisionings)} websites have been added, they are being set up in the background.',
+            'provisionings': serializers.ProvisioningSerializer(provisionings, many=True).data
+        }, status=status.HTTP_201_CREATED)
+
 class PhpVersionsView(APIView):
     """Gets the list of supported PHP versions."""
     http_method_names = ['get']
@@ -196,3 +537,16 @@ class WebsiteViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(label__icontains=search_q)
 
         return queryset
+
+    def create(self, request, *args, **kwargs):
+        """Create a website.
+
+        The website is set up in the background, the response contains the provisioning
+        with the status of each step.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        data = serializer.data
+        data['provisioning'] = serializers.ProvisioningSerializer(serializer.instance.provisioning).data
+        return Response(data, status=status.HTTP_201_CREATED)
@@ -1,4 +1,5 @@
 from django_cron import CronJobBase, Schedule
+from django.conf import settings
 from django.core.management import call_command
 
 
@@ -21,4 +22,39 @@ class ProcessSsls(CronJobBase):
         In this method, we write the CRON job task or the logic.
         """
         call_command('activate-ssl')
-    
+
+
+class ReconcileConfigs(CronJobBase):
+    """Reconcile configs.
+
+    Rewrites the vhost and PHP-FPM pool files that drifted from the database, e.g. after a crash or a
+    manual edit, and removes the ones of deleted websites.
+
+    Attributes:
+        schedule (object): The schedule of this CRON class. It will execute every X minutes.
+        code (str): A unique string to distinguish this CRON class among others.
+    """
+    schedule = Schedule(run_every_mins=60)
+    code = 'fastcp.reconcile_configs'
+
+    def do(self):
+        """Executes the logic."""
+        call_command('reconcile-configs')
+
+
+class ScrapeFpmStatus(CronJobBase):
+    """Scrape the PHP-FPM status.
+
+    Adds a sample of the status of the PHP-FPM pool of each website to the store that the pool
+    status page reads.
+
+    Attributes:
+        schedule (object): The schedule of this CRON class. It will execute every X minutes.
+        code (str): A unique string to distinguish this CRON class among others.
+    """
+    schedule = Schedule(run_every_mins=max(1, round(settings.FASTCP_FPM_STATUS_INTERVAL / 60)))
+    code = 'fastcp.scrape_fpm_status'
+
+    def do(self):
+        """Executes the logic."""
+        call_command('scrape-fpm-status')
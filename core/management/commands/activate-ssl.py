@@ -1,34 +1,43 @@
+import time
+
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from core.models import Website
-from api.websites.services.ssl import FastcpSsl
-from core.signals import domains_updated
-from core.utils.system import ssl_expiring
+from api.websites.services.renewal import RenewalEngine
 
 
 class Command(BaseCommand):
     help = 'Activate SSL.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.FASTCP_SSL_RENEW_WORKERS,
+                            help='Number of websites processed concurrently.')
+
     def handle(self, *args, **options):
-        websites = Website.objects.all()
-        
-        self.stdout.write(self.style.WARNING(f'Attempting to get/renew SSL certificates for {websites.count()} websites.'))
-        for website in websites:
-            if website.needs_ssl() or ssl_expiring(website):
-                try:
-                    fcp = FastcpSsl()
-                    activated = fcp.get_ssl(website)
+        started = time.monotonic()
+        report = RenewalEngine(
+            workers=options['workers'],
+            orders=settings.FASTCP_SSL_ORDERS_PER_WINDOW,
+            window=settings.FASTCP_SSL_ORDER_WINDOW
+        ).run()
+        elapsed = time.monotonic() - started
 
-                    if activated:
-                        self.stdout.write(self.style.SUCCESS(
-                            f'[{website}] SSL certificate activated for website.'))
-                        website.has_ssl = True
-                        website.save()
-                        domains_updated.send(sender=website)
-                    else:
-                        self.stdout.write(self.style.ERROR(
-                            f'[{website}] SSL certificate cannot be activated for some or all domains.'))
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f'{str(e)}'))
+        for website in report['activated']:
+            self.stdout.write(self.style.SUCCESS(f'[{website}] SSL certificate activated for website.'))
+        for website in report['unverified']:
+            self.stdout.write(self.style.ERROR(
+                f'[{website}] SSL certificate cannot be activated, none of the domains is resolving.'))
+        for website in report['deferred']:
+            self.stdout.write(self.style.WARNING(
+                f'[{website}] SSL certificate deferred to the next run, the order rate limit has been reached.'))
+        for error in report['errors']:
+            self.stdout.write(self.style.ERROR(error))
+        for service, success in report['reloaded'].items():
+            if success:
+                self.stdout.write(self.style.SUCCESS(f'Reloaded {service}.'))
             else:
-                self.stdout.write(self.style.SUCCESS(
-                    f'Website {website} does not need an SSL.'))
+                self.stdout.write(self.style.ERROR(f'{service} cannot be reloaded, its changes have been rolled back.'))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(report["activated"])} activated, {len(report["failed"])} failed, {len(report["unverified"])} '
+            f'unverified and {len(report["deferred"])} deferred SSL certificates, {report["skipped"]} websites '
+            f'did not need one, in {elapsed:.2f}s.'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from core.models import Website
+from core.utils.system import expiring_websites, update_ssl_metadata
+
+
+class Command(BaseCommand):
+    help = 'Store the expiry, issuer, key type and domains of the SSL certificates that are already on disk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Read the certificates of all websites, not only of the ones without metadata.')
+
+    def handle(self, *args, **options):
+        websites = Website.objects.select_related('user').prefetch_related('domains')
+        if not options['all']:
+            websites = websites.filter(ssl_not_after__isnull=True)
+
+        stored = 0
+        for website in websites:
+            if update_ssl_metadata(website):
+                stored += 1
+                self.stdout.write(f'[{website}] {website.ssl_key_type} certificate issued by {website.ssl_issuer}, '
+                                  f'expires on {website.ssl_not_after:%Y-%m-%d}.')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored the metadata of {stored} SSL certificates, {expiring_websites().count()} websites '
+            f'need a renewal.'))
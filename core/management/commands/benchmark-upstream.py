@@ -0,0 +1,147 @@
+import http.client
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# TCP states in /proc/net/tcp
+TCP_TIME_WAIT = '06'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answers every request like a small PHP page would, keeping the connection open if asked to."""
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are written separately, Nagle would hold the body back on reused connections
+    disable_nagle_algorithm = True
+    body = b'x' * 2048
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def time_wait_sockets(port: int) -> int:
+    """Returns the number of local sockets to or from a port in the TIME_WAIT state, None if unknown."""
+    count = 0
+    try:
+        for path in ['/proc/net/tcp', '/proc/net/tcp6']:
+            with open(path) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    ports = {int(address.rsplit(':', 1)[1], 16) for address in fields[1:3]}
+                    if fields[3] == TCP_TIME_WAIT and port in ports:
+                        count += 1
+    except (OSError, StopIteration, IndexError, ValueError):
+        return None
+    return count
+
+
+class Command(BaseCommand):
+    help = ('Compare the requests per second that NGINX gets out of Apache when it opens a new connection '
+            'for each request and when it reuses keepalive connections.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', help='host:port of the backend, a local Apache stand-in is started if not set.')
+        parser.add_argument('--host', default='localhost', help='Host header of the requests.')
+        parser.add_argument('--path', default='/', help='Path of the requests.')
+        parser.add_argument('--requests', type=int, default=5000, help='Number of requests of each run.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Number of concurrent clients.')
+
+    def handle(self, *args, **options):
+        server = None
+        if options['target']:
+            host, _, port = options['target'].rpartition(':')
+            if not host or not port.isdigit():
+                raise CommandError('The target should be host:port.')
+            port = int(port)
+        else:
+            server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            host, port = server.server_address
+            self.stdout.write(f'Started an Apache stand-in on {host}:{port}.')
+
+        try:
+            results = {}
+            for name, keepalive in [('new connection per request', False), ('keepalive upstream', True)]:
+                results[keepalive] = self.run(host, port, keepalive, options)
+                rate, errors, time_wait = results[keepalive]
+                line = f'{name}: {rate:.0f} requests/s, {errors} errors'
+                if time_wait is not None:
+                    line += f', {time_wait} sockets in TIME_WAIT'
+                self.stdout.write(line)
+                # Let the sockets of the previous run expire from the counts of the next one
+                time.sleep(1)
+        finally:
+            if server:
+                server.shutdown()
+                server.server_close()
+
+        if results[False][0]:
+            self.stdout.write(self.style.SUCCESS(
+                f'Keepalive connections serve {results[True][0] / results[False][0]:.2f}x the requests per second.'))
+
+    def run(self, host: str, port: int, keepalive: bool, options: dict) -> tuple:
+        """Send the requests of a run.
+
+        With keepalive, each client reuses its connection for up to NGINX_UPSTREAM_KEEPALIVE_REQUESTS
+        requests, like NGINX does with the connections of the upstream.
+
+        Returns:
+            tuple: The requests per second, the number of failed requests and the number of sockets
+                   in TIME_WAIT after the run.
+        """
+        clients = max(1, options['concurrency'])
+        per_client = max(1, options['requests'] // clients)
+        headers = {'Host': options['host']}
+        if not keepalive:
+            headers['Connection'] = 'close'
+        errors = [0] * clients
+        before = time_wait_sockets(port)
+
+        def client(i):
+            connection = None
+            served = 0
+            for _ in range(per_client):
+                if connection is None:
+                    connection = http.client.HTTPConnection(host, port, timeout=10)
+                try:
+                    connection.request('GET', options['path'], headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    served += 1
+                    if response.status >= 500:
+                        errors[i] += 1
+                except (OSError, http.client.HTTPException):
+                    errors[i] += 1
+                    response = None
+
+                if not keepalive or response is None or response.will_close or \
+                        served >= settings.NGINX_UPSTREAM_KEEPALIVE_REQUESTS:
+                    connection.close()
+                    connection = None
+                    served = 0
+            if connection is not None:
+                connection.close()
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        after = time_wait_sockets(port)
+        time_wait = None if before is None or after is None else max(0, after - before)
+        return clients * per_client / elapsed, sum(errors), time_wait
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from api.websites.serializers import BulkCreateSerializer
+from api.websites.services.bulk_create import BulkCreateService, read_manifest
+
+
+class Command(BaseCommand):
+    help = 'Create websites in bulk from a CSV or JSON manifest.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('manifest', help='Path of the manifest file.')
+        parser.add_argument('--format', choices=['csv', 'json'],
+                            help='Format of the manifest, guessed from the file extension by default.')
+
+    def handle(self, *args, **options):
+        path = options['manifest']
+        fmt = options['format'] or ('csv' if path.lower().endswith('.csv') else 'json')
+        try:
+            with open(path, encoding='utf-8-sig') as f:
+                websites = read_manifest(f.read(), fmt)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'The manifest cannot be read: {e}')
+
+        s = BulkCreateSerializer(data={'websites': websites})
+        if not s.is_valid():
+            errors = s.errors.get('websites', [])
+            for i, error in enumerate(errors):
+                if not error:
+                    continue
+                # Errors of a website are keyed by field, the others are about the whole manifest
+                if isinstance(error, dict):
+                    error = f'Website #{i + 1}: {error}'
+                self.stdout.write(self.style.ERROR(str(error)))
+            raise CommandError('The manifest is invalid, no websites have been created.')
+
+        count = len(s.validated_data.get('websites'))
+        self.stdout.write(self.style.WARNING(f'Creating {count} websites.'))
+        started = time.monotonic()
+        provisionings = BulkCreateService().create(s.validated_data, background=False)
+        elapsed = time.monotonic() - started
+
+        completed = 0
+        for provisioning in provisionings:
+            provisioning.refresh_from_db()
+            if provisioning.status == 'completed':
+                completed += 1
+                self.stdout.write(self.style.SUCCESS(f'[{provisioning.website}] Website has been set up.'))
+            else:
+                failed = [f'{step["name"]}: {step["error"]}' for step in provisioning.steps if step['status'] == 'failed']
+                self.stdout.write(self.style.ERROR(f'[{provisioning.website}] Website cannot be set up ({"; ".join(failed)}).'))
+
+        rate = count / elapsed if elapsed > 0 else float(count)
+        self.stdout.write(self.style.SUCCESS(
+            f'{completed} of {count} websites set up in {elapsed:.2f}s ({rate:.2f} websites/s).'))
@@ -0,0 +1,39 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.utils.reconciler import Reconciler
+
+
+class Command(BaseCommand):
+    help = 'Bring the NGINX, Apache and PHP-FPM configs on disk in line with the websites in the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only list the files that would be written or removed.')
+        parser.add_argument('--workers', type=int, default=settings.FASTCP_RECONCILE_WORKERS,
+                            help='Number of threads that render and compare the configs.')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        started = time.monotonic()
+        report = Reconciler(workers=options['workers'], dry_run=dry_run).run()
+        elapsed = time.monotonic() - started
+
+        prefix = 'Would write' if dry_run else 'Written'
+        for path in report['written']:
+            self.stdout.write(self.style.WARNING(f'{prefix}: {path}'))
+        prefix = 'Would remove' if dry_run else 'Removed'
+        for path in report['removed']:
+            self.stdout.write(self.style.WARNING(f'{prefix}: {path}'))
+        for error in report['errors']:
+            self.stdout.write(self.style.ERROR(error))
+        for service, success in report['reloaded'].items():
+            if success:
+                self.stdout.write(self.style.SUCCESS(f'Reloaded {service}.'))
+            else:
+                self.stdout.write(self.style.ERROR(f'{service} cannot be reloaded, its changes have been rolled back.'))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(report["written"])} written, {len(report["removed"])} removed and {report["unchanged"]} '
+            f'unchanged config files in {elapsed:.2f}s.'))
@@ -0,0 +1,14 @@
+import time
+
+from django.core.management.base import BaseCommand
+from core.utils import fpm_status
+
+
+class Command(BaseCommand):
+    help = 'Add a sample of the status of the PHP-FPM pool of each website to the status store.'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        scraped = fpm_status.get_scraper().scrape_all()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Scraped {scraped} PHP-FPM pools in {elapsed:.2f}s.'))
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-19 11:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RemoteFetch',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('url', models.URLField(max_length=2048)),
+                ('path', models.CharField(max_length=4096)),
+                ('name', models.CharField(max_length=255)),
+                ('checksum', models.CharField(blank=True, max_length=128, null=True)),
+                ('algorithm', models.CharField(default='sha256', max_length=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('size', models.BigIntegerField(blank=True, null=True)),
+                ('received', models.BigIntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='remote_fetches', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
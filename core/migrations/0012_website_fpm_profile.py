@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-19 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_provisioning'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='website',
+            name='fpm_profile',
+            field=models.CharField(choices=[('auto', 'Auto'), ('ondemand', 'On demand'), ('dynamic', 'Dynamic'), ('static', 'Static')], default='auto', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='website',
+            name='fpm_max_children',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='website',
+            name='fpm_max_requests',
+            field=models.IntegerField(default=500),
+        ),
+        migrations.AddField(
+            model_name='website',
+            name='fpm_idle_timeout',
+            field=models.IntegerField(default=10),
+        ),
+    ]
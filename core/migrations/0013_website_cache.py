@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_website_fpm_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='website',
+            name='cache_mode',
+            field=models.CharField(choices=[('off', 'Off'), ('micro', 'Microcaching'), ('full', 'Full page')], default='off', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='website',
+            name='cache_ttl',
+            field=models.IntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_website_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='website',
+            name='serving_mode',
+            field=models.CharField(choices=[('apache', 'NGINX + Apache'), ('nginx', 'NGINX only')], default='apache', max_length=10),
+        ),
+    ]
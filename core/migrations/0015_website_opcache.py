@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-19 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_website_serving_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='website',
+            name='opcache_memory',
+            field=models.IntegerField(default=64),
+        ),
+        migrations.AddField(
+            model_name='website',
+            name='opcache_max_files',
+            field=models.IntegerField(default=10000),
+        ),
+        migrations.AddField(
+            model_name='website',
+            name='opcache_revalidate_freq',
+            field=models.IntegerField(default=2),
+        ),
+        migrations.AddField(
+            model_name='website',
+            name='opcache_validate_timestamps',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='website',
+            name='opcache_preload',
+            field=models.BooleanField(default=False),
+        ),
+    ]
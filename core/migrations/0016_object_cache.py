@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_website_opcache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='max_object_cache_memory',
+            field=models.IntegerField(default=64),
+        ),
+        migrations.AddField(
+            model_name='website',
+            name='object_cache',
+            field=models.CharField(choices=[('off', 'Off'), ('redis', 'Redis')], default='off', max_length=10),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_object_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='website',
+            name='ssl_not_after',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='website',
+            name='ssl_issuer',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='website',
+            name='ssl_key_type',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='website',
+            name='ssl_domains',
+            field=models.JSONField(default=list),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_website_ssl_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='website',
+            name='ssl_renew_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='domain',
+            name='ssl_next_attempt',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
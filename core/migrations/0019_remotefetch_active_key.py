@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_ssl_scheduling'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='remotefetch',
+            name='active_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
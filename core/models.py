@@ -1,4 +1,6 @@
+import hashlib
 import os
+import uuid
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser, BaseUserManager
@@ -56,6 +58,8 @@ class User(AbstractUser):
     storage_used = models.FloatField(default=0)
     # Max storage in Bytes a user can consume (1024 bytes == 1kb)
     max_storage = models.FloatField(default=1024)
+    # Max memory in MB of the object cache of each website
+    max_object_cache_memory = models.IntegerField(default=64)
 
     # More customizations
     REQUIRED_FIELDS = []
@@ -92,6 +96,25 @@ for v in php_versions:
 
 class Website(models.Model):
     """Website model holds the websites owned by users."""
+    FPM_PROFILE_CHOICES = (
+        ('auto', 'Auto'),
+        ('ondemand', 'On demand'),
+        ('dynamic', 'Dynamic'),
+        ('static', 'Static'),
+    )
+    SERVING_MODE_CHOICES = (
+        ('apache', 'NGINX + Apache'),
+        ('nginx', 'NGINX only'),
+    )
+    CACHE_MODE_CHOICES = (
+        ('off', 'Off'),
+        ('micro', 'Microcaching'),
+        ('full', 'Full page'),
+    )
+    OBJECT_CACHE_CHOICES = (
+        ('off', 'Off'),
+        ('redis', 'Redis'),
+    )
     user = models.ForeignKey(User, related_name='websites', on_delete=models.CASCADE)
     label = models.CharField(max_length=30, unique=True)
     has_ssl = models.BooleanField(default=False)
@@ -100,6 +123,48 @@ class Website(models.Model):
     is_wp = models.BooleanField(default=False)
     created = models.DateTimeField(auto_now_add=True)
 
+    # PHP-FPM pool profile, see core.utils.fpm
+    fpm_profile = models.CharField(max_length=10, choices=FPM_PROFILE_CHOICES, default='auto')
+    # Max number of PHP workers, derived from the hardware if not set
+    fpm_max_children = models.IntegerField(null=True, blank=True)
+    # Number of requests a worker serves before it's recycled
+    fpm_max_requests = models.IntegerField(default=500)
+    # Seconds an idle worker of an on demand pool is kept alive
+    fpm_idle_timeout = models.IntegerField(default=10)
+
+    # Either NGINX proxies PHP requests to Apache, which honours .htaccess files, or it passes them
+    # to the PHP-FPM pool directly
+    serving_mode = models.CharField(max_length=10, choices=SERVING_MODE_CHOICES, default='apache')
+
+    # NGINX cache in front of PHP, see templates/system/nginx-cache-*.txt
+    cache_mode = models.CharField(max_length=10, choices=CACHE_MODE_CHOICES, default='off')
+    # Seconds a response is cached for
+    cache_ttl = models.IntegerField(default=1)
+
+    # OPcache, see core.utils.opcache. The memory and the max number of files of the websites that
+    # share a PHP version add up to the shared cache of that version.
+    opcache_memory = models.IntegerField(default=64)
+    opcache_max_files = models.IntegerField(default=10000)
+    # Seconds between the checks of the timestamps of the cached scripts
+    opcache_revalidate_freq = models.IntegerField(default=2)
+    # Without the checks, changed scripts are only picked up once the OPcache is reset
+    opcache_validate_timestamps = models.BooleanField(default=True)
+    # Compile the scripts of the website when PHP-FPM starts
+    opcache_preload = models.BooleanField(default=False)
+
+    # Persistent object cache run under the owner of the website, see core.utils.object_cache
+    object_cache = models.CharField(max_length=10, choices=OBJECT_CACHE_CHOICES, default='off')
+
+    # The certificate on disk, read when it's written so expiry checks don't parse it again, see
+    # core.utils.system.update_ssl_metadata
+    ssl_not_after = models.DateTimeField(null=True, blank=True, db_index=True)
+    ssl_issuer = models.CharField(max_length=255, null=True, blank=True)
+    ssl_key_type = models.CharField(max_length=20, null=True, blank=True)
+    ssl_domains = models.JSONField(default=list)
+    # When the certificate is due for renewal, a random point early in its renewal window so the
+    # renewals of certificates issued together don't bunch up
+    ssl_renew_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
     def save(self, *args, **kwargs):
         """Always generate a slug on save."""
         if not self.slug:
@@ -141,6 +206,8 @@ class Domain(models.Model):
     ssl_error = models.TextField(null=True, blank=True)
     ssl_retries = models.IntegerField(default=0)
     ssl_attempted = models.DateTimeField(null=True, blank=True)
+    # A domain that failed is not attempted again before this, see core.utils.system.record_ssl_attempt
+    ssl_next_attempt = models.DateTimeField(null=True, blank=True, db_index=True)
 
     def __str__(self):
         return self.domain
@@ -154,3 +221,100 @@ class Database(models.Model):
 
     def __str__(self):
         return self.name
+
+
+class Upload(models.Model):
+    """Upload model holds the resumable upload sessions of the file manager.
+
+    The received bytes are written to a part file that lives next to the destination, and the
+    ranges that have already been received are tracked so that chunks can be sent in parallel
+    and out of order.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, related_name='uploads', on_delete=models.CASCADE)
+    path = models.CharField(max_length=4096)
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    # Length of the contiguous data received from the start of the file
+    offset = models.BigIntegerField(default=0)
+    # Received byte ranges as a sorted list of [start, end) pairs
+    ranges = models.JSONField(default=list)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def dest_path(self) -> str:
+        """The final location of the uploaded file."""
+        return os.path.join(self.path, self.name)
+
+    @property
+    def part_path(self) -> str:
+        """The temporary file the chunks are written to."""
+        return os.path.join(self.path, f'.{self.name}.{self.id.hex}.part')
+
+    @property
+    def is_complete(self) -> bool:
+        """Check either all of the bytes have been received or not."""
+        return self.offset >= self.size
+
+
+class RemoteFetch(models.Model):
+    """Remote fetch model holds the remote files being downloaded by the file manager."""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, related_name='remote_fetches', on_delete=models.CASCADE)
+    url = models.URLField(max_length=2048)
+    path = models.CharField(max_length=4096)
+    name = models.CharField(max_length=255)
+    checksum = models.CharField(max_length=128, null=True, blank=True)
+    algorithm = models.CharField(max_length=10, default='sha256')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    size = models.BigIntegerField(null=True, blank=True)
+    received = models.BigIntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+    # Digest of the destination while the fetch is pending or running, so only one fetch at a time
+    # can write to the part file of a destination
+    active_key = models.CharField(max_length=64, null=True, blank=True, unique=True, editable=False)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.url
+
+    @property
+    def dest_path(self) -> str:
+        """The location the remote file is saved to."""
+        return os.path.join(self.path, self.name)
+
+    @staticmethod
+    def destination_key(dest_path: str) -> str:
+        """Returns the active_key of the fetches to a destination."""
+        return hashlib.sha256(dest_path.encode('utf-8')).hexdigest()
+
+
+class Provisioning(models.Model):
+    """Provisioning model holds the progress of the steps that set up a website in the background."""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    website = models.ForeignKey(Website, related_name='provisionings', on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    # List of steps with their name, required steps, status and error
+    steps = models.JSONField(default=list)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.website} ({self.status})'
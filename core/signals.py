@@ -6,6 +6,7 @@ from django.dispatch import receiver
 from core.models import Website, User, Database
 from core.utils import system as fcpsys
 from core.utils import filesystem
+from core.utils import reloads
 
 
 
@@ -30,6 +31,8 @@ def update_php_handler(sender, **kwargs):
     sender.php = new_version
     sender.save()
     filesystem.generate_fpm_conf(sender)
+    # The website doesn't count towards the OPcache of its previous version anymore
+    filesystem.generate_opcache_conf(old_version)
 
 update_php.connect(update_php_handler, dispatch_uid='update-php-conf')
 
@@ -59,8 +62,12 @@ domains_updated.connect(domains_updated_handler, dispatch_uid='domains-updated')
 
 @receiver(post_save, sender=Website)
 def setup_website(sender, instance=None, created=False, **kwargs):
-    """Executes when a website is created at first. We will create the data."""
-    if created:
+    """Executes when a website is created at first. We will create the data.
+
+    Websites that are provisioned in the background (see core.utils.system.provision_website)
+    set defer_setup on the instance before saving it.
+    """
+    if created and not getattr(instance, 'defer_setup', False):
         fcpsys.setup_website(instance)
 
 
@@ -81,19 +88,29 @@ create_user.connect(create_user_handler, dispatch_uid='create-user')
 
 
 def restart_services_handler(sender=None, **kwargs):
-    """Restarts services. Expects the service names as a comma-separated string."""
+    """Restarts services. Expects the service names as a comma-separated string.
+
+    The restarts are coalesced and run in the background, pass wait=True to block until
+    the pending restarts are done.
+    """
     services = kwargs.get('services').split(',')
-    for service in services:
-        fcpsys.run_cmd(f'/usr/bin/systemctl restart {service}')
+    reloads.scheduler.schedule(services, 'restart')
+    if kwargs.get('wait'):
+        reloads.scheduler.flush()
 
 restart_services.connect(restart_services_handler, dispatch_uid='restart-services')
 
 
 def reload_services_handler(sender=None, **kwargs):
-    """Reload services. Expects the service names as a comma-separated string."""
+    """Gracefully reload services. Expects the service names as a comma-separated string.
+
+    The reloads are coalesced and run in the background, pass wait=True to block until
+    the pending reloads are done.
+    """
     services = kwargs.get('services').split(',')
-    for service in services:
-        fcpsys.run_cmd(f'/usr/bin/systemctl restart {service}')
+    reloads.scheduler.schedule(services, 'reload')
+    if kwargs.get('wait'):
+        reloads.scheduler.flush()
 
 reload_services.connect(reload_services_handler, dispatch_uid='reload-services')
 
@@ -1,7 +1,32 @@
+import hashlib
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
 import unittest
-from django.test import TestCase
-from .models import Website, User
-from .utils.system import setup_wordpress
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import Encoding
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from .models import Domain, Website, User
+from .utils.filesystem import read_lines, render_opcache_conf, tail_lines, write_config
+from .utils.downloader import Downloader, DownloadError
+from .utils.http import RangeNotSatisfiable, parse_range_header, sse_stream
+from .utils.system import expiring_websites, setup_wordpress, ssl_expiring
+from .utils import filesystem, fpm, fpm_status, nginx_cache, object_cache, reloads, watchers
+from .utils.fastcgi import HEADER, FCGI_END_REQUEST, FCGI_PARAMS, FCGI_STDIN, FCGI_STDOUT, encode_record
+from .utils.reconciler import Reconciler
+from .utils.reloads import ReloadScheduler
+from .utils.pipeline import Pipeline, Step
 
 # Create your tests here.
 class TestWordPressDeploy(TestCase):
@@ -21,3 +46,800 @@ class TestWordPressDeploy(TestCase):
     def test_wp_deploy(self):
         w = Website.objects.first()
         setup_wordpress(w)
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """Serves the test payload with support for single byte ranges."""
+    payload = b''
+    ranges = True
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def send_payload(self, body=True):
+        data = self.payload
+        range_header = self.headers.get('Range')
+        self.requests.append(range_header)
+        if self.ranges and range_header:
+            start, end = range_header.split('=')[1].split('-')
+            start, end = int(start), int(end or len(data) - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+            data = data[start:end + 1]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', '"payload"')
+        if self.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+    def do_HEAD(self):
+        self.send_payload(body=False)
+
+    def do_GET(self):
+        self.send_payload()
+
+
+class TestDownloader(SimpleTestCase):
+
+    def setUp(self) -> None:
+        RangeRequestHandler.payload = os.urandom(300000)
+        RangeRequestHandler.ranges = True
+        RangeRequestHandler.requests = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/backup.zip'
+        self.tmp_dir = tempfile.mkdtemp()
+        self.dest_path = os.path.join(self.tmp_dir, 'backup.zip')
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    @mock.patch('core.utils.downloader.MIN_SEGMENT_SIZE', 50000)
+    def test_concurrent_ranges(self):
+        checksum = hashlib.sha256(RangeRequestHandler.payload).hexdigest()
+        Downloader(self.url, self.dest_path, connections=4).download(checksum=checksum)
+        with open(self.dest_path, 'rb') as f:
+            self.assertEqual(f.read(), RangeRequestHandler.payload)
+        self.assertEqual(len([r for r in RangeRequestHandler.requests if r]), 4)
+        self.assertEqual(os.listdir(self.tmp_dir), ['backup.zip'])
+
+    @mock.patch('core.utils.downloader.MIN_SEGMENT_SIZE', 50000)
+    def test_resume(self):
+        downloader = Downloader(self.url, self.dest_path, connections=2)
+        with mock.patch.object(downloader, '_verify', side_effect=DownloadError('interrupted')):
+            with self.assertRaises(DownloadError):
+                downloader.download()
+
+        RangeRequestHandler.requests = []
+        downloader = Downloader(self.url, self.dest_path, connections=2)
+        downloader.download()
+        with open(self.dest_path, 'rb') as f:
+            self.assertEqual(f.read(), RangeRequestHandler.payload)
+        # Nothing is left to fetch, only the probe hits the server
+        self.assertEqual(RangeRequestHandler.requests, [None])
+
+    def test_without_ranges(self):
+        RangeRequestHandler.ranges = False
+        Downloader(self.url, self.dest_path).download()
+        with open(self.dest_path, 'rb') as f:
+            self.assertEqual(f.read(), RangeRequestHandler.payload)
+
+    def test_checksum_mismatch(self):
+        with self.assertRaises(DownloadError):
+            Downloader(self.url, self.dest_path).download(checksum='0' * 64)
+        self.assertFalse(os.path.exists(self.dest_path))
+
+    def test_disk_errors(self):
+        # The part file cannot be preallocated, e.g. the disk is full
+        downloader = Downloader(self.url, self.dest_path)
+        with mock.patch('core.utils.downloader.open', side_effect=OSError(28, 'No space left on device')):
+            with self.assertRaises(DownloadError):
+                downloader.download()
+
+        downloader = Downloader(self.url, self.dest_path)
+        with mock.patch('core.utils.downloader.os.link', side_effect=OSError), \
+                mock.patch('core.utils.downloader.os.rename', side_effect=PermissionError):
+            with self.assertRaises(DownloadError):
+                downloader.download()
+
+
+class TestRangeHeader(SimpleTestCase):
+
+    def test_parse_range_header(self):
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range_header('bytes=500-', 1000), (500, 999))
+        self.assertEqual(parse_range_header('bytes=900-5000', 1000), (900, 999))
+        self.assertEqual(parse_range_header('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range_header('bytes=-5000', 1000), (0, 999))
+        self.assertIsNone(parse_range_header(None, 1000))
+        self.assertIsNone(parse_range_header('bytes=0-1,5-6', 1000))
+        self.assertIsNone(parse_range_header('items=0-1', 1000))
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range_header('bytes=1000-', 1000)
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range_header('bytes=10-5', 1000)
+
+
+class TestEventStream(SimpleTestCase):
+
+    def test_max_duration(self):
+        subscription = mock.Mock(dropped=0)
+        subscription.get.side_effect = lambda timeout: time.sleep(timeout) or []
+
+        started = time.monotonic()
+        chunks = list(sse_stream(subscription, keepalive=0.1, max_duration=0.35))
+        self.assertLess(time.monotonic() - started, 0.6)
+        self.assertEqual(chunks[:3], [': keepalive\n\n'] * 3)
+        self.assertEqual(chunks[-1], 'event: reconnect\ndata: null\n\n')
+        subscription.close.assert_called_once()
+
+    def test_last_id(self):
+        subscription = mock.Mock(dropped=0)
+        batches = [[('lines', ['a'], 12)]]
+        subscription.get.side_effect = lambda timeout: batches.pop() if batches else time.sleep(timeout) or []
+        chunks = list(sse_stream(subscription, keepalive=0.05, max_duration=0.2, last_id=3))
+        # The reconnecting client resumes after the last lines it got
+        self.assertEqual(chunks[0], 'id: 3\n\n')
+        self.assertEqual(chunks[1], 'id: 12\nevent: lines\ndata: ["a"]\n\n')
+        self.assertEqual(chunks[-1], 'id: 12\nevent: reconnect\ndata: null\n\n')
+
+
+class TestFileWindows(SimpleTestCase):
+
+    def setUp(self) -> None:
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write(''.join(f'line {i}\n' for i in range(1, 1001)))
+
+    def tearDown(self) -> None:
+        os.remove(self.path)
+
+    def test_tail_lines(self):
+        data, start, end, truncated = tail_lines(self.path, 3, block_size=16)
+        self.assertEqual(data, b'line 998\nline 999\nline 1000\n')
+        self.assertEqual(end, os.path.getsize(self.path))
+        self.assertEqual(start, end - len(data))
+        self.assertFalse(truncated)
+        data, start, end, truncated = tail_lines(self.path, 5000)
+        self.assertEqual(start, 0)
+        self.assertFalse(truncated)
+        data, start, end, truncated = tail_lines(self.path, 5000, max_bytes=20)
+        self.assertEqual((data, truncated), (b'\nline 999\nline 1000\n', True))
+
+    def test_read_lines(self):
+        data, start, end, truncated = read_lines(self.path, 9, 2)
+        self.assertEqual(data, b'line 10\nline 11\n')
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            self.assertEqual(f.read(end - start), data)
+        self.assertFalse(truncated)
+        self.assertEqual(read_lines(self.path, 5000, 2)[0], b'')
+        self.assertEqual(read_lines(self.path, 9, 2, max_bytes=10), (b'line 10\nli', start, start + 10, True))
+
+    def test_no_line_breaks(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'x' * (4 * 1024 * 1024))
+        data, start, end, truncated = tail_lines(self.path, 1, max_bytes=1024 * 1024)
+        self.assertEqual((len(data), start, truncated), (1024 * 1024, 3 * 1024 * 1024, True))
+        data, start, end, truncated = read_lines(self.path, 0, 1, max_bytes=1024 * 1024)
+        self.assertEqual((len(data), end, truncated), (1024 * 1024, 1024 * 1024, True))
+
+    def test_large_file(self):
+        # A sparse 3 GB log, only its last lines are ever read
+        with open(self.path, 'r+b') as f:
+            f.truncate(3 * 1024 ** 3)
+            f.seek(0, os.SEEK_END)
+            f.write(b'\n' + ''.join(f'line {i}\n' for i in range(1, 201)).encode())
+        started = time.monotonic()
+        data, start, end, truncated = tail_lines(self.path, 200)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(data.splitlines()[0], b'line 1')
+        self.assertFalse(truncated)
+        # The sparse part has no line breaks
+        data, start, end, truncated = read_lines(self.path, 1000, 1)
+        self.assertEqual((len(data), truncated), (1024 * 1024, True))
+
+
+class TestWatchers(SimpleTestCase):
+
+    def setUp(self) -> None:
+        # The polling backend behaves the same everywhere
+        self.watcher = watchers.Watcher(poll_interval=0.05, polling=True)
+        patcher = mock.patch('core.utils.watchers.get_watcher', return_value=self.watcher)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'access.log')
+        with open(self.path, 'w') as f:
+            f.write('old line\n')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp_dir)
+
+    def append(self, data: str, mode: str = 'a') -> None:
+        # Give the poller a chance to see every change separately
+        time.sleep(0.1)
+        with open(self.path, mode) as f:
+            f.write(data)
+
+    def receive(self, subscription: object, count: int) -> list:
+        messages = []
+        deadline = time.monotonic() + 5
+        while len(messages) < count and time.monotonic() < deadline:
+            messages += subscription.get(0.1)
+        return messages
+
+    def test_follow(self):
+        first = watchers.follow(self.path)
+        second = watchers.follow(self.path)
+        self.assertIs(first.channel, second.channel)
+
+        self.assertEqual(first.offset, 9)
+        self.append('line 1\nline')
+        self.append(' 2\n')
+        expected = [('lines', ['line 1'], 16), ('lines', ['line 2'], 23)]
+        self.assertEqual(self.receive(first, 2), expected)
+        self.assertEqual(self.receive(second, 2), expected)
+
+        first.close()
+        self.assertEqual(len(self.watcher._callbacks), 1)
+        second.close()
+        self.assertEqual(self.watcher._callbacks, {})
+
+    def test_rotation(self):
+        subscription = watchers.follow(self.path)
+        os.rename(self.path, f'{self.path}.1')
+        self.append('new file\n', 'w')
+        self.assertEqual(self.receive(subscription, 2), [('rotate', None), ('lines', ['new file'], 9)])
+        self.append('x\n', 'w')
+        self.assertEqual(self.receive(subscription, 2), [('truncate', None), ('lines', ['x'], 2)])
+        subscription.close()
+
+    def test_watch_directory(self):
+        subscription = watchers.watch_directory(self.tmp_dir)
+        self.append('line\n')
+        self.append('line\n')
+        new_path = os.path.join(self.tmp_dir, 'error.log')
+        open(new_path, 'w').close()
+        time.sleep(0.1)
+        os.remove(new_path)
+
+        events = [data for _, data in self.receive(subscription, 3)]
+        self.assertEqual(events, [
+            {'event': 'modify', 'name': 'access.log'},
+            {'event': 'add', 'name': 'error.log'},
+            {'event': 'remove', 'name': 'error.log'},
+        ])
+        subscription.close()
+        self.assertEqual(self.watcher._callbacks, {})
+
+
+class TestReloadScheduler(SimpleTestCase):
+
+    def setUp(self) -> None:
+        self.calls = []
+        self.done = threading.Event()
+        self.scheduler = ReloadScheduler(debounce=0.2)
+        self.scheduler.run = self.run_action
+
+    def run_action(self, service: str, action: str) -> bool:
+        self.calls.append((service, action))
+        self.done.set()
+        return True
+
+    def test_coalesce(self):
+        self.scheduler.schedule(['nginx'], 'reload')
+        self.scheduler.schedule(['nginx', 'apache2'], 'reload')
+        self.scheduler.schedule(['php8.1-fpm'], 'restart')
+        self.scheduler.schedule(['php8.1-fpm'], 'reload')
+        self.assertEqual(self.calls, [])
+        self.assertTrue(self.done.wait(5))
+        time.sleep(0.1)
+        self.assertEqual(sorted(self.calls), [
+            ('apache2', 'reload'), ('nginx', 'reload'), ('php8.1-fpm', 'restart')])
+
+    def test_write_config(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'site.conf')
+        with mock.patch('core.utils.reloads.scheduler', self.scheduler), \
+                mock.patch('core.utils.reloads.get_validator', return_value=None):
+            self.assertTrue(write_config(path, 'server {}', 'nginx'))
+            self.assertFalse(write_config(path, 'server {}', 'nginx'))
+            self.assertTrue(self.done.wait(5))
+            time.sleep(0.3)
+            self.assertEqual(self.calls, [('nginx', 'reload')])
+            self.assertTrue(write_config(path, 'server { listen 80; }', 'nginx'))
+
+    def test_hold(self):
+        with self.scheduler.hold():
+            self.scheduler.schedule(['nginx'], 'reload')
+            time.sleep(0.4)
+            self.assertEqual(self.calls, [])
+            self.scheduler.schedule(['nginx'], 'reload')
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.calls, [('nginx', 'reload')])
+
+    def test_rollback(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        changed = os.path.join(tmp_dir, 'changed.conf')
+        created = os.path.join(tmp_dir, 'created.conf')
+        with open(changed, 'w') as f:
+            f.write('good')
+
+        self.scheduler.track('nginx', changed)
+        with open(changed, 'w') as f:
+            f.write('bad')
+        self.scheduler.track('nginx', changed)
+        self.scheduler.track('nginx', created)
+        with open(created, 'w') as f:
+            f.write('bad')
+        self.scheduler.schedule(['nginx'], 'reload')
+
+        with mock.patch('core.utils.reloads.get_validator', return_value=['/bin/false']):
+            self.assertEqual(self.scheduler.flush(), {'nginx': False})
+        self.assertEqual(self.calls, [])
+        with open(changed) as f:
+            self.assertEqual(f.read(), 'good')
+        self.assertFalse(os.path.exists(created))
+
+    def test_flush(self):
+        self.scheduler.schedule(['nginx'], 'reload')
+        self.assertEqual(self.scheduler.flush(), {'nginx': True})
+        self.assertEqual(self.calls, [('nginx', 'reload')])
+        self.assertEqual(self.scheduler.flush(), {})
+        # The cancelled timer never runs the batch again
+        time.sleep(0.3)
+        self.assertEqual(self.calls, [('nginx', 'reload')])
+
+
+class TestPipeline(SimpleTestCase):
+
+    def test_run(self):
+        # The independent steps must run at the same time to pass the barrier
+        barrier = threading.Barrier(2, timeout=5)
+        order = []
+
+        def fail():
+            raise OSError('Step failed.')
+
+        steps = [
+            Step('download', barrier.wait),
+            Step('directories', barrier.wait),
+            Step('install', lambda: order.append('install'), requires=['download', 'directories']),
+            Step('database', fail),
+            Step('config', lambda: order.append('config'), requires=['database']),
+        ]
+        changes = []
+        pipeline = Pipeline(steps, workers=4, on_change=lambda step, status, error: changes.append((step.name, status)))
+        self.assertFalse(pipeline.run())
+        self.assertEqual(order, ['install'])
+        self.assertEqual(pipeline.statuses, {
+            'download': 'completed',
+            'directories': 'completed',
+            'install': 'completed',
+            'database': 'failed',
+            'config': 'skipped',
+        })
+        self.assertEqual(pipeline.errors, {'database': 'Step failed.'})
+        self.assertIn(('install', 'running'), changes)
+
+    def test_invalid_graph(self):
+        with self.assertRaises(ValueError):
+            Pipeline([Step('a', print, requires=['b']), Step('b', print, requires=['a'])])
+        with self.assertRaises(ValueError):
+            Pipeline([Step('a', print, requires=['missing'])])
+
+
+class TestReconciler(TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.nginx_root = os.path.join(self.tmp_dir, 'nginx')
+        self.apache_root = os.path.join(self.tmp_dir, 'apache')
+        self.pool_root = os.path.join(self.tmp_dir, 'php', '8.1', 'fpm', 'pool.d')
+        for path in [self.nginx_root, self.apache_root, self.pool_root]:
+            os.makedirs(path)
+
+        user = User.objects.create(username='reconcile')
+        website = Website(user=user, label='reconciled', php='8.1')
+        website.defer_setup = True
+        website.save()
+        website.domains.create(domain='reconciled.test')
+
+    def test_run(self):
+        orphan = os.path.join(self.nginx_root, 'deleted.conf')
+        with open(orphan, 'w') as f:
+            f.write('# Added by FastCP.\n')
+        os.makedirs(os.path.join(self.nginx_root, 'deleted.d'))
+        custom = os.path.join(self.nginx_root, 'custom.conf')
+        with open(custom, 'w') as f:
+            f.write('server {}\n')
+
+        calls = []
+        settings = override_settings(NGINX_VHOSTS_ROOT=self.nginx_root, APACHE_VHOST_ROOT=self.apache_root,
+                                     PHP_INSTALL_PATH=os.path.join(self.tmp_dir, 'php'),
+                                     FILE_MANAGER_ROOT=os.path.join(self.tmp_dir, 'users'))
+        with settings, mock.patch('core.utils.reloads.get_validator', return_value=None), \
+                mock.patch.object(reloads.scheduler, 'run', lambda service, action: calls.append(service) or True):
+            report = Reconciler(workers=2).run()
+            # The vhost, the Apache vhost, the pool, the upstream shared by the vhosts and the
+            # OPcache config of the PHP version
+            self.assertEqual(len(report['written']), 5)
+            self.assertEqual(report['removed'], [orphan])
+            self.assertEqual(sorted(calls), ['apache2', 'nginx', 'php8.1-fpm'])
+            self.assertTrue(os.path.exists(custom))
+            self.assertFalse(os.path.exists(os.path.join(self.nginx_root, 'deleted.d')))
+            self.assertTrue(os.path.exists(os.path.join(self.pool_root, 'reconciled.conf')))
+            with open(os.path.join(self.nginx_root, 'reconciled.conf')) as f:
+                self.assertIn('proxy_pass http://fastcp_apache;', f.read())
+            with open(os.path.join(self.nginx_root, '_fastcp_apache.conf')) as f:
+                self.assertIn('upstream fastcp_apache {', f.read())
+
+            calls.clear()
+            report = Reconciler(workers=2).run()
+            self.assertEqual((report['written'], report['removed'], report['unchanged']), ([], [], 5))
+            self.assertEqual(calls, [])
+
+    def test_nginx_serving_mode(self):
+        settings = override_settings(NGINX_VHOSTS_ROOT=self.nginx_root, APACHE_VHOST_ROOT=self.apache_root,
+                                     PHP_INSTALL_PATH=os.path.join(self.tmp_dir, 'php'),
+                                     NGINX_CACHE_ROOT=os.path.join(self.tmp_dir, 'cache'),
+                                     FILE_MANAGER_ROOT=os.path.join(self.tmp_dir, 'users'))
+        with settings, mock.patch('core.utils.reloads.get_validator', return_value=None), \
+                mock.patch.object(reloads.scheduler, 'run', return_value=True):
+            Reconciler().run()
+            Website.objects.update(serving_mode='nginx', cache_mode='micro')
+            report = Reconciler().run()
+
+            # The Apache vhost is gone but its includes are kept
+            self.assertEqual(report['removed'], [os.path.join(self.apache_root, 'reconciled.conf')])
+            self.assertTrue(os.path.isdir(os.path.join(self.apache_root, 'reconciled.d')))
+            with open(os.path.join(self.nginx_root, 'reconciled.conf')) as f:
+                vhost = f.read()
+            self.assertIn('fastcgi_pass unix:', vhost)
+            self.assertIn('fastcgi_cache fastcp_reconciled;', vhost)
+            self.assertNotIn('proxy_pass', vhost)
+
+
+class TestFpmProfiles(SimpleTestCase):
+
+    def setUp(self) -> None:
+        fpm._auto_limits.clear()
+        self.addCleanup(fpm._auto_limits.clear)
+        patcher = mock.patch('core.utils.fpm.hardware_info', return_value={
+            'ram': {'memory': {'total': 4 * 1024 ** 3}}, 'cpu': {'logical': 2}})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_auto_max_children(self):
+        # 60% of 4 GB is 38 workers of 64 MB, capped at 4 per CPU
+        self.assertEqual(fpm.auto_max_children(pools=1), 8)
+        self.assertEqual(fpm.auto_max_children(pools=10), 3)
+        self.assertEqual(fpm.auto_max_children(pools=200), fpm.MIN_CHILDREN)
+
+    def test_pool_settings(self):
+        website = Website(fpm_profile='dynamic', fpm_max_children=12, fpm_max_requests=100)
+        pool = fpm.pool_settings(website)
+        self.assertEqual((pool['pm'], pool['max_children'], pool['max_requests']), ('dynamic', 12, 100))
+        self.assertTrue(pool['min_spare_servers'] <= pool['start_servers'] <= pool['max_spare_servers'])
+
+        website = Website(fpm_profile='auto', fpm_max_children=12)
+        with mock.patch('core.utils.fpm.Website.objects.count', return_value=10):
+            pool = fpm.pool_settings(website)
+        self.assertEqual((pool['pm'], pool['max_children']), ('ondemand', 3))
+
+
+class TestFpmStatus(SimpleTestCase):
+
+    def serve_status(self, socket_path: str, body: bytes) -> dict:
+        """Answer a single FastCGI request on a unix socket, returns the params of the request."""
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        server.listen(1)
+        self.addCleanup(server.close)
+        params = {}
+
+        def serve():
+            conn, _ = server.accept()
+            with conn:
+                reader = conn.makefile('rb')
+                while True:
+                    _, record_type, _, length, padding = HEADER.unpack(reader.read(HEADER.size))
+                    content = reader.read(length + padding)[:length]
+                    if record_type == FCGI_PARAMS and content:
+                        # Short names and values only
+                        while content:
+                            name_len, value_len = content[0], content[1]
+                            name = content[2:2 + name_len].decode()
+                            params[name] = content[2 + name_len:2 + name_len + value_len].decode()
+                            content = content[2 + name_len + value_len:]
+                    if record_type == FCGI_STDIN and not content:
+                        break
+                response = b'Content-Type: application/json\r\n\r\n' + body
+                conn.sendall(encode_record(FCGI_STDOUT, response) + encode_record(FCGI_END_REQUEST, bytes(8)))
+
+        threading.Thread(target=serve, daemon=True).start()
+        return params
+
+    def test_fetch_status(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        socket_path = os.path.join(tmp_dir, 'site.sock')
+        params = self.serve_status(socket_path, b'{"pool": "site", "listen queue": 3, "idle processes": 1, '
+                                                b'"active processes": 5, "total processes": 6, "max children reached": 2, '
+                                                b'"slow requests": 7, "accepted conn": 100}')
+        status = fpm_status.fetch_status(socket_path)
+        self.assertEqual(params['SCRIPT_NAME'], fpm.STATUS_PATH)
+        self.assertEqual((status['listen_queue'], status['active_processes'], status['slow_requests']), (3, 4, 7))
+
+    def test_time_series(self):
+        series = fpm_status.TimeSeries(fpm_status.STATUS_FIELDS, capacity=3)
+        for i in range(5):
+            series.append(i, {'active_processes': i, 'slow_requests': i * 2})
+        samples = series.samples()
+        self.assertEqual(samples['time'], [2, 3, 4])
+        self.assertEqual(series.last()['active_processes'], 4)
+        summary = fpm_status.saturation(series, max_children=8)
+        self.assertEqual((summary['peak_active'], summary['peak_utilization'], summary['slow_requests']), (4, 0.5, 4))
+
+    def test_scraper_store(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        socket_path = os.path.join(tmp_dir, 'site.sock')
+        self.serve_status(socket_path, b'{"pool": "site", "listen queue": 0, "idle processes": 1, '
+                                       b'"active processes": 3, "total processes": 3, "max children reached": 0, '
+                                       b'"slow requests": 0, "accepted conn": 10}')
+        website = mock.Mock(pk=7, slug='site', serving_mode='nginx')
+        store_dir = os.path.join(tmp_dir, 'fpm-status')
+        with mock.patch.object(fpm_status.filesystem, 'get_website_paths', return_value={'socket_path': socket_path}), \
+                mock.patch.object(fpm_status.filesystem, 'get_user_paths', return_value={'logs_path': tmp_dir}):
+            self.assertEqual(fpm_status.StatusScraper(store_dir).scrape(website)['active_processes'], 2)
+
+        # Another process reads the samples from the store
+        series = fpm_status.StatusScraper(store_dir).series(website)
+        self.assertEqual(len(series), 1)
+        self.assertEqual(series.last()['active_processes'], 2)
+        self.assertEqual(len(fpm_status.StatusScraper(store_dir).series(mock.Mock(pk=8))), 0)
+        self.assertTrue(fpm_status.StatusScraper(store_dir).is_current(series))
+        self.assertFalse(fpm_status.StatusScraper(store_dir).is_current(fpm_status.TimeSeries(fpm_status.STATUS_FIELDS, 1)))
+
+    def test_idle_pool(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        website = mock.Mock(pk=7, slug='site', serving_mode='nginx')
+        scraper = fpm_status.StatusScraper(os.path.join(tmp_dir, 'fpm-status'))
+        series = fpm_status.TimeSeries(fpm_status.STATUS_FIELDS, 10)
+        series.append(time.time(), {'active_processes': 0})
+        scraper._save(website, series)
+
+        # Only the HTTP access log of a website without SSL has a new request
+        log_path = os.path.join(tmp_dir, 'site_nginx.access.log')
+        time.sleep(0.01)
+        open(log_path, 'w').close()
+        with mock.patch.object(fpm_status.filesystem, 'get_website_paths', return_value={'socket_path': ''}), \
+                mock.patch.object(fpm_status.filesystem, 'get_user_paths', return_value={'logs_path': tmp_dir}), \
+                mock.patch.object(fpm_status, 'fetch_status', return_value={'active_processes': 0}) as fetch_status:
+            scraper.scrape(website)
+            fetch_status.assert_called_once()
+            # Idle since the last scrape, the last sample is repeated
+            scraper.scrape(website)
+            fetch_status.assert_called_once()
+        self.assertEqual(len(scraper.series(website)), 3)
+
+    def test_read_slowlog(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'site_php.slow.log')
+        entry = ('[19-Oct-2026 10:00:0{}]  [pool site] pid 12{}\n'
+                 'script_filename = /srv/users/u/apps/site/public/index.php\n'
+                 '[0x00007f0000001{}] {}\n'
+                 '[0x00007f0000002{}] main() /srv/users/u/apps/site/public/index.php:3\n\n')
+        with open(path, 'w') as f:
+            f.write(entry.format(1, 1, 1, 'sleep()', 1))
+            f.write(entry.format(2, 2, 2, 'curl_exec()', 2))
+            f.write(entry.format(3, 3, 3, 'sleep()', 3))
+        traces = fpm_status.read_slowlog(path)
+        self.assertEqual([(trace['frames'][0], trace['count']) for trace in traces], [('sleep()', 2), ('curl_exec()', 1)])
+        self.assertEqual(traces[0]['last_seen'], '19-Oct-2026 10:00:03')
+
+
+class TestNginxCache(SimpleTestCase):
+
+    def test_purge(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        website = Website(user=User(username='cache'), slug='cached', php='8.1')
+        cache_path = os.path.join(tmp_dir, 'cached')
+        paths = [nginx_cache.cache_file(cache_path, key) for key in [
+            'https://cached.test/blog/?page=2', 'http://cached.test/blog/?page=2', 'https://cached.test/']]
+        for path in paths:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()
+
+        with override_settings(NGINX_CACHE_ROOT=tmp_dir):
+            self.assertEqual(nginx_cache.purge_url(website, 'https://Cached.test/blog/?page=2'), 2)
+            self.assertFalse(os.path.exists(paths[0]))
+            self.assertTrue(os.path.exists(paths[2]))
+            self.assertEqual(nginx_cache.purge_all(website), 1)
+            self.assertEqual(os.listdir(cache_path), [])
+
+
+class TestOpcache(TestCase):
+
+    def setUp(self) -> None:
+        user = User.objects.create(username='opcache')
+        for label in ['first', 'second']:
+            website = Website(user=user, label=label, php='8.1', opcache_memory=96, opcache_max_files=8000)
+            website.defer_setup = True
+            website.save()
+
+    def test_concurrent_writes(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        running = []
+        overlaps = []
+
+        def render(php, exclude=None):
+            # Each website would see the version with a different number of websites
+            running.append(1)
+            overlaps.append(len(running))
+            time.sleep(0.01)
+            running.pop()
+            return 'conf', os.path.join(tmp_dir, php, 'fpm', 'preload', f'{threading.get_ident()}.php'), 'script'
+
+        results = []
+        with override_settings(PHP_INSTALL_PATH=tmp_dir), \
+                mock.patch('core.utils.filesystem.render_opcache_conf', side_effect=render), \
+                mock.patch.object(reloads.scheduler, 'schedule'):
+            threads = [threading.Thread(target=lambda: results.append(filesystem.generate_opcache_conf('8.1')))
+                       for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(results, [True] * 8)
+        self.assertEqual(max(overlaps), 1)
+        # Only the script of the last write is left
+        self.assertEqual(len(os.listdir(os.path.join(tmp_dir, '8.1', 'fpm', 'preload'))), 1)
+
+    def test_version_settings(self):
+        data, preload_path, _ = render_opcache_conf('8.1')
+        self.assertIn('opcache.memory_consumption = 192\n', data)
+        self.assertIn('opcache.interned_strings_buffer = 24\n', data)
+        self.assertIn('opcache.max_accelerated_files = 16000\n', data)
+        self.assertIsNone(preload_path)
+
+        second = Website.objects.get(label='second')
+        Website.objects.filter(pk=second.pk).update(opcache_preload=True)
+        # The preloaded classes would clash with the ones of the first website
+        _, preload_path, _ = render_opcache_conf('8.1')
+        self.assertIsNone(preload_path)
+
+        first = Website.objects.get(label='first')
+        data, preload_path, script = render_opcache_conf('8.1', exclude=first.pk)
+        self.assertTrue(preload_path.endswith('/8.1/fpm/preload/second.php'))
+        self.assertIn(f'opcache.preload = {preload_path}\nopcache.preload_user = opcache\n', data)
+        self.assertIn(f"foreach (['{second.metadata['path']}', '{second.metadata['pub_path']}'] as $root)", script)
+
+        # A website that is being deleted doesn't count anymore, the defaults of PHP are kept
+        data, preload_path, _ = render_opcache_conf('8.1', exclude=second.pk)
+        self.assertIn('opcache.memory_consumption = 128\n', data)
+        self.assertIsNone(preload_path)
+
+    def test_memory_cap(self):
+        Website.objects.update(opcache_memory=4096)
+        # 15% of 4 GB, then the ceiling of the settings
+        with mock.patch('core.utils.opcache.hardware_info', return_value={'ram': {'memory': {'total': 4 * 1024 ** 3}}}):
+            data, _, _ = render_opcache_conf('8.1')
+            self.assertIn('opcache.memory_consumption = 614\n', data)
+            with override_settings(FASTCP_OPCACHE_MAX_MEMORY=256):
+                data, _, _ = render_opcache_conf('8.1')
+                self.assertIn('opcache.memory_consumption = 256\n', data)
+
+
+class TestObjectCache(TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        user = User.objects.create(username='redis', max_object_cache_memory=32)
+        self.website = Website(user=user, label='cached', php='8.1', object_cache='redis')
+        self.website.defer_setup = True
+        self.website.save()
+
+    def test_wp_config(self):
+        content = ("<?php\ndefine( 'DB_NAME', 'wp' );\n\n/* That's all, stop editing! Happy publishing. */\n"
+                   "require_once ABSPATH . 'wp-settings.php';\n")
+        wired = object_cache.wire_wp_config(content, '/srv/users/redis/run/cached.redis/redis.sock')
+        self.assertIn("define( 'WP_REDIS_PATH', '/srv/users/redis/run/cached.redis/redis.sock' );\n"
+                      "define( 'WP_REDIS_DATABASE', 0 );\n// END FastCP object cache\n\n/* That's all", wired)
+        # Wiring again replaces the constants
+        self.assertEqual(object_cache.wire_wp_config(wired, '/srv/users/redis/run/cached.redis/redis.sock'), wired)
+        self.assertEqual(object_cache.unwire_wp_config(wired), content)
+
+    @unittest.skipUnless(shutil.which('redis-server'), 'redis-server is not installed')
+    def test_stats(self):
+        with override_settings(FILE_MANAGER_ROOT=self.tmp_dir):
+            paths = filesystem.get_website_paths(self.website)
+            os.makedirs(paths.get('redis_path'))
+            conf_path = os.path.join(self.tmp_dir, 'redis.conf')
+            with open(conf_path, 'w') as f:
+                f.write(object_cache.render_conf(self.website))
+
+            server = subprocess.Popen([shutil.which('redis-server'), conf_path], stdout=subprocess.DEVNULL)
+            self.addCleanup(server.wait)
+            self.addCleanup(server.terminate)
+            for _ in range(50):
+                if os.path.exists(paths.get('redis_socket_path')):
+                    break
+                time.sleep(0.1)
+
+            client = object_cache.RedisClient(paths.get('redis_socket_path'))
+            self.assertEqual(client.command('SET', 'alloptions', 'cached'), 'OK')
+            self.assertEqual(client.command('GET', 'alloptions'), b'cached')
+            self.assertIsNone(client.command('GET', 'notoptions'))
+            stats = object_cache.stats(self.website)
+            self.assertEqual((stats['hits'], stats['misses'], stats['hit_ratio'], stats['keys']), (1, 1, 0.5, 1))
+            self.assertEqual(stats['max_memory'], 32 * 1024 * 1024)
+
+
+def make_certificate(domains: list, days: int) -> bytes:
+    """Returns a self-signed certificate for the domains, in PEM format."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(x509.NameOID.COMMON_NAME, domains[0])])
+    now = datetime.now(timezone.utc)
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(
+        key.public_key()).serial_number(x509.random_serial_number()).not_valid_before(
+        now - timedelta(days=1)).not_valid_after(now + timedelta(days=days)).add_extension(
+        x509.SubjectAlternativeName([x509.DNSName(domain) for domain in domains]), critical=False).sign(key, hashes.SHA256())
+    return cert.public_bytes(Encoding.PEM)
+
+
+class TestSslMetadata(TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        settings = override_settings(NGINX_BASE_DIR=self.tmp_dir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        user = User.objects.create(username='certs')
+        for label, days in [('expiring', 10), ('valid', 60)]:
+            website = Website(user=user, label=label, php='8.1', has_ssl=True)
+            website.defer_setup = True
+            website.save()
+            Domain.objects.create(website=website, domain=f'{label}.test', ssl=True)
+            Domain.objects.create(website=website, domain=f'www.{label}.test', ssl=True)
+
+            # Written before the metadata was stored, without the www domain
+            ssl_base = filesystem.get_website_paths(website).get('ssl_base')
+            os.makedirs(ssl_base)
+            with open(os.path.join(ssl_base, 'cert.chain'), 'wb') as f:
+                f.write(make_certificate([f'{label}.test'], days))
+
+    def test_backfill(self):
+        call_command('backfill-ssl-metadata', stdout=open(os.devnull, 'w'))
+
+        website = Website.objects.get(label='expiring')
+        self.assertEqual(website.ssl_key_type, 'EC secp256r1')
+        self.assertEqual(website.ssl_issuer, 'CN=expiring.test')
+        self.assertEqual(website.ssl_domains, ['expiring.test'])
+        self.assertEqual(list(expiring_websites()), [website])
+        self.assertEqual(list(website.domains.filter(ssl=True).values_list('domain', flat=True)), ['expiring.test'])
+
+        # The expiry is read from the database from now on
+        with mock.patch('builtins.open', side_effect=AssertionError):
+            self.assertTrue(ssl_expiring(website))
+            self.assertFalse(ssl_expiring(Website.objects.get(label='valid')))
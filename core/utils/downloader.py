@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+import requests
+
+
+# Size of the blocks read from the responses
+CHUNK_SIZE = 1024 * 1024
+
+# Files smaller than this are never split into multiple connections
+MIN_SEGMENT_SIZE = 4 * 1024 * 1024
+
+# Seconds between two progress reports (and saves of the resume state)
+REPORT_INTERVAL = 1
+
+
+class DownloadError(Exception):
+    """Raised when a remote file cannot be downloaded."""
+
+
+class Downloader(object):
+    """Downloader.
+
+    Downloads a remote file to the disk. The server is probed with a HEAD request first, and if it
+    supports byte ranges, the file is split into segments that are fetched over multiple concurrent
+    connections. Data is written to a hidden part file next to the destination along with a small
+    state file, so an interrupted download resumes where it stopped as long as the remote file has
+    not changed. Once verified, the part file is moved into place.
+
+    Attributes:
+        received (int): Number of bytes on the disk so far.
+        size (int): Size of the remote file, None if the server didn't report it.
+    """
+
+    def __init__(self, url: str, dest_path: str, connections: int = 4, timeout: int = 30,
+                 progress=None) -> None:
+        """Create the downloader.
+
+        Args:
+            url (str): The remote URL.
+            dest_path (str): The path to save the file to.
+            connections (int): Max number of concurrent connections.
+            timeout (int): Connect and read timeout of each request in seconds.
+            progress (callable): Called with the received bytes and the total size as the
+                                 download progresses.
+        """
+        self.url = url
+        self.dest_path = dest_path
+        self.connections = max(1, connections)
+        self.timeout = timeout
+        self.progress = progress
+
+        dirname, name = os.path.split(dest_path)
+        self.part_path = os.path.join(dirname, f'.{name}.part')
+        self.state_path = f'{self.part_path}.json'
+
+        self.received = 0
+        self.size = None
+        self._state = None
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._last_report = 0
+
+    def probe(self) -> dict:
+        """Probe the remote file.
+
+        Returns:
+            dict: The size of the file, whether byte ranges are supported and a validator that
+                  changes when the remote file changes.
+        """
+        try:
+            res = requests.head(self.url, allow_redirects=True, timeout=self.timeout)
+            if res.status_code >= 400:
+                # Some servers don't implement HEAD, the body is never read here
+                res = requests.get(self.url, stream=True, timeout=self.timeout)
+                res.close()
+        except requests.RequestException as e:
+            raise DownloadError(f'The remote server cannot be reached: {e}')
+
+        if res.status_code != 200:
+            raise DownloadError(f'The remote server responded with {res.status_code}.')
+
+        try:
+            size = int(res.headers.get('Content-Length'))
+        except (TypeError, ValueError):
+            size = None
+
+        return {
+            'url': res.url,
+            'size': size,
+            'ranges': bool(size) and res.headers.get('Accept-Ranges', '').lower() == 'bytes',
+            'validator': res.headers.get('ETag') or res.headers.get('Last-Modified')
+        }
+
+    def _load_state(self, info: dict) -> dict:
+        """Load the state of a previous attempt if it can be resumed."""
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if (not os.path.exists(self.part_path) or not info.get('validator')
+                or state.get('size') != info.get('size')
+                or state.get('validator') != info.get('validator')):
+            return None
+        return state
+
+    def _save_state(self) -> None:
+        if self._state is not None:
+            with self._lock:
+                data = json.dumps(self._state)
+            with open(self.state_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+
+    def _plan(self, size: int) -> list:
+        """Split the file into segments of [start, end, received] where end is inclusive."""
+        count = min(self.connections, max(1, size // MIN_SEGMENT_SIZE))
+        step = -(-size // count)
+        return [[start, min(start + step, size) - 1, 0] for start in range(0, size, step)]
+
+    def _report(self, force: bool = False) -> None:
+        """Save the resume state and report the progress. Only called from the calling thread."""
+        now = time.monotonic()
+        if force or now - self._last_report >= REPORT_INTERVAL:
+            self._last_report = now
+            self._save_state()
+            if self.progress:
+                self.progress(self.received, self.size)
+
+    def _fetch_segment(self, fd: int, segment: list) -> None:
+        """Fetch a segment with a range request and write it at its offset."""
+        start, end, done = segment
+        pos = start + done
+        if pos > end:
+            return
+
+        headers = {'Range': f'bytes={pos}-{end}'}
+        with requests.get(self.url, headers=headers, stream=True, timeout=self.timeout) as res:
+            if res.status_code != 206:
+                raise DownloadError(f'The remote server responded with {res.status_code} to a range request.')
+            for chunk in res.iter_content(chunk_size=CHUNK_SIZE):
+                if self._cancelled.is_set():
+                    return
+                chunk = chunk[:end - pos + 1]
+                os.pwrite(fd, chunk, pos)
+                pos += len(chunk)
+                with self._lock:
+                    segment[2] += len(chunk)
+                    self.received += len(chunk)
+                if pos > end:
+                    break
+
+        if pos <= end:
+            raise DownloadError('The connection was closed before the segment was received.')
+
+    def _fetch_all(self, fd: int) -> None:
+        """Fetch the whole file over a single connection."""
+        with requests.get(self.url, stream=True, timeout=self.timeout) as res:
+            if res.status_code != 200:
+                raise DownloadError(f'The remote server responded with {res.status_code}.')
+            for chunk in res.iter_content(chunk_size=CHUNK_SIZE):
+                os.write(fd, chunk)
+                self.received += len(chunk)
+                self._report()
+
+    def _verify(self, checksum: str = None, algorithm: str = 'sha256') -> None:
+        if self._state is not None and self.received != self.size:
+            raise DownloadError('Some segments of the file were not received.')
+
+        if self.size is not None and os.path.getsize(self.part_path) != self.size:
+            raise DownloadError('The size of the downloaded file does not match.')
+
+        if checksum:
+            digest = hashlib.new(algorithm)
+            with open(self.part_path, 'rb') as f:
+                for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    digest.update(block)
+            if digest.hexdigest() != checksum.lower():
+                raise DownloadError('The checksum of the downloaded file does not match.')
+
+    def _move_into_place(self) -> None:
+        """Move the part file to the destination without replacing an existing file."""
+        try:
+            os.link(self.part_path, self.dest_path)
+            os.remove(self.part_path)
+        except FileExistsError:
+            raise DownloadError(f'The destination file {self.dest_path} already exists.')
+        except OSError:
+            # The filesystem doesn't support hard links
+            if os.path.exists(self.dest_path):
+                raise DownloadError(f'The destination file {self.dest_path} already exists.')
+            os.rename(self.part_path, self.dest_path)
+
+    def download(self, checksum: str = None, algorithm: str = 'sha256') -> None:
+        """Download the file.
+
+        Args:
+            checksum (str): Expected hex digest of the file, if any.
+            algorithm (str): The hashing algorithm of the checksum.
+
+        Raises:
+            DownloadError: If the file cannot be downloaded or verified. The part file is kept
+                           so the download can be resumed later.
+        """
+        info = self.probe()
+        self.url = info.get('url')
+        self.size = info.get('size')
+
+        try:
+            if info.get('ranges'):
+                self._state = self._load_state(info)
+                if self._state is None:
+                    self._state = {
+                        'size': self.size,
+                        'validator': info.get('validator'),
+                        'segments': self._plan(self.size)
+                    }
+                    with open(self.part_path, 'wb') as f:
+                        f.truncate(self.size)
+                segments = self._state.get('segments')
+                self.received = sum(segment[2] for segment in segments)
+                flags = os.O_WRONLY
+            else:
+                self._state = None
+                segments = None
+                flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+
+            fd = os.open(self.part_path, flags, 0o644)
+            try:
+                if segments:
+                    with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+                        futures = [executor.submit(self._fetch_segment, fd, s) for s in segments]
+                        pending = futures
+                        while pending:
+                            done, pending = wait(
+                                pending, timeout=REPORT_INTERVAL, return_when=FIRST_EXCEPTION)
+                            if any(future.exception() for future in done):
+                                self._cancelled.set()
+                            self._report()
+                        for future in futures:
+                            future.result()
+                else:
+                    self._fetch_all(fd)
+            finally:
+                os.close(fd)
+                self._report(force=True)
+        except requests.RequestException as e:
+            raise DownloadError(f'The download was interrupted: {e}')
+        except OSError as e:
+            raise DownloadError(f'The file cannot be written: {e}')
+
+        try:
+            self._verify(checksum, algorithm)
+            self._move_into_place()
+            if os.path.exists(self.state_path):
+                os.remove(self.state_path)
+        except OSError as e:
+            raise DownloadError(f'The downloaded file cannot be verified or moved into place: {e}')
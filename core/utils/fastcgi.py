@@ -0,0 +1,101 @@
+import socket
+import struct
+
+
+FCGI_VERSION = 1
+FCGI_BEGIN_REQUEST = 1
+FCGI_END_REQUEST = 3
+FCGI_PARAMS = 4
+FCGI_STDIN = 5
+FCGI_STDOUT = 6
+FCGI_STDERR = 7
+FCGI_RESPONDER = 1
+
+# version, type, request id, content length, padding length, reserved
+HEADER = struct.Struct('>BBHHBx')
+MAX_CONTENT = 65535
+
+
+class FastCGIError(Exception):
+    """Raised when a FastCGI server cannot be reached or sends an invalid response."""
+
+
+def encode_record(record_type: int, content: bytes, request_id: int = 1) -> bytes:
+    """Encode a FastCGI record, long content is split into several records."""
+    records = []
+    for offset in range(0, max(len(content), 1), MAX_CONTENT):
+        chunk = content[offset:offset + MAX_CONTENT]
+        padding = -len(chunk) % 8
+        records.append(HEADER.pack(FCGI_VERSION, record_type, request_id, len(chunk), padding) + chunk + b'\0' * padding)
+    return b''.join(records)
+
+
+def encode_params(params: dict) -> bytes:
+    """Encode FastCGI name-value pairs."""
+    data = b''
+    for name, value in params.items():
+        name = str(name).encode('utf-8')
+        value = str(value).encode('utf-8')
+        for length in (len(name), len(value)):
+            data += struct.pack('>B', length) if length < 128 else struct.pack('>I', length | 0x80000000)
+        data += name + value
+    return data
+
+
+class FastCGIClient(object):
+    """FastCGI client.
+
+    A minimal responder client, enough to query the status page of a PHP-FPM pool over its unix
+    socket without going through the web server. One request is sent per connection.
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 5) -> None:
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def request(self, params: dict, stdin: bytes = b'') -> tuple:
+        """Send a request.
+
+        Args:
+            params (dict): The CGI params, e.g. SCRIPT_FILENAME and REQUEST_METHOD.
+            stdin (bytes): The request body.
+
+        Returns:
+            tuple: The response headers as a dict with lower case names, and the body as bytes.
+
+        Raises:
+            FastCGIError: If the server cannot be reached or the response is invalid.
+        """
+        message = encode_record(FCGI_BEGIN_REQUEST, struct.pack('>HB5x', FCGI_RESPONDER, 0))
+        message += encode_record(FCGI_PARAMS, encode_params(params)) + encode_record(FCGI_PARAMS, b'')
+        if stdin:
+            message += encode_record(FCGI_STDIN, stdin)
+        message += encode_record(FCGI_STDIN, b'')
+
+        stdout = b''
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+                sock.sendall(message)
+                reader = sock.makefile('rb')
+                while True:
+                    header = reader.read(HEADER.size)
+                    if len(header) < HEADER.size:
+                        raise FastCGIError('The connection was closed before the end of the response.')
+                    _, record_type, _, length, padding = HEADER.unpack(header)
+                    content = reader.read(length + padding)[:length]
+                    if record_type == FCGI_STDOUT:
+                        stdout += content
+                    elif record_type == FCGI_END_REQUEST:
+                        break
+        except OSError as e:
+            raise FastCGIError(f'{self.socket_path}: {e}')
+
+        head, _, body = stdout.partition(b'\r\n\r\n')
+        headers = {}
+        for line in head.decode('latin-1').split('\r\n'):
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        return headers, body
@@ -1,11 +1,29 @@
+import hashlib
+import mmap
 import os
 import shutil
+import tempfile
+import threading
 import zipfile
 from pathlib import Path
 from datetime import datetime
 from django.conf import settings
 from django.template.loader import render_to_string
 from core import signals
+from core.utils import fpm, opcache, reloads
+
+# Digests of the config files, see config_digest()
+_config_digests = {}
+
+# Name of the NGINX upstream of Apache
+NGINX_UPSTREAM = 'fastcp_apache'
+
+# Max size of a window of lines, see read_lines and tail_lines
+MAX_LINE_WINDOW = 1024 * 1024
+
+# Locks of the OPcache configs of the PHP versions, see generate_opcache_conf()
+_opcache_locks = {}
+_opcache_locks_lock = threading.Lock()
 
 
 def extract_zip(root_path, archive_path):
@@ -97,6 +115,250 @@ def get_path_info(p):
     }
 
 
+def file_etag(stat: os.stat_result) -> str:
+    """Returns an ETag for a file.
+
+    The ETag is derived from the modification time and the size of the file, so it changes
+    whenever the file is written.
+
+    Args:
+        stat (os.stat_result): The result of os.stat() for the file.
+
+    Returns:
+        str: The quoted ETag.
+    """
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def atomic_write(path: str, data: bytes, mode: int = 0o644, uid: int = None, gid: int = None) -> None:
+    """Write a file atomically.
+
+    The data is written to a temporary file in the same directory, flushed to the disk and then
+    renamed over the target, so readers either see the old or the new content and never a
+    partially written file, even if the process crashes mid-write.
+
+    Args:
+        path (str): The path of the file.
+        data (bytes): The new content.
+        mode (int): Permissions of the file.
+        uid (int): Owner of the file, unchanged if None.
+        gid (int): Group of the file, unchanged if None.
+    """
+    dirname, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{name}.', suffix='.tmp', dir=dirname)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fchmod(f.fileno(), mode)
+            if uid is not None or gid is not None:
+                os.fchown(f.fileno(), -1 if uid is None else uid, -1 if gid is None else gid)
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    # Persist the rename itself
+    dir_fd = os.open(dirname or '.', os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def config_digest(path: str) -> str:
+    """Returns the SHA-256 digest of a config file, None if it doesn't exist.
+
+    Digests are cached by inode, size and modification time, so unchanged files are only read
+    once per process.
+
+    Args:
+        path (str): The path of the config file.
+
+    Returns:
+        str: The hex digest.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    cached = _config_digests.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    _config_digests[path] = (key, digest)
+    return digest
+
+
+def config_changed(path: str, data: str) -> bool:
+    """Check either writing data to a config file would change it or not."""
+    return config_digest(path) != hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def write_config(path: str, data: str, service: str) -> bool:
+    """Write a config file of a service.
+
+    Nothing is done if the file already has this content. Otherwise, the file is written atomically
+    and a graceful reload of the service is requested. The previous content is backed up, and
+    restored if the new config doesn't pass the config test of the service.
+
+    Args:
+        path (str): The path of the config file.
+        data (str): The content of the file.
+        service (str): The name of the systemd unit that reads the file.
+
+    Returns:
+        bool: True if the file has been written and False if it was up to date.
+    """
+    if not config_changed(path, data):
+        return False
+
+    reloads.scheduler.track(service, path)
+    atomic_write(path, data.encode('utf-8'))
+    signals.reload_services.send(sender=None, services=service)
+    return True
+
+
+def remove_config(path: str, service: str) -> bool:
+    """Remove a config file of a service if it exists and request a graceful reload of the service.
+
+    Args:
+        path (str): The path of the config file.
+        service (str): The name of the systemd unit that reads the file.
+
+    Returns:
+        bool: True if the file has been removed and False if it didn't exist.
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    _config_digests.pop(path, None)
+    signals.reload_services.send(sender=None, services=service)
+    return True
+
+
+def read_bytes(path: str, offset: int, length: int) -> tuple:
+    """Read a byte window of a file.
+
+    Args:
+        path (str): The path of the file.
+        offset (int): Offset to start reading from.
+        length (int): Max number of bytes to read.
+
+    Returns:
+        tuple: The data along with the start and the end (exclusive) offsets of the window.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    return data, offset, offset + len(data)
+
+
+def read_lines(path: str, start: int, count: int, max_bytes: int = MAX_LINE_WINDOW) -> tuple:
+    """Read a window of lines of a file.
+
+    The file is memory mapped and the line breaks are located with mmap.find(), so only the
+    pages up to the end of the window are touched and the lines are never split in Python. The
+    window is cut at max_bytes, so a file without line breaks isn't returned whole.
+
+    Args:
+        path (str): The path of the file.
+        start (int): Index of the first line to read (zero based).
+        count (int): Max number of lines to read.
+        max_bytes (int): Max size of the window.
+
+    Returns:
+        tuple: The data, the start and the end (exclusive) offsets of the window, and True if the
+               window was cut at max_bytes.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return b'', 0, 0, False
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            begin = 0
+            for _ in range(start):
+                pos = mm.find(b'\n', begin)
+                if pos == -1:
+                    return b'', size, size, False
+                begin = pos + 1
+
+            limit = min(size, begin + max_bytes)
+            end = begin
+            truncated = False
+            for _ in range(count):
+                pos = mm.find(b'\n', end, limit)
+                if pos == -1:
+                    truncated = limit < size
+                    end = limit
+                    break
+                end = pos + 1
+
+            return mm[begin:end], begin, end, truncated
+
+
+def tail_lines(path: str, count: int, block_size: int = 65536, max_bytes: int = MAX_LINE_WINDOW) -> tuple:
+    """Read the last lines of a file.
+
+    Blocks are read backwards from the end of the file until enough line breaks are found or
+    max_bytes have been read, so the cost only depends on the size of the requested lines and not
+    on the file size, and the window is cut at max_bytes.
+
+    Args:
+        path (str): The path of the file.
+        count (int): Number of lines to read.
+        block_size (int): Size of the blocks to read at once.
+        max_bytes (int): Max size of the window.
+
+    Returns:
+        tuple: The data, the start and the end (exclusive) offsets of the window, and True if the
+               window was cut at max_bytes.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        pos = size
+        blocks = []
+        read = 0
+        breaks = 0
+        needed = count
+        while pos > 0 and count > 0 and read <= max_bytes:
+            read_size = min(block_size, pos)
+            pos -= read_size
+            f.seek(pos)
+            block = f.read(read_size)
+            if not blocks and block.endswith(b'\n'):
+                # A trailing line break doesn't start a new line
+                needed += 1
+            breaks += block.count(b'\n')
+            blocks.append(block)
+            read += len(block)
+            if breaks >= needed:
+                break
+        data = b''.join(reversed(blocks))
+
+        # Drop the lines before the requested ones
+        cut = len(data)
+        for _ in range(needed):
+            cut = data.rfind(b'\n', 0, cut)
+            if cut == -1:
+                break
+        data = data[cut + 1:]
+
+        truncated = len(data) > max_bytes
+        if truncated:
+            data = data[-max_bytes:]
+
+    return data, size - len(data), size, truncated
+
+
 def get_user_path(user, exact=False):
     """Get user path.
 
@@ -152,6 +414,7 @@ def get_website_paths(website: object) -> dict:
     fpm_root = os.path.join(settings.PHP_INSTALL_PATH, website.php, 'fpm', 'pool.d')
     ssl_base = os.path.join(settings.NGINX_BASE_DIR, 'ssl', website.slug)
     tmp_path = os.path.join(user_paths.get('tmp_path'), website.slug)
+    redis_path = os.path.join(user_paths.get('run_path'), f'{website.slug}.redis')
 
     return {
         'fpm_root': fpm_root,
@@ -160,11 +423,18 @@ def get_website_paths(website: object) -> dict:
         'tmp_path': tmp_path,
         'web_root': os.path.join(web_base, 'public'),
         'socket_path': os.path.join(user_paths.get('run_path'), f'{website.slug}.sock'),
+        'slowlog_path': os.path.join(user_paths.get('logs_path'), f'{website.slug}_php.slow.log'),
+        'preload_path': os.path.join(opcache.preload_root(website.php), f'{website.slug}.php'),
         'ngix_vhost_dir': os.path.join(settings.NGINX_VHOSTS_ROOT, f'{website.slug}.d'),
         'ngix_vhost_conf': os.path.join(settings.NGINX_VHOSTS_ROOT, f'{website.slug}.conf'),
         'apache_vhost_dir': os.path.join(settings.APACHE_VHOST_ROOT, f'{website.slug}.d'),
         'apache_vhost_conf': os.path.join(settings.APACHE_VHOST_ROOT, f'{website.slug}.conf'),
         'ssl_base': ssl_base,
+        'cache_path': os.path.join(settings.NGINX_CACHE_ROOT, website.slug),
+        'redis_path': redis_path,
+        'redis_socket_path': os.path.join(redis_path, 'redis.sock'),
+        'redis_conf_path': os.path.join(settings.FASTCP_REDIS_CONF_ROOT, f'{website.slug}.conf'),
+        'redis_unit_path': os.path.join(settings.SYSTEMD_UNIT_ROOT, f'fastcp-redis-{website.slug}.service'),
         'priv_key_path': os.path.join(ssl_base, 'priv.key'),
         'cert_chain_path': os.path.join(ssl_base, 'cert.chain')
     }
@@ -203,12 +473,7 @@ def delete_apache_vhost(website: object) -> bool:
     website_conf_dir = website_paths.get('apache_vhost_dir')
     try:
         shutil.rmtree(website_conf_dir)
-        vhost_file = website_paths.get('apache_vhost_conf')
-
-        if os.path.exists(vhost_file):
-            os.remove(vhost_file)
-
-        signals.restart_services.send(sender=None, services='apache2')
+        remove_config(website_paths.get('apache_vhost_conf'), 'apache2')
         return True
     except (OSError, IOError, PermissionError):
         return False
@@ -228,11 +493,7 @@ def delete_nginx_vhost(website: object) -> bool:
     website_conf_dir = website_paths.get('ngix_vhost_dir')
     try:
         shutil.rmtree(website_conf_dir)
-        vhost_path = website_paths.get('ngix_vhost_conf')
-
-        if os.path.exists(vhost_path):
-            os.remove(vhost_path)
-        signals.restart_services.send(sender=None, services='nginx')
+        remove_config(website_paths.get('ngix_vhost_conf'), 'nginx')
         return True
     except (OSError, IOError, PermissionError):
         return False
@@ -250,23 +511,17 @@ def delete_ssl_certs(website: object) -> None:
     if os.path.exists(website_paths.get('ssl_base')):
         shutil.rmtree(website_paths.get('ssl_base'))
 
-def create_apache_vhost(website: object, **kwargs) -> bool:
-    """Create Apache vhost file.
-
-    This function generates Apache vhost file.
+def render_apache_vhost(website: object) -> str:
+    """Render the Apache vhost file of a website.
 
     Args:
         website (object): Website model object.
 
     Returns:
-        bool: True on success and False otherwise.
+        str: The content of the vhost file.
     """
     website_paths = get_website_paths(website)
     user_paths = get_user_paths(website.user)
-    create_if_missing(website_paths.get('apache_vhost_dir'))
-
-    # Vhost conf path
-    website_vhost_path = website_paths.get('apache_vhost_conf')
 
     main_domain = None
     server_aliases = []
@@ -289,40 +544,59 @@ def create_apache_vhost(website: object, **kwargs) -> bool:
         'socket_path': website_paths.get('socket_path')
     }
 
-    tpl_data = render_to_string('system/apache-vhost.txt', context=context)
+    return render_to_string('system/apache-vhost.txt', context=context)
+
+def create_apache_vhost(website: object, **kwargs) -> bool:
+    """Create Apache vhost file.
+
+    This function generates Apache vhost file. Websites served by NGINX only don't have one, so
+    their vhost file is removed instead.
+
+    Args:
+        website (object): Website model object.
+
+    Returns:
+        bool: True on success and False otherwise.
+    """
+    website_paths = get_website_paths(website)
+    if website.serving_mode == 'nginx':
+        try:
+            remove_config(website_paths.get('apache_vhost_conf'), 'apache2')
+            return True
+        except (OSError, IOError, PermissionError):
+            return False
+
+    create_if_missing(website_paths.get('apache_vhost_dir'))
 
     try:
-        with open(website_vhost_path, 'w', encoding='utf-8') as f:
-            f.write(tpl_data)
-        signals.restart_services.send(sender=None, services='apache2')
+        write_config(website_paths.get('apache_vhost_conf'), render_apache_vhost(website), 'apache2')
         return True
     except (OSError, IOError, PermissionError):
         return False
 
-def create_nginx_vhost(website: object, **kwargs) -> bool:
-    """Create NGINX vhost file.
+def render_nginx_vhost(website: object) -> str:
+    """Render the NGINX vhost file of a website.
 
-    This function generates NGINX vhost file. The default protocol is HTTP. If the
-    vhost needs to be created for the HTTPs protocol, ssl_cert and ssl_key should
-    be passed in args.
+    The HTTPs vhost is rendered if the website has SSL and its certificates exist, the HTTP
+    one otherwise.
 
     Args:
         website (object): Website model object.
-        protocol (str): It should be either http or https.
 
     Returns:
-        bool: True on success and False otherwise.
+        str: The content of the vhost file.
     """
     website_paths = get_website_paths(website)
     user_paths = get_user_paths(website.user)
-    create_if_missing(website_paths.get('ngix_vhost_dir'))
 
     # Template rendering context
     context = {
         'app_name': website.slug,
         'log_path': user_paths.get('logs_path'),
         'webroot': website_paths.get('web_root'),
-        'socket_path': website_paths.get('socket_path')
+        'socket_path': website_paths.get('socket_path'),
+        'serving_mode': website.serving_mode,
+        'upstream': NGINX_UPSTREAM
     }
 
     # Vhost conf path
@@ -345,12 +619,74 @@ def create_nginx_vhost(website: object, **kwargs) -> bool:
 
     context['domains'] = domains
 
-    tpl_data = render_to_string(nginx_vhost_tpl_path, context=context)
+    # Proxy cache
+    if website.cache_mode != 'off':
+        context['cache_zone'] = f'fastcp_{website.slug}'
+        context['cache_type'] = 'fastcgi' if website.serving_mode == 'nginx' else 'proxy'
+        context['cache_path'] = website_paths.get('cache_path')
+        context['cache_max_size'] = settings.NGINX_CACHE_MAX_SIZE
+        context['cache_ttl'] = website.cache_ttl
+
+    return render_to_string(nginx_vhost_tpl_path, context=context)
+
+def get_nginx_upstream_path() -> str:
+    """Returns the path of the NGINX upstream config.
+
+    It sits next to the vhosts so NGINX loads it along with them, and its name starts with an
+    underscore, which a website slug never does.
+    """
+    return os.path.join(settings.NGINX_VHOSTS_ROOT, f'_{NGINX_UPSTREAM}.conf')
+
+def render_nginx_upstream() -> str:
+    """Render the NGINX upstream config.
+
+    The vhosts proxy to Apache through this upstream, so the connections to Apache are kept alive
+    and reused by all of the websites instead of a new one being opened for each request.
+
+    Returns:
+        str: The content of the upstream config.
+    """
+    return render_to_string('system/nginx-upstream.txt', context={
+        'upstream': NGINX_UPSTREAM,
+        'keepalive': settings.NGINX_UPSTREAM_KEEPALIVE,
+        'keepalive_requests': settings.NGINX_UPSTREAM_KEEPALIVE_REQUESTS,
+        'keepalive_timeout': settings.NGINX_UPSTREAM_KEEPALIVE_TIMEOUT,
+    })
+
+def create_nginx_upstream() -> bool:
+    """Create the NGINX upstream config, the vhosts cannot be loaded without it.
+
+    Returns:
+        bool: True on success and False otherwise.
+    """
+    try:
+        write_config(get_nginx_upstream_path(), render_nginx_upstream(), 'nginx')
+        return True
+    except (OSError, IOError, PermissionError):
+        return False
+
+def create_nginx_vhost(website: object, **kwargs) -> bool:
+    """Create NGINX vhost file.
+
+    This function generates NGINX vhost file. The default protocol is HTTP. If the
+    website has SSL and its certificates exist, the HTTPs vhost is created.
+
+    Args:
+        website (object): Website model object.
+
+    Returns:
+        bool: True on success and False otherwise.
+    """
+    website_paths = get_website_paths(website)
+    create_if_missing(website_paths.get('ngix_vhost_dir'))
+    if website.cache_mode != 'off':
+        create_if_missing(website_paths.get('cache_path'))
+
+    if not create_nginx_upstream():
+        return False
 
     try:
-        with open(website_paths.get('ngix_vhost_conf'), 'w', encoding='utf-8') as f:
-            f.write(tpl_data)
-        signals.restart_services.send(sender=None, services='nginx')
+        write_config(website_paths.get('ngix_vhost_conf'), render_nginx_vhost(website), 'nginx')
         return True
     except (OSError, IOError, PermissionError):
         return False
@@ -438,6 +774,30 @@ def delete_website_dirs(website: object) -> bool:
         return False
 
 
+def render_fpm_conf(website: object) -> str:
+    """Render the PHP-FPM pool conf of a website.
+
+    Args:
+        website (object): Website model object.
+
+    Returns:
+        str: The content of the pool conf file.
+    """
+    context = {
+        'app_name': website.slug,
+        'ssh_user': website.user.username,
+        'ssh_group': website.user.username,
+        'listen_group': 'www-data',
+        'socket_path': get_website_paths(website).get('socket_path'),
+        'status_path': fpm.STATUS_PATH,
+        'slowlog_timeout': settings.FASTCP_FPM_SLOWLOG_TIMEOUT,
+        'slowlog_path': get_website_paths(website).get('slowlog_path'),
+        'opcache_validate_timestamps': int(website.opcache_validate_timestamps),
+        'opcache_revalidate_freq': website.opcache_revalidate_freq
+    }
+    context.update(fpm.pool_settings(website))
+    return render_to_string('system/php-fpm-pool.txt', context)
+
 def generate_fpm_conf(website: object) -> bool:
     """Generate FPM pool conf.
 
@@ -459,26 +819,82 @@ def generate_fpm_conf(website: object) -> bool:
     # Create temp dir if missing
     create_if_missing(paths.get('tmp_path'))
 
-    context = {
-        'app_name': website.slug,
-        'ssh_user': website.user.username,
-        'ssh_group': website.user.username,
-        'listen_group': 'www-data',
-        'socket_path': paths.get('socket_path')
-    }
-
-    # Render template data
-    data = render_to_string('system/php-fpm-pool.txt', context)
-
     # Write conf file
     try:
-        with open(paths.get('fpm_path'), 'w', encoding='utf-8') as f:
-            f.write(data)
-        signals.restart_services.send(sender=None, services=f'php{website.php}-fpm')
-        return True
+        write_config(paths.get('fpm_path'), render_fpm_conf(website), f'php{website.php}-fpm')
     except (OSError, IOError, PermissionError):
         return False
 
+    return generate_opcache_conf(website.php)
+
+def render_opcache_conf(php: str, exclude: int = None) -> tuple:
+    """Render the OPcache config of a PHP version, and the preload script if a website has one.
+
+    Args:
+        php (str): The PHP version.
+        exclude (int): ID of a website that is being deleted.
+
+    Returns:
+        tuple: The content of the config, the path of the preload script and its content, both None
+               if no website of the version preloads its scripts.
+    """
+    options = opcache.version_settings(php, exclude=exclude)
+    website = options.pop('preload')
+    context = dict(options, php=php)
+    if website is None:
+        return render_to_string('system/php-opcache.txt', context), None, None
+
+    website_paths = get_website_paths(website)
+    context['preload_path'] = website_paths.get('preload_path')
+    context['preload_user'] = website.user.username
+    script = render_to_string('system/php-opcache-preload.txt', {
+        'app_name': website.slug,
+        'base_path': website_paths.get('base_path'),
+        'web_root': website_paths.get('web_root'),
+        'max_files': website.opcache_max_files
+    })
+    return render_to_string('system/php-opcache.txt', context), context['preload_path'], script
+
+def generate_opcache_conf(php: str, exclude: int = None) -> bool:
+    """Generate the OPcache config of a PHP version.
+
+    The preload script of the website that has one is written along with it, and the scripts of
+    the websites that don't preload anymore are removed.
+
+    Args:
+        php (str): The PHP version.
+        exclude (int): ID of a website that is being deleted.
+
+    Returns:
+        bool: True on success False otherwise.
+    """
+    service = f'php{php}-fpm'
+    with _opcache_locks_lock:
+        lock = _opcache_locks.setdefault(php, threading.Lock())
+
+    # The websites of a version are provisioned concurrently, the config and the preload scripts
+    # are rendered and written by one of them at a time, so the last one reflects all of them
+    with lock:
+        try:
+            data, preload_path, script = render_opcache_conf(php, exclude=exclude)
+            preload_dir = opcache.preload_root(php)
+            if preload_path:
+                create_if_missing(preload_dir)
+                write_config(preload_path, script, service)
+
+            conf_path = opcache.conf_path(php)
+            create_if_missing(os.path.dirname(conf_path))
+            write_config(conf_path, data, service)
+
+            # Only once the config doesn't point to them anymore
+            if os.path.isdir(preload_dir):
+                for entry in os.scandir(preload_dir):
+                    if entry.path != preload_path:
+                        remove_config(entry.path, service)
+            return True
+        except (OSError, IOError, PermissionError):
+            return False
+
 def delete_fpm_conf(website: object) -> bool:
     """Delete FPM pool conf.
 
@@ -493,8 +909,7 @@ def delete_fpm_conf(website: object) -> bool:
     fpm_path = get_website_paths(website).get('fpm_path')
     if os.path.exists(fpm_path):
         try:
-            os.remove(fpm_path)
-            signals.restart_services.send(sender=None, services=f'php{website.php}-fpm')
+            remove_config(fpm_path, f'php{website.php}-fpm')
             return True
         except (OSError, IOError, PermissionError):
             return False
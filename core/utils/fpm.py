@@ -0,0 +1,82 @@
+import threading
+import time
+
+from django.conf import settings
+
+from core.models import Website
+from core.utils.generics import hardware_info
+
+
+# The pm.status_path of the generated pools. It's only reachable through the socket of the pool,
+# as the web server only hands *.php files to PHP-FPM, see core.utils.fpm_status
+STATUS_PATH = '/.fastcp-fpm-status'
+
+# Min number of workers the auto profile gives a pool
+MIN_CHILDREN = 2
+# Workers per CPU beyond which more workers only add memory pressure
+CHILDREN_PER_CPU = 4
+# Seconds the auto limits are reused for, rendering the pools of a whole node computes them once
+AUTO_LIMITS_TTL = 60
+
+_auto_limits = {}
+_auto_limits_lock = threading.Lock()
+
+
+def auto_max_children(pools: int = None) -> int:
+    """Returns the max number of workers of a pool with the auto profile.
+
+    FASTCP_FPM_MEMORY_RATIO of the RAM is shared between the pools of all of the websites of the
+    node, and a pool never gets more workers than the CPUs can keep busy.
+
+    Args:
+        pools (int): Number of pools on the node, the number of websites if None.
+
+    Returns:
+        int: The max number of workers.
+    """
+    with _auto_limits_lock:
+        cached = _auto_limits.get(pools)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        info = hardware_info()
+        memory = info['ram']['memory']['total'] * settings.FASTCP_FPM_MEMORY_RATIO
+        children = int(memory // (settings.FASTCP_FPM_CHILD_MEMORY * 1024 * 1024))
+        count = max(1, Website.objects.count() if pools is None else pools)
+        cpus = info['cpu']['logical'] or 1
+        max_children = max(MIN_CHILDREN, min(children // count, cpus * CHILDREN_PER_CPU))
+
+        _auto_limits[pools] = (time.monotonic() + AUTO_LIMITS_TTL, max_children)
+        return max_children
+
+
+def pool_settings(website: object) -> dict:
+    """Returns the process manager settings of the PHP-FPM pool of a website.
+
+    The auto profile is an on demand pool sized by auto_max_children(), so idle websites don't hold
+    any workers. Dynamic and static pools keep workers around for busy websites. Profiles other
+    than auto use the max number of workers of the website, or the auto one if it isn't set.
+
+    Args:
+        website (object): Website model object.
+
+    Returns:
+        dict: The pm, max_children, start_servers, min_spare_servers, max_spare_servers,
+              max_requests and idle_timeout of the pool.
+    """
+    profile = website.fpm_profile
+    if profile == 'auto' or not website.fpm_max_children:
+        max_children = auto_max_children()
+    else:
+        max_children = website.fpm_max_children
+
+    spare = max(1, max_children // 4)
+    return {
+        'pm': 'ondemand' if profile == 'auto' else profile,
+        'max_children': max_children,
+        'start_servers': spare,
+        'min_spare_servers': spare,
+        'max_spare_servers': max(spare, max_children // 2),
+        'max_requests': website.fpm_max_requests,
+        'idle_timeout': website.fpm_idle_timeout,
+    }
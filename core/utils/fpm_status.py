@@ -0,0 +1,307 @@
+import json
+import logging
+import os
+import re
+import time
+from array import array
+
+from django.conf import settings
+
+from core.models import Website
+from core.utils import filesystem
+from core.utils.fastcgi import FastCGIClient, FastCGIError
+from core.utils.fpm import STATUS_PATH
+
+
+logger = logging.getLogger(__name__)
+
+# Fields of the status page that are kept, with the status page key
+STATUS_FIELDS = {
+    'listen_queue': 'listen queue',
+    'active_processes': 'active processes',
+    'idle_processes': 'idle processes',
+    'total_processes': 'total processes',
+    'max_children_reached': 'max children reached',
+    'slow_requests': 'slow requests',
+    'accepted_conn': 'accepted conn',
+}
+
+SLOWLOG_HEADER_RE = re.compile(r'^\[(?P<date>[^\]]+)\]\s+\[pool (?P<pool>[^\]]+)\] pid (?P<pid>\d+)')
+SLOWLOG_FRAME_RE = re.compile(r'^\[0x[0-9a-f]+\]\s+')
+
+
+def fetch_status(socket_path: str, timeout: float = 5) -> dict:
+    """Fetch the status of a PHP-FPM pool.
+
+    Args:
+        socket_path (str): The unix socket of the pool.
+        timeout (float): Socket timeout in seconds.
+
+    Returns:
+        dict: The STATUS_FIELDS of the pool. The worker that serves the status request itself isn't
+              counted in active_processes.
+
+    Raises:
+        FastCGIError: If the pool cannot be reached or its status cannot be read.
+    """
+    _, body = FastCGIClient(socket_path, timeout=timeout).request({
+        'GATEWAY_INTERFACE': 'FastCGI/1.0',
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': STATUS_PATH,
+        'SCRIPT_FILENAME': STATUS_PATH,
+        'REQUEST_URI': f'{STATUS_PATH}?json',
+        'QUERY_STRING': 'json',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+    })
+    try:
+        data = json.loads(body)
+        status = {field: int(data[key]) for field, key in STATUS_FIELDS.items()}
+    except (ValueError, KeyError, TypeError):
+        raise FastCGIError(f'{socket_path}: the status page cannot be parsed.')
+    status['active_processes'] = max(0, status['active_processes'] - 1)
+    return status
+
+
+class TimeSeries(object):
+    """Time series.
+
+    A fixed size ring buffer of samples, each field is kept in a flat array of doubles so a few
+    hours of samples of thousands of pools only take a few megabytes.
+    """
+
+    def __init__(self, fields: list, capacity: int) -> None:
+        self.fields = list(fields)
+        self.capacity = max(1, capacity)
+        self._columns = {name: array('d', [0.0]) * self.capacity for name in ['time'] + self.fields}
+        self._next = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, timestamp: float, values: dict) -> None:
+        """Add a sample, the oldest one is dropped if the buffer is full."""
+        self._columns['time'][self._next] = timestamp
+        for name in self.fields:
+            self._columns[name][self._next] = values.get(name, 0)
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def samples(self) -> dict:
+        """Returns the samples, oldest first, as a list of values for each field and for time."""
+        start = (self._next - self._count) % self.capacity
+        order = [(start + i) % self.capacity for i in range(self._count)]
+        return {name: [column[i] for i in order] for name, column in self._columns.items()}
+
+    def last(self) -> dict:
+        """Returns the latest sample, None if there's none."""
+        if not self._count:
+            return None
+        i = (self._next - 1) % self.capacity
+        return {name: column[i] for name, column in self._columns.items()}
+
+    @classmethod
+    def from_samples(cls, fields: list, capacity: int, samples: dict) -> 'TimeSeries':
+        """Create a time series from the output of samples, the oldest ones are dropped if they don't fit."""
+        series = cls(fields, capacity)
+        for i, timestamp in enumerate(samples.get('time', [])):
+            series.append(timestamp, {name: samples[name][i] for name in series.fields if name in samples})
+        return series
+
+
+def saturation(series: TimeSeries, max_children: int) -> dict:
+    """Summarize how close a pool is to its limits over the samples of a time series.
+
+    Args:
+        series (TimeSeries): The samples of the pool.
+        max_children (int): The max number of workers of the pool.
+
+    Returns:
+        dict: The current and peak active workers and their ratio to max_children, the current and
+              peak listen queue, and how many times the pool hit max_children and served slow
+              requests during the window. Empty if there's no sample yet.
+    """
+    samples = series.samples()
+    if not samples['time']:
+        return {}
+
+    active = samples['active_processes']
+    queue = samples['listen_queue']
+    return {
+        'since': samples['time'][0],
+        'active': int(active[-1]),
+        'peak_active': int(max(active)),
+        'utilization': round(active[-1] / max_children, 2) if max_children else None,
+        'peak_utilization': round(max(active) / max_children, 2) if max_children else None,
+        'listen_queue': int(queue[-1]),
+        'peak_listen_queue': int(max(queue)),
+        # The counters are reset when PHP-FPM restarts
+        'max_children_reached': int(max(0, samples['max_children_reached'][-1] - samples['max_children_reached'][0])),
+        'slow_requests': int(max(0, samples['slow_requests'][-1] - samples['slow_requests'][0])),
+    }
+
+
+def read_slowlog(path: str, lines: int = 5000, limit: int = 20) -> list:
+    """Read the slowlog of a pool and group its entries by stack trace.
+
+    Args:
+        path (str): The path of the slowlog.
+        lines (int): Number of lines read from the end of the file.
+        limit (int): Max number of traces returned.
+
+    Returns:
+        list: The traces, most frequent first, with their frames, count, script and last date.
+    """
+    try:
+        data, _, _, _ = filesystem.tail_lines(path, lines)
+    except (OSError, IOError, PermissionError):
+        return []
+
+    traces = {}
+    for block in re.split(r'\n\s*\n', data.decode('utf-8', errors='replace')):
+        header = None
+        script = None
+        frames = []
+        for line in block.strip().splitlines():
+            match = SLOWLOG_HEADER_RE.match(line)
+            if match:
+                header = match
+            elif line.startswith('script_filename = '):
+                script = line[len('script_filename = '):]
+            elif SLOWLOG_FRAME_RE.match(line):
+                frames.append(SLOWLOG_FRAME_RE.sub('', line))
+
+        if header is None or not frames:
+            continue
+        trace = traces.setdefault(tuple(frames), {'frames': frames, 'count': 0})
+        trace['count'] += 1
+        trace['script'] = script
+        trace['last_seen'] = header.group('date')
+
+    return sorted(traces.values(), key=lambda trace: trace['count'], reverse=True)[:limit]
+
+
+def access_logs(website: object) -> list:
+    """Returns the paths of the access logs of the requests that reach the pool of a website.
+
+    Both the HTTP and the HTTPS access logs of NGINX are listed, a website may have either.
+    """
+    logs_path = filesystem.get_user_paths(website.user).get('logs_path')
+    if website.serving_mode == 'nginx':
+        names = [f'{website.slug}_nginx.access.log', f'{website.slug}_nginx.access_ssl.log']
+    else:
+        names = [f'{website.slug}_apache.access.log']
+    return [os.path.join(logs_path, name) for name in names]
+
+
+def last_request(website: object) -> float:
+    """Returns the modification time of the access log written last, infinity if there's none.
+
+    A website without an access log is never considered idle.
+    """
+    times = []
+    for path in access_logs(website):
+        try:
+            times.append(os.path.getmtime(path))
+        except OSError:
+            pass
+    return max(times) if times else float('inf')
+
+
+class StatusScraper(object):
+    """PHP-FPM status scraper.
+
+    Scrapes the status page of the pool of every website and keeps the samples of each website in a
+    file of the store directory. It runs from a single process, the scrape-fpm-status command, so the
+    pools are scraped once per interval whatever the number of web workers, and the views only read
+    the store.
+
+    A status request makes an on demand pool spawn a worker, so pools whose access log hasn't
+    changed since the last scrape and that had no active workers then are not contacted, the last
+    sample is repeated instead.
+    """
+
+    def __init__(self, store_dir: str, capacity: int = 120, timeout: float = 5, interval: float = 60) -> None:
+        self.store_dir = store_dir
+        self.capacity = capacity
+        self.timeout = timeout
+        self.interval = interval
+
+    def is_current(self, series: TimeSeries) -> bool:
+        """Check either the last sample of a series is recent, i.e. the scraper is running and reaches the pool."""
+        last = series.last()
+        # A couple of missed runs are tolerated, e.g. while PHP-FPM restarts
+        return last is not None and time.time() - last['time'] <= 3 * max(self.interval, 60)
+
+    def _path(self, website_id: int) -> str:
+        return os.path.join(self.store_dir, f'{website_id}.json')
+
+    def series(self, website: object) -> TimeSeries:
+        """Returns the stored samples of a website, an empty series if it hasn't been scraped yet."""
+        try:
+            with open(self._path(website.pk), encoding='utf-8') as f:
+                samples = json.load(f)
+            return TimeSeries.from_samples(STATUS_FIELDS, self.capacity, samples)
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            return TimeSeries(STATUS_FIELDS, self.capacity)
+
+    def _save(self, website: object, series: TimeSeries) -> None:
+        os.makedirs(self.store_dir, mode=0o700, exist_ok=True)
+        data = json.dumps(series.samples()).encode('utf-8')
+        filesystem.atomic_write(self._path(website.pk), data, mode=0o600)
+
+    def scrape_all(self) -> int:
+        """Scrape the pools of all of the websites.
+
+        Returns:
+            int: The number of pools that were scraped.
+        """
+        websites = list(Website.objects.select_related('user'))
+
+        # Forget the websites that were deleted
+        ids = {self._path(website.pk) for website in websites}
+        try:
+            names = os.listdir(self.store_dir)
+        except OSError:
+            names = []
+        for name in names:
+            path = os.path.join(self.store_dir, name)
+            if name.endswith('.json') and path not in ids:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        return sum(1 for website in websites if self.scrape(website) is not None)
+
+    def scrape(self, website: object) -> dict:
+        """Scrape the pool of a website and add a sample to its stored series.
+
+        Returns:
+            dict: The sample, None if the pool cannot be reached.
+        """
+        series = self.series(website)
+        now = time.time()
+        paths = filesystem.get_website_paths(website)
+        last = series.last()
+        # The time of the last sample is the time of the last scrape
+        idle = last is not None and last['active_processes'] == 0 and last_request(website) < last['time']
+
+        if idle:
+            sample = last
+        else:
+            try:
+                sample = fetch_status(paths.get('socket_path'), timeout=self.timeout)
+            except FastCGIError as e:
+                logger.debug(f'Unable to scrape the PHP-FPM pool of {website}: {e}')
+                return None
+
+        series.append(now, sample)
+        self._save(website, series)
+        return sample
+
+
+def get_scraper() -> StatusScraper:
+    """Returns a status scraper of the store set up in the settings."""
+    return StatusScraper(settings.FASTCP_FPM_STATUS_DIR, capacity=settings.FASTCP_FPM_STATUS_SAMPLES,
+                         interval=settings.FASTCP_FPM_STATUS_INTERVAL)
@@ -0,0 +1,137 @@
+import json
+import re
+import time
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when a requested byte range lies outside of the file."""
+
+
+def parse_range_header(header: str, size: int) -> tuple:
+    """Parse a Range header.
+
+    Only a single byte range is supported. Requests for multiple ranges or with a malformed header
+    are answered with the full content, as allowed by RFC 9110.
+
+    Args:
+        header (str): The value of the Range header.
+        size (int): Size of the file in bytes.
+
+    Returns:
+        tuple: The first and the last byte (inclusive) of the range, or None if the full content
+               should be sent.
+
+    Raises:
+        RangeNotSatisfiable: If the range doesn't overlap the file.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+
+    start, end = match.groups()
+    if start == '':
+        # Suffix range, i.e. the last N bytes
+        length = int(end)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - length), size - 1
+
+    start = int(start)
+    end = size - 1 if end == '' else min(int(end), size - 1)
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def sse_message(event: str, data=None, id: object = None) -> str:
+    """Format a server-sent event.
+
+    Args:
+        event (str): Name of the event.
+        data: JSON serializable data of the event.
+        id (object): ID of the event, sent back by the client in the Last-Event-ID header when
+                     it reconnects.
+
+    Returns:
+        str: The event in the text/event-stream format.
+    """
+    prefix = '' if id is None else f'id: {id}\n'
+    return f'{prefix}event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+def _sse_batch(subscription: object, messages: list) -> str:
+    chunk = ''
+    if subscription.dropped:
+        # The client fell behind and should reload the state
+        chunk += sse_message('overflow', subscription.dropped)
+        subscription.dropped = 0
+    return chunk + ''.join(sse_message(*message) for message in messages)
+
+
+def _last_id(messages: list, last_id: object) -> object:
+    """Returns the ID of the last message that has one, last_id if none has."""
+    for message in reversed(messages):
+        if len(message) > 2 and message[2] is not None:
+            return message[2]
+    return last_id
+
+
+def sse_stream(subscription: object, initial: list = None, keepalive: int = 15, max_duration: float = None,
+               last_id: object = None):
+    """Stream the messages of a subscription as server-sent events.
+
+    The messages are (event, data) or (event, data, id) tuples. A comment is sent when the stream
+    is idle, so disconnected clients are noticed and their subscriptions are closed.
+
+    A synchronous worker is held for as long as the stream lasts, so under WSGI the stream ends
+    after max_duration seconds with a reconnect event. It carries the ID of the last message, which
+    the client sends back in the Last-Event-ID header when it reconnects.
+
+    Args:
+        subscription (object): A core.utils.watchers.Subscription object.
+        initial (list): Messages to send before the ones of the subscription.
+        keepalive (int): Seconds between two keep-alive comments.
+        max_duration (float): Seconds after which the stream ends, None to never end it.
+        last_id (object): ID of the stream until a message has one, sent first so a client that
+                          reconnects before any message resumes from there.
+
+    Yields:
+        str: Chunks of the event stream.
+    """
+    deadline = None if max_duration is None else time.monotonic() + max_duration
+    try:
+        if last_id is not None:
+            # Sets the Last-Event-ID of the client without dispatching an event
+            yield f'id: {last_id}\n\n'
+        if initial:
+            last_id = _last_id(initial, last_id)
+            yield _sse_batch(subscription, initial)
+        while True:
+            timeout = keepalive
+            if deadline is not None:
+                timeout = min(keepalive, deadline - time.monotonic())
+                if timeout <= 0:
+                    yield sse_message('reconnect', id=last_id)
+                    return
+            messages = subscription.get(timeout)
+            last_id = _last_id(messages, last_id)
+            yield _sse_batch(subscription, messages) if messages else ': keepalive\n\n'
+    finally:
+        subscription.close()
+
+
+async def async_sse_stream(subscription: object, initial: list = None, keepalive: int = 15, last_id: object = None):
+    """Same as sse_stream() but waits for messages without holding a thread, used under ASGI."""
+    try:
+        if last_id is not None:
+            yield f'id: {last_id}\n\n'
+        if initial:
+            yield _sse_batch(subscription, initial)
+        while True:
+            messages = await subscription.aget(keepalive)
+            yield _sse_batch(subscription, messages) if messages else ': keepalive\n\n'
+    finally:
+        subscription.close()
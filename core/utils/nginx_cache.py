@@ -0,0 +1,75 @@
+import hashlib
+import os
+import shutil
+from urllib.parse import urlsplit
+
+from core.utils import filesystem
+
+
+# Must match the cache key of templates/system/nginx-cache-location.txt
+CACHE_KEY = '{scheme}://{host}{uri}'
+
+
+def cache_file(cache_path: str, key: str) -> str:
+    """Returns the path of the cache file of a key, for a cache with levels=1:2."""
+    digest = hashlib.md5(key.encode('utf-8'), usedforsecurity=False).hexdigest()  # nosec B324 - NGINX cache layout
+    return os.path.join(cache_path, digest[-1], digest[-3:-1], digest)
+
+
+def purge_url(website: object, url: str) -> int:
+    """Purge a URL from the cache of a website.
+
+    The URL is purged for both schemes and all of the domains of the website, so a path such as
+    /blog/ can be purged as well as a full URL. NGINX treats a missing cache file as a miss.
+
+    Args:
+        website (object): Website model object.
+        url (str): A path or a full URL, with its query string if any.
+
+    Returns:
+        int: The number of cache files removed.
+    """
+    parts = urlsplit(url)
+    uri = parts.path or '/'
+    if parts.query:
+        uri = f'{uri}?{parts.query}'
+    hosts = [parts.hostname] if parts.hostname else [domain.domain for domain in website.domains.all()]
+
+    cache_path = filesystem.get_website_paths(website).get('cache_path')
+    removed = 0
+    for host in hosts:
+        for scheme in ['http', 'https']:
+            try:
+                os.remove(cache_file(cache_path, CACHE_KEY.format(scheme=scheme, host=host.lower(), uri=uri)))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def purge_all(website: object) -> int:
+    """Purge the whole cache of a website.
+
+    The directory of the cache is kept, only its contents are removed.
+
+    Args:
+        website (object): Website model object.
+
+    Returns:
+        int: The number of cache files removed.
+    """
+    cache_path = filesystem.get_website_paths(website).get('cache_path')
+    removed = 0
+    try:
+        entries = list(os.scandir(cache_path))
+    except FileNotFoundError:
+        return 0
+
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            removed += sum(len(files) for _, _, files in os.walk(entry.path))
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            os.remove(entry.path)
+            removed += 1
+    return removed
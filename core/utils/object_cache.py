@@ -0,0 +1,299 @@
+import os
+import pwd
+import re
+import socket
+import subprocess  # nosec B404 - only used for its exceptions
+
+from django.conf import settings
+from django.template.loader import render_to_string
+
+from core.utils import filesystem
+from core.utils import system as fcpsys
+
+
+# The constants that FastCP adds to wp-config.php are kept between these lines
+WP_CONFIG_BEGIN = '// BEGIN FastCP object cache'
+WP_CONFIG_END = '// END FastCP object cache'
+WP_CONFIG_BLOCK_RE = re.compile(rf'{re.escape(WP_CONFIG_BEGIN)}\n.*?{re.escape(WP_CONFIG_END)}\n\n', re.S)
+# The constants go right before the first of these lines that wp-config.php has
+WP_CONFIG_ANCHORS = ["/* That's all, stop editing!", "require_once ABSPATH . 'wp-settings.php';"]
+
+
+class RedisError(Exception):
+    """Raised when a Redis server cannot be reached or replies with an error."""
+
+
+class RedisClient(object):
+    """Redis client.
+
+    A minimal RESP client, enough to read the stats of the object cache of a website over its unix
+    socket. One command is sent per connection.
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 5) -> None:
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def command(self, *args) -> object:
+        """Send a command.
+
+        Returns:
+            object: The reply, bulk strings are returned as bytes.
+
+        Raises:
+            RedisError: If the server cannot be reached or replies with an error.
+        """
+        message = f'*{len(args)}\r\n'.encode('utf-8')
+        for arg in args:
+            arg = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            message += f'${len(arg)}\r\n'.encode('utf-8') + arg + b'\r\n'
+
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+                sock.sendall(message)
+                reply = self._read(sock.makefile('rb'))
+        except OSError as e:
+            raise RedisError(f'{self.socket_path}: {e}')
+
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    def _read(self, reader) -> object:
+        line = reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise RedisError('The connection was closed before the end of the reply.')
+
+        kind, value = line[:1], line[1:-2]
+        if kind == b'+':
+            return value.decode('utf-8')
+        if kind == b'-':
+            return RedisError(value.decode('utf-8'))
+        if kind == b':':
+            return int(value)
+        if kind == b'$':
+            length = int(value)
+            return None if length < 0 else reader.read(length + 2)[:length]
+        if kind == b'*':
+            length = int(value)
+            return None if length < 0 else [self._read(reader) for _ in range(length)]
+        raise RedisError('The reply cannot be parsed.')
+
+
+def unit_name(website: object) -> str:
+    """Returns the name of the systemd unit of the object cache of a website."""
+    return f'fastcp-redis-{website.slug}'
+
+
+def render_conf(website: object) -> str:
+    """Render the Redis config of a website.
+
+    The memory of the cache is capped by the plan of the owner of the website.
+
+    Args:
+        website (object): Website model object.
+
+    Returns:
+        str: The content of the config file.
+    """
+    paths = filesystem.get_website_paths(website)
+    return render_to_string('system/redis.txt', {
+        'app_name': website.slug,
+        'socket_path': paths.get('redis_socket_path'),
+        'data_dir': paths.get('redis_path'),
+        'max_memory': website.user.max_object_cache_memory
+    })
+
+
+def render_unit(website: object) -> str:
+    """Render the systemd unit that runs the object cache of a website as its owner."""
+    return render_to_string('system/redis-unit.txt', {
+        'app_name': website.slug,
+        'ssh_user': website.user.username,
+        'redis_server': settings.FASTCP_REDIS_SERVER,
+        'conf_path': filesystem.get_website_paths(website).get('redis_conf_path')
+    })
+
+
+def wire_wp_config(content: str, socket_path: str) -> str:
+    """Add the constants that point the Redis object cache plugins of WordPress to the socket.
+
+    Constants that were added before are replaced.
+
+    Args:
+        content (str): The content of wp-config.php.
+        socket_path (str): The unix socket of the object cache.
+
+    Returns:
+        str: The new content of wp-config.php.
+    """
+    content = unwire_wp_config(content)
+    block = (f"{WP_CONFIG_BEGIN}\n"
+             f"define( 'WP_REDIS_SCHEME', 'unix' );\n"
+             f"define( 'WP_REDIS_PATH', '{socket_path}' );\n"
+             f"define( 'WP_REDIS_DATABASE', 0 );\n"
+             f"{WP_CONFIG_END}\n")
+
+    for anchor in WP_CONFIG_ANCHORS:
+        index = content.find(anchor)
+        if index >= 0:
+            index = content.rfind('\n', 0, index) + 1
+            return f'{content[:index]}{block}\n{content[index:]}'
+
+    # No anchor, the constants go right after the opening tag
+    head, sep, tail = content.partition('\n')
+    return f'{head}{sep}{block}\n{tail}'
+
+
+def unwire_wp_config(content: str) -> str:
+    """Remove the constants that wire_wp_config() added to the content of wp-config.php."""
+    return WP_CONFIG_BLOCK_RE.sub('', content)
+
+
+def update_wp_config(website: object, enabled: bool) -> bool:
+    """Wire or unwire the object cache in the wp-config.php of a website.
+
+    Args:
+        website (object): Website model object.
+        enabled (bool): Add the constants if True, remove them otherwise.
+
+    Returns:
+        bool: True if wp-config.php has been changed, False if it's up to date or doesn't exist.
+    """
+    paths = filesystem.get_website_paths(website)
+    path = os.path.join(paths.get('web_root'), 'wp-config.php')
+    try:
+        with open(path) as f:
+            content = f.read()
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+
+    if enabled:
+        updated = wire_wp_config(content, paths.get('redis_socket_path'))
+    else:
+        updated = unwire_wp_config(content)
+    if updated == content:
+        return False
+
+    filesystem.atomic_write(path, updated.encode('utf-8'), mode=stat.st_mode & 0o777, uid=stat.st_uid, gid=stat.st_gid)
+    return True
+
+
+def enable(website: object) -> bool:
+    """Start the object cache of a website and wire it into its wp-config.php.
+
+    The cache is restarted if its config has changed, e.g. when the plan of the owner has.
+
+    Args:
+        website (object): Website model object.
+
+    Returns:
+        bool: True on success and False otherwise.
+    """
+    paths = filesystem.get_website_paths(website)
+    unit = unit_name(website)
+    changed = False
+    try:
+        # The socket is created by Redis, in a directory that only the owner can enter
+        redis_path = paths.get('redis_path')
+        filesystem.create_if_missing(redis_path)
+        try:
+            owner = pwd.getpwnam(website.user.username)
+            os.chown(redis_path, owner.pw_uid, owner.pw_gid)
+        except KeyError:
+            pass
+        os.chmod(redis_path, 0o700)
+
+        filesystem.create_if_missing(settings.FASTCP_REDIS_CONF_ROOT)
+        for path, data in [(paths.get('redis_conf_path'), render_conf(website)),
+                           (paths.get('redis_unit_path'), render_unit(website))]:
+            if filesystem.config_changed(path, data):
+                filesystem.atomic_write(path, data.encode('utf-8'))
+                changed = True
+
+        if changed and not fcpsys.run_cmd('/usr/bin/systemctl daemon-reload'):
+            return False
+        if not fcpsys.run_cmd(f'/usr/bin/systemctl enable {unit}'):
+            return False
+        if not fcpsys.run_cmd(f'/usr/bin/systemctl {"restart" if changed else "start"} {unit}'):
+            return False
+
+        update_wp_config(website, True)
+        return True
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+
+def disable(website: object) -> bool:
+    """Unwire the object cache of a website from its wp-config.php, stop it and remove its files.
+
+    Args:
+        website (object): Website model object.
+
+    Returns:
+        bool: True on success and False otherwise.
+    """
+    paths = filesystem.get_website_paths(website)
+    try:
+        update_wp_config(website, False)
+        unit_path = paths.get('redis_unit_path')
+        if os.path.exists(unit_path):
+            fcpsys.run_cmd(f'/usr/bin/systemctl disable --now {unit_name(website)}')
+            os.remove(unit_path)
+            fcpsys.run_cmd('/usr/bin/systemctl daemon-reload')
+
+        if os.path.exists(paths.get('redis_conf_path')):
+            os.remove(paths.get('redis_conf_path'))
+        filesystem.delete_dir(paths.get('redis_path'))
+        return True
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+
+def parse_info(data: bytes) -> dict:
+    """Parse the reply of the INFO command, numeric values are converted to numbers."""
+    info = {}
+    for line in data.decode('utf-8', errors='replace').splitlines():
+        if not line or line.startswith('#'):
+            continue
+        key, _, value = line.partition(':')
+        try:
+            info[key] = float(value) if '.' in value else int(value)
+        except ValueError:
+            info[key] = value
+    return info
+
+
+def stats(website: object, timeout: float = 5) -> dict:
+    """Returns the stats of the object cache of a website.
+
+    Args:
+        website (object): Website model object.
+        timeout (float): Socket timeout in seconds.
+
+    Returns:
+        dict: The hits, misses, hit ratio, number of keys, evicted keys, used and max memory in
+              bytes, and connected clients of the cache.
+
+    Raises:
+        RedisError: If the cache cannot be reached.
+    """
+    socket_path = filesystem.get_website_paths(website).get('redis_socket_path')
+    info = parse_info(RedisClient(socket_path, timeout=timeout).command('INFO'))
+    hits = info.get('keyspace_hits', 0)
+    misses = info.get('keyspace_misses', 0)
+    # e.g. db0:keys=12,expires=3,avg_ttl=0
+    keyspace = dict(item.split('=', 1) for item in str(info.get('db0', '')).split(',') if '=' in item)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+        'keys': int(keyspace.get('keys', 0)),
+        'evicted_keys': info.get('evicted_keys', 0),
+        'used_memory': info.get('used_memory', 0),
+        'max_memory': info.get('maxmemory', 0),
+        'connected_clients': info.get('connected_clients', 0),
+    }
@@ -0,0 +1,85 @@
+import os
+
+from django.conf import settings
+from django.db.models import Sum
+
+from core.models import Website
+from core.utils.generics import hardware_info
+
+
+# The OPcache of a PHP version is shared by the pools of all of its websites and it's sized when
+# PHP-FPM starts, so the memory, the max number of files and the preloaded scripts cannot be set
+# per pool. They are set for the whole version in this file of its conf.d directory instead.
+CONF_NAME = '90-fastcp-opcache.ini'
+
+# The shared cache of a version never gets less than the defaults of PHP
+MIN_MEMORY = 128
+MIN_MAX_FILES = 10000
+# The max value of opcache.max_accelerated_files
+MAX_MAX_FILES = 1000000
+# Share of the memory used for interned strings, between 8 MB and the max value of PHP
+INTERNED_STRINGS_RATIO = 8
+MIN_INTERNED_STRINGS = 8
+MAX_INTERNED_STRINGS = 4095
+
+# opcache.preload was added in PHP 7.4
+PRELOAD_MIN_VERSION = (7, 4)
+
+
+def conf_path(php: str) -> str:
+    """Returns the path of the OPcache config of a PHP version."""
+    return os.path.join(settings.PHP_INSTALL_PATH, php, 'fpm', 'conf.d', CONF_NAME)
+
+
+def preload_root(php: str) -> str:
+    """Returns the directory of the preload scripts of a PHP version."""
+    return os.path.join(settings.PHP_INSTALL_PATH, php, 'fpm', 'preload')
+
+
+def supports_preload(php: str) -> bool:
+    """Check either a PHP version supports opcache.preload or not."""
+    try:
+        return tuple(int(part) for part in php.split('.')[:2]) >= PRELOAD_MIN_VERSION
+    except ValueError:
+        return False
+
+
+def max_memory() -> int:
+    """Returns the max memory of the OPcache of a PHP version in megabytes."""
+    ram = hardware_info()['ram']['memory']['total'] / (1024 * 1024)
+    return int(min(ram * settings.FASTCP_OPCACHE_MEMORY_RATIO, settings.FASTCP_OPCACHE_MAX_MEMORY))
+
+
+def version_settings(php: str, exclude: int = None) -> dict:
+    """Returns the OPcache settings of a PHP version.
+
+    The memory and the max number of files of the websites of the version add up, so a node with
+    many websites doesn't thrash a cache sized for one, up to the share of the RAM and the ceiling
+    of the settings, as the whole cache is allocated when PHP-FPM starts. The preloaded classes and functions are
+    declared in every pool of the version, where they clash with the ones of the other websites, so
+    a website only preloads its scripts if it's the only website of its version.
+
+    Args:
+        php (str): The PHP version.
+        exclude (int): ID of a website that is being deleted.
+
+    Returns:
+        dict: The memory, interned_strings_buffer and max_files of the cache, and the website whose
+              scripts are preloaded, None if there's none.
+    """
+    websites = Website.objects.filter(php=php)
+    if exclude is not None:
+        websites = websites.exclude(pk=exclude)
+
+    totals = websites.aggregate(memory=Sum('opcache_memory'), max_files=Sum('opcache_max_files'))
+    memory = max(MIN_MEMORY, min(totals['memory'] or 0, max_memory()))
+    preload = None
+    if supports_preload(php) and websites.count() == 1:
+        preload = websites.filter(opcache_preload=True).select_related('user').first()
+
+    return {
+        'memory': memory,
+        'interned_strings_buffer': min(MAX_INTERNED_STRINGS, max(MIN_INTERNED_STRINGS, memory // INTERNED_STRINGS_RATIO)),
+        'max_files': min(MAX_MAX_FILES, max(MIN_MAX_FILES, totals['max_files'] or 0)),
+        'preload': preload,
+    }
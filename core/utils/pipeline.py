@@ -0,0 +1,127 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.db import close_old_connections
+
+
+# Step statuses
+PENDING = 'pending'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+class Step(object):
+    """A step of a pipeline.
+
+    Steps should be idempotent, so a pipeline that failed halfway can be run again.
+
+    Attributes:
+        name (str): Unique name of the step in the pipeline.
+        func (callable): The function to run, it is called without arguments.
+        requires (list): Names of the steps that must be completed before this one starts.
+    """
+
+    def __init__(self, name: str, func, requires: list = None) -> None:
+        self.name = name
+        self.func = func
+        self.requires = list(requires or [])
+
+
+class Pipeline(object):
+    """Pipeline.
+
+    Runs a dependency graph of steps on a pool of worker threads. A step starts as soon as all of the
+    steps it requires are completed, so independent steps run concurrently. If a step fails, the steps
+    that depend on it are skipped and the others still run.
+
+    The statuses are only changed, and on_change is only called, from the thread that called run().
+    """
+
+    def __init__(self, steps: list, workers: int = 4, on_change=None) -> None:
+        """Create the pipeline.
+
+        Args:
+            steps (list): The Step objects.
+            workers (int): Max number of steps that run at the same time.
+            on_change (callable): Called with the step, its new status and the error message if
+                                  it failed, whenever the status of a step changes.
+
+        Raises:
+            ValueError: If a step requires an unknown step or the steps have a cycle.
+        """
+        self.steps = steps
+        self.workers = max(1, workers)
+        self.on_change = on_change
+        self.statuses = {step.name: PENDING for step in steps}
+        self.errors = {}
+        self._check()
+
+    def _check(self) -> None:
+        names = set(self.statuses)
+        for step in self.steps:
+            unknown = set(step.requires) - names
+            if unknown:
+                raise ValueError(f'The step {step.name} requires unknown steps: {", ".join(unknown)}.')
+
+        done = set()
+        remaining = list(self.steps)
+        while remaining:
+            ready = [step for step in remaining if set(step.requires) <= done]
+            if not ready:
+                raise ValueError('The steps have a dependency cycle.')
+            done.update(step.name for step in ready)
+            remaining = [step for step in remaining if step.name not in done]
+
+    def _set(self, step: Step, status: str, error: str = None) -> None:
+        self.statuses[step.name] = status
+        if error:
+            self.errors[step.name] = error
+        if self.on_change:
+            self.on_change(step, status, error)
+
+    @staticmethod
+    def _run_step(step: Step) -> None:
+        # Every worker thread has its own database connection
+        close_old_connections()
+        try:
+            step.func()
+        finally:
+            close_old_connections()
+
+    def run(self) -> bool:
+        """Run the steps and wait for them.
+
+        Returns:
+            bool: True if all of the steps are completed and False otherwise.
+        """
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='fastcp-step') as executor:
+            while True:
+                changed = True
+                while changed:
+                    changed = False
+                    for step in self.steps:
+                        if self.statuses[step.name] != PENDING:
+                            continue
+                        required = [self.statuses[name] for name in step.requires]
+                        if any(status in (FAILED, SKIPPED) for status in required):
+                            self._set(step, SKIPPED)
+                            changed = True
+                        elif all(status == COMPLETED for status in required):
+                            running[executor.submit(self._run_step, step)] = step
+                            self._set(step, RUNNING)
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        self._set(step, COMPLETED)
+                    else:
+                        self._set(step, FAILED, str(error) or error.__class__.__name__)
+
+        return all(status == COMPLETED for status in self.statuses.values())
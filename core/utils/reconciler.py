@@ -0,0 +1,195 @@
+import glob
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from core.models import Website
+from core.utils import filesystem, fpm, opcache, reloads
+
+
+logger = logging.getLogger(__name__)
+
+# The config templates have this in their header, files without it were not written by FastCP
+GENERATED_MARKER = b'by FastCP'
+
+
+def is_generated(path: str) -> bool:
+    """Check either a config file was generated by FastCP or not."""
+    try:
+        with open(path, 'rb') as f:
+            return GENERATED_MARKER in f.read(512)
+    except OSError:
+        return False
+
+
+class Reconciler(object):
+    """Config reconciler.
+
+    Brings the NGINX and Apache vhosts, the NGINX upstream, and the PHP-FPM pools and OPcache configs
+    on disk back in line with the database. The configs of every website are rendered and compared with the files on
+    disk by a pool of threads, only the files that differ are written, and the generated files that
+    no website owns anymore are removed. The services are reloaded once at the end, and only the ones whose files
+    have changed.
+    """
+
+    def __init__(self, workers: int = 8, dry_run: bool = False) -> None:
+        """Create the reconciler.
+
+        Args:
+            workers (int): Number of threads that render and compare the configs.
+            dry_run (bool): Only report the changes, don't write or remove anything.
+        """
+        self.workers = max(1, workers)
+        self.dry_run = dry_run
+
+    def run(self) -> dict:
+        """Reconcile the configs.
+
+        Returns:
+            dict: The written and removed paths, the number of unchanged files, the errors and the
+                  result of each reloaded service.
+        """
+        report = {'written': [], 'removed': [], 'unchanged': 0, 'errors': [], 'reloaded': {}}
+        websites = Website.objects.select_related('user').prefetch_related('domains')
+        # Computed once here, so the worker threads don't query the database
+        fpm.auto_max_children()
+
+        with reloads.scheduler.hold():
+            expected = {filesystem.get_nginx_upstream_path()}
+            self._reconcile_upstream(report)
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='fastcp-reconcile') as executor:
+                for result in executor.map(self._reconcile_website, websites):
+                    expected.update(result['expected'])
+                    report['written'] += result['written']
+                    report['unchanged'] += result['unchanged']
+                    report['errors'] += result['errors']
+
+            for php in sorted({website.php for website in websites}):
+                self._reconcile_opcache(php, report)
+
+            for path, service in self._generated_files():
+                if path in expected:
+                    continue
+                try:
+                    if not self.dry_run:
+                        self._remove(path, service, expected)
+                    report['removed'].append(path)
+                except OSError as e:
+                    report['errors'].append(f'{path}: {e}')
+
+            if not self.dry_run:
+                report['reloaded'] = reloads.scheduler.flush()
+
+        for error in report['errors']:
+            logger.error(f'Unable to reconcile {error}')
+        return report
+
+    def _reconcile_upstream(self, report: dict) -> None:
+        """Write the NGINX upstream config shared by the vhosts if it differs from the expected one."""
+        path = filesystem.get_nginx_upstream_path()
+        try:
+            data = filesystem.render_nginx_upstream()
+            if self.dry_run:
+                changed = filesystem.config_changed(path, data)
+            else:
+                filesystem.create_if_missing(settings.NGINX_VHOSTS_ROOT)
+                changed = filesystem.write_config(path, data, 'nginx')
+
+            if changed:
+                report['written'].append(path)
+            else:
+                report['unchanged'] += 1
+        except OSError as e:
+            report['errors'].append(f'{path}: {e}')
+
+    def _reconcile_opcache(self, php: str, report: dict) -> None:
+        """Write the OPcache config of a PHP version and its preload script if they differ from the expected ones."""
+        try:
+            data, preload_path, script = filesystem.render_opcache_conf(php)
+        except OSError as e:
+            report['errors'].append(f'{opcache.conf_path(php)}: {e}')
+            return
+
+        files = [(opcache.conf_path(php), data)]
+        if preload_path:
+            files.insert(0, (preload_path, script))
+        for path, data in files:
+            try:
+                if self.dry_run:
+                    changed = filesystem.config_changed(path, data)
+                else:
+                    filesystem.create_if_missing(os.path.dirname(path))
+                    changed = filesystem.write_config(path, data, f'php{php}-fpm')
+
+                if changed:
+                    report['written'].append(path)
+                else:
+                    report['unchanged'] += 1
+            except OSError as e:
+                report['errors'].append(f'{path}: {e}')
+
+    def _reconcile_website(self, website: object) -> dict:
+        """Write the configs of a website that differ from the expected ones."""
+        result = {'expected': [], 'written': [], 'unchanged': 0, 'errors': []}
+        paths = filesystem.get_website_paths(website)
+        configs = [
+            (paths.get('ngix_vhost_conf'), 'nginx', filesystem.render_nginx_vhost),
+            (paths.get('fpm_path'), f'php{website.php}-fpm', filesystem.render_fpm_conf),
+        ]
+        dirs = [paths.get('ngix_vhost_dir'), paths.get('tmp_path')]
+        # The Apache vhost of a website served by NGINX only is removed as an orphan, its include
+        # directory is kept for when the website goes back to Apache
+        if website.serving_mode == 'apache':
+            configs.append((paths.get('apache_vhost_conf'), 'apache2', filesystem.render_apache_vhost))
+            dirs.append(paths.get('apache_vhost_dir'))
+        else:
+            result['expected'].append(paths.get('apache_vhost_dir'))
+
+        if not self.dry_run:
+            if website.cache_mode != 'off':
+                dirs.append(paths.get('cache_path'))
+            for path in dirs:
+                filesystem.create_if_missing(path)
+
+        for path, service, render in configs:
+            result['expected'].append(path)
+            try:
+                data = render(website)
+                if self.dry_run:
+                    changed = filesystem.config_changed(path, data)
+                else:
+                    changed = filesystem.write_config(path, data, service)
+
+                if changed:
+                    result['written'].append(path)
+                else:
+                    result['unchanged'] += 1
+            except OSError as e:
+                result['errors'].append(f'{path}: {e}')
+        return result
+
+    def _generated_files(self) -> list:
+        """Returns the (path, service) of the generated config files on disk."""
+        files = []
+        for pattern, service in [
+            (os.path.join(settings.NGINX_VHOSTS_ROOT, '*.conf'), 'nginx'),
+            (os.path.join(settings.APACHE_VHOST_ROOT, '*.conf'), 'apache2'),
+        ]:
+            files += [(path, service) for path in glob.glob(pattern)]
+
+        for fpm_root in glob.glob(os.path.join(settings.PHP_INSTALL_PATH, '*', 'fpm', 'pool.d')):
+            version = os.path.basename(os.path.dirname(os.path.dirname(fpm_root)))
+            files += [(path, f'php{version}-fpm') for path in glob.glob(os.path.join(fpm_root, '*.conf'))]
+
+        return [(path, service) for path, service in files if is_generated(path)]
+
+    def _remove(self, path: str, service: str, expected: set) -> None:
+        """Remove an orphaned config file, and the include directory of an orphaned vhost."""
+        filesystem.remove_config(path, service)
+        if service in ('nginx', 'apache2'):
+            include_dir = f'{path[:-len(".conf")]}.d'
+            if include_dir not in expected and os.path.isdir(include_dir):
+                shutil.rmtree(include_dir)
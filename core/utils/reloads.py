@@ -0,0 +1,213 @@
+import atexit
+import logging
+import os
+import re
+import subprocess  # nosec B404 - validators are run with fixed arguments
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from core.utils import filesystem
+from core.utils import system as fcpsys
+
+
+logger = logging.getLogger(__name__)
+
+# A restart covers a reload, so it wins when both are requested for a service
+ACTION_PRIORITY = {'reload': 0, 'restart': 1}
+
+# Commands that check the config of a service without touching the running instance
+VALIDATORS = {
+    'nginx': ['/usr/sbin/nginx', '-t'],
+    'apache2': ['/usr/sbin/apachectl', 'configtest'],
+}
+PHP_FPM_RE = re.compile(r'^php(\d+\.\d+)-fpm$')
+
+
+def get_validator(service: str) -> list:
+    """Returns the config test command of a service, None if it has none."""
+    match = PHP_FPM_RE.match(service)
+    if match:
+        return [f'/usr/sbin/php-fpm{match.group(1)}', '-t']
+    return VALIDATORS.get(service)
+
+
+class ReloadScheduler(object):
+    """Reload scheduler.
+
+    Collects the services that need to be restarted or reloaded and runs each of them once at the
+    end of a short debounce window, in a background thread. Creating a website writes several config
+    files and each write requests a restart, but the services are only restarted once.
+
+    Batches never overlap: a batch that becomes due while another one is running waits for it.
+    Callers that need the services to be up to date before they continue call flush(), and bulk
+    operations that take longer than the debounce window hold the batch open with hold().
+
+    The config of every service is tested before it is reloaded or restarted. Config files written
+    with track() are backed up once per batch, and if the test fails, they are restored and the
+    service keeps running with its last good config.
+    """
+
+    def __init__(self, debounce: float = 1) -> None:
+        """Create the scheduler.
+
+        Args:
+            debounce (float): Seconds to wait for more requests before running a batch. With 0,
+                              requests are run immediately in the calling thread.
+        """
+        self.debounce = debounce
+        self._pending = {}
+        self._backups = {}
+        self._lock = threading.Lock()
+        self._running = threading.Lock()
+        self._timer = None
+        self._holds = 0
+
+    def track(self, service: str, path: str) -> None:
+        """Back up a config file of a service before it is changed.
+
+        Only the first change of a file in a batch is backed up, so a failed batch is rolled back
+        to the config the service was running with.
+
+        Args:
+            service (str): The name of the systemd unit that reads the file.
+            path (str): The path of the config file.
+        """
+        with self._lock:
+            backups = self._backups.setdefault(service, {})
+            if path not in backups:
+                try:
+                    with open(path, 'rb') as f:
+                        backups[path] = f.read()
+                except FileNotFoundError:
+                    backups[path] = None
+
+    def schedule(self, services: list, action: str = 'restart') -> None:
+        """Request a restart or a reload of services.
+
+        Args:
+            services (list): The names of the systemd units.
+            action (str): Either restart or reload.
+        """
+        with self._lock:
+            for service in services:
+                current = self._pending.get(service)
+                if current is None or ACTION_PRIORITY[action] > ACTION_PRIORITY[current]:
+                    self._pending[service] = action
+
+            run_now = self._start()
+
+        if run_now:
+            self.flush()
+
+    def _start(self) -> bool:
+        """Start the debounce timer of the pending requests, returns True if they should run now."""
+        if self._holds or not self._pending:
+            return False
+        if self.debounce <= 0:
+            return True
+        if self._timer is None:
+            self._timer = threading.Timer(self.debounce, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+        return False
+
+    @contextmanager
+    def hold(self):
+        """Hold the requests until the end of the block.
+
+        No batch is run while the block runs, unless it's flushed explicitly, so the services are
+        restarted once for all of the changes of the block however long it takes. The requests
+        that are still pending at the end are run as usual.
+        """
+        with self._lock:
+            self._holds += 1
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._holds -= 1
+                run_now = self._start()
+            if run_now:
+                self.flush()
+
+    def flush(self) -> dict:
+        """Run the pending requests now and wait for them to complete.
+
+        Returns:
+            dict: The result of each service that was run, True on success and False otherwise.
+        """
+        with self._running:
+            with self._lock:
+                pending = self._pending
+                backups = self._backups
+                self._pending = {}
+                self._backups = {}
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+
+            results = {}
+            for service, action in pending.items():
+                if self.validate(service):
+                    results[service] = self.run(service, action)
+                else:
+                    self.rollback(backups.get(service, {}))
+                    results[service] = False
+            return results
+
+    def validate(self, service: str) -> bool:
+        """Test the config of a service."""
+        cmd = get_validator(service)
+        if cmd is None:
+            return True
+        try:
+            res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,  # nosec B603
+                                 timeout=60)
+        except FileNotFoundError:
+            # The service isn't installed, there's nothing to test
+            return True
+        except (OSError, subprocess.TimeoutExpired):
+            return False
+
+        if res.returncode != 0:
+            output = res.stdout.decode('utf-8', errors='replace').strip()
+            logger.error(f'The config of {service} is invalid, the changes are rolled back: {output}')
+            return False
+        return True
+
+    def rollback(self, backups: dict) -> None:
+        """Restore the backed up config files.
+
+        Created files are removed and changed ones are restored. Files that were deleted are not
+        brought back, as they belong to websites that don't exist anymore.
+        """
+        for path, data in backups.items():
+            try:
+                if data is None:
+                    if os.path.exists(path):
+                        os.remove(path)
+                elif os.path.exists(path):
+                    filesystem.atomic_write(path, data)
+            except OSError:
+                logger.error(f'Unable to restore {path}.')
+
+    def run(self, service: str, action: str) -> bool:
+        """Run the action of a service."""
+        try:
+            success = fcpsys.run_cmd(f'/usr/bin/systemctl {action} {service}')
+        except (OSError, subprocess.TimeoutExpired):
+            success = False
+        if not success:
+            logger.error(f'Unable to {action} {service}.')
+        return success
+
+
+scheduler = ReloadScheduler(debounce=settings.FASTCP_RELOAD_DEBOUNCE)
+
+# Management commands exit right after their changes, the pending requests must not be lost
+atexit.register(scheduler.flush)
@@ -1,22 +1,51 @@
 import os
+import random
 import secrets
 import string
-from datetime import datetime
+import threading
+import time
+import uuid
+from datetime import timedelta
 from subprocess import (  # nosec B404 - subprocess is required for system command execution
     STDOUT, check_call, CalledProcessError, Popen, PIPE, DEVNULL
 )
 
-import requests
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 from django.template.loader import render_to_string
 
 from api.databases.services.mysql import FastcpSqlService
+from core.models import Domain, Provisioning, Website
 from core.utils import filesystem
+from core.utils import object_cache
+from core.utils import pipeline
+from core.utils import reloads
+from core.utils.downloader import Downloader
+from core.utils.pipeline import Step
+from core.utils.tasks import run_in_background
 
 
 # Constants
 FASTCP_SYS_GROUP = 'fcp-users'
+WP_ARCHIVE_URL = 'https://wordpress.org/latest.zip'
+
+# Seconds the downloaded WordPress archive is reused for
+WP_ARCHIVE_MAX_AGE = 3600
+
+# Certificates are renewed when they expire in this many days or less, or in the last third of
+# their lifetime for shorter lived certificates
+SSL_RENEW_DAYS = 30
+# The renewals are spread over this share of the renewal window, the rest is left for the retries
+SSL_RENEW_SPREAD = 2 / 3
+
+# Steps of a website that write the configs the services are reloaded for
+RELOAD_REQUIRES = ['fpm_pool', 'vhosts']
+
+_wp_archive_lock = threading.Lock()
 
 
 def set_uid(uid=0) -> None:
@@ -107,6 +136,7 @@ def delete_website(website: object):
 
     # Delete PHP FPM pool conf
     filesystem.delete_fpm_conf(website)
+    filesystem.generate_opcache_conf(website.php, exclude=website.pk)
 
     # Delete NGINX vhost files
     filesystem.delete_nginx_vhost(website)
@@ -117,38 +147,72 @@ def delete_website(website: object):
     # Delete SSL certs
     filesystem.delete_ssl_certs(website)
 
+    # Delete the proxy cache
+    filesystem.delete_dir(filesystem.get_website_paths(website).get('cache_path'))
 
-def setup_wordpress(website: object, **kwargs) -> None:
-    """Setup WordPress.
+    # Stop the object cache
+    if website.object_cache != 'off':
+        object_cache.disable(website)
 
-    By default, a blank PHP website is created, but if needed, this function
-    installs WordPress in the root directory of the newly created wbsite.
+
+def download_wordpress() -> str:
+    """Download WordPress.
+
+    Downloads the latest WordPress archive to the cache directory. The archive is reused by the
+    installs that happen within WP_ARCHIVE_MAX_AGE, so concurrent and bulk installs only download
+    it once.
+
+    Returns:
+        str: The path of the archive.
+
+    Raises:
+        DownloadError: If the archive cannot be downloaded.
+    """
+    cache_dir = settings.FASTCP_CACHE_DIR
+    archive_path = os.path.join(cache_dir, 'wordpress-latest.zip')
+    with _wp_archive_lock:
+        try:
+            if time.time() - os.path.getmtime(archive_path) < WP_ARCHIVE_MAX_AGE:
+                return archive_path
+        except OSError:
+            pass
+
+        filesystem.create_if_missing(cache_dir)
+        download_path = os.path.join(cache_dir, f'wordpress-{os.getpid()}.zip')
+        if os.path.exists(download_path):
+            os.remove(download_path)
+        Downloader(WP_ARCHIVE_URL, download_path).download()
+        os.replace(download_path, archive_path)
+    return archive_path
+
+
+def install_wordpress(website: object, archive_path: str, **kwargs) -> None:
+    """Install WordPress.
+
+    Extracts the WordPress archive into the public directory of the website and populates
+    wp-config.php. Anything that a previous attempt left behind is replaced, so it's safe to
+    run it again.
 
     Args:
         website (object): Website model object.
+        archive_path (str): The path of the WordPress archive.
+        dbname (str): The database name.
+        dbuser (str): The database username.
+        dbpassword (str): The database password.
     """
     paths = filesystem.get_website_paths(website)
     base_path = paths.get('base_path')
     pub_path = paths.get('web_root')
 
-    # Delete public directory
-    filesystem.delete_dir(pub_path)
-
-    # Download wordpress
-    wp_archive_path = os.path.join(base_path, 'latest.zip')
-    with requests.get('https://wordpress.org/latest.zip', timeout=30) as res:
-        with open(wp_archive_path, 'wb') as f:
-            f.write(res.content)
-
-    # Extract ZIP
-    filesystem.extract_zip(base_path, wp_archive_path)
-
-    # Rename to public
-    os.rename(os.path.join(base_path, 'wordpress'), pub_path)
-
-    # Delete WP zip
-    os.remove(wp_archive_path)
+    # Extract ZIP next to the public directory
+    extract_path = os.path.join(base_path, '.wordpress')
+    filesystem.delete_dir(extract_path)
+    filesystem.extract_zip(extract_path, archive_path)
 
+    # Replace the public directory
+    filesystem.delete_dir(pub_path)
+    os.rename(os.path.join(extract_path, 'wordpress'), pub_path)
+    filesystem.delete_dir(extract_path)
 
     # Populate wp-config
     dbname = kwargs.get('dbname')
@@ -168,9 +232,229 @@ def setup_wordpress(website: object, **kwargs) -> None:
                 content = content.replace('put your unique phrase here', rand_passwd(60), 1)
 
             f2.write(content)
+
+
+def setup_wordpress(website: object, **kwargs) -> None:
+    """Setup WordPress.
+
+    By default, a blank PHP website is created, but if needed, this function
+    installs WordPress in the root directory of the newly created wbsite.
+
+    Args:
+        website (object): Website model object.
+    """
+    install_wordpress(website, download_wordpress(), **kwargs)
     fix_ownership(website)
 
 
+def website_steps(website: object, database: object = None, dbpassword: str = None) -> list:
+    """Returns the steps that set up a website, except the reload of the services.
+
+    The directories and the configs, the database and the WordPress download don't depend on each
+    other and run concurrently.
+
+    Args:
+        website (object): Website model object, its domains should already exist.
+        database (object): Database model object to create for a WordPress website.
+        dbpassword (str): Password of the database.
+
+    Returns:
+        list: The core.utils.pipeline.Step objects.
+    """
+    def vhosts():
+        if not filesystem.create_nginx_vhost(website) or not filesystem.create_apache_vhost(website):
+            raise OSError('The vhost files cannot be written.')
+
+    steps = [
+        Step('directories', lambda: _check(filesystem.create_website_dirs(website), 'The website directories cannot be created.')),
+        Step('fpm_pool', lambda: _check(filesystem.generate_fpm_conf(website), 'The PHP-FPM pool cannot be created.'),
+             requires=['directories']),
+        Step('vhosts', vhosts, requires=['directories']),
+    ]
+    ownership_requires = ['directories']
+
+    if database is not None:
+        archive = {}
+
+        def download():
+            archive['path'] = download_wordpress()
+
+        def install():
+            install_wordpress(website, archive.get('path'), dbname=database.name,
+                              dbuser=database.username, dbpassword=dbpassword)
+
+        steps += [
+            Step('database', lambda: _check(FastcpSqlService().setup_db(
+                user=database.username, password=dbpassword, dbname=database.name, exists_ok=True),
+                'The database cannot be created.')),
+            Step('wordpress_download', download),
+            Step('wordpress_install', install, requires=['directories', 'database', 'wordpress_download']),
+        ]
+        ownership_requires.append('wordpress_install')
+
+    steps.append(Step('ownership', lambda: fix_ownership(website), requires=ownership_requires))
+    return steps
+
+
+def provision_website(website: object, database: object = None, dbpassword: str = None) -> object:
+    """Provision a website.
+
+    Sets up a newly created website in the background as a dependency graph of idempotent steps,
+    see website_steps(). The progress is saved in a Provisioning object.
+
+    Args:
+        website (object): Website model object, its domains should already exist.
+        database (object): Database model object to create for a WordPress website.
+        dbpassword (str): Password of the database.
+
+    Returns:
+        object: The Provisioning model object.
+    """
+    def reload():
+        # Completed once the services run with the new configs
+        _check_reload(website, reloads.scheduler.flush())
+
+    steps = website_steps(website, database, dbpassword)
+    steps.append(Step('reload', reload, requires=RELOAD_REQUIRES))
+
+    provisioning = Provisioning.objects.create(website=website, steps=_step_states(steps))
+    # The rows created by the caller must be visible to the worker threads
+    transaction.on_commit(lambda: run_in_background(run_provisioning, provisioning.pk, steps))
+    return provisioning
+
+
+def provision_websites(items: list, background: bool = True) -> list:
+    """Provision websites in bulk.
+
+    All of the steps of all of the websites run on the same pool of workers, and the services are
+    reloaded once at the end instead of once per website.
+
+    Args:
+        items (list): A (website, database, dbpassword) tuple for each website, see provision_website().
+        background (bool): Run the steps in the background instead of waiting for them. Either way,
+                           they run once the current transaction is committed.
+
+    Returns:
+        list: The Provisioning model objects, in the order of the items.
+    """
+    jobs = []
+    provisionings = []
+    for website, database, dbpassword in items:
+        steps = website_steps(website, database, dbpassword)
+        # Bookkeeping only, the services are reloaded after all of the steps
+        states = _step_states(steps + [Step('reload', None, requires=RELOAD_REQUIRES)])
+        provisioning = Provisioning(website=website, steps=states)
+        provisionings.append(provisioning)
+        jobs.append((provisioning.pk, steps))
+    Provisioning.objects.bulk_create(provisionings)
+
+    # The rows created by the caller must be visible to the worker threads
+    if background:
+        transaction.on_commit(lambda: run_in_background(run_bulk_provisioning, jobs))
+    else:
+        transaction.on_commit(lambda: run_bulk_provisioning(jobs))
+    return provisionings
+
+
+def run_provisioning(provisioning_id: str, steps: list) -> bool:
+    """Run the steps of a provisioning and save their progress.
+
+    Args:
+        provisioning_id (str): The UUID of the Provisioning model object.
+        steps (list): The core.utils.pipeline.Step objects.
+
+    Returns:
+        bool: True if all of the steps are completed and False otherwise.
+    """
+    provisioning = Provisioning.objects.get(pk=provisioning_id)
+    state = {step.get('name'): step for step in provisioning.steps}
+
+    def on_change(step, status, error):
+        state[step.name]['status'] = status
+        state[step.name]['error'] = error
+        provisioning.save(update_fields=['steps', 'updated'])
+
+    provisioning.status = 'running'
+    provisioning.save(update_fields=['status', 'updated'])
+    success = pipeline.Pipeline(steps, workers=settings.FASTCP_PROVISIONING_WORKERS, on_change=on_change).run()
+    provisioning.status = 'completed' if success else 'failed'
+    provisioning.save(update_fields=['status', 'updated'])
+    return success
+
+
+def run_bulk_provisioning(jobs: list) -> dict:
+    """Run the steps of several provisionings as one pipeline and reload the services once.
+
+    Args:
+        jobs (list): A (provisioning_id, steps) tuple for each provisioning.
+
+    Returns:
+        dict: True for each provisioning id whose steps are all completed and False otherwise.
+    """
+    provisionings = Provisioning.objects.select_related('website').in_bulk([job[0] for job in jobs])
+    states = {}
+    steps = []
+    for provisioning_id, job_steps in jobs:
+        states[str(provisioning_id)] = {step.get('name'): step for step in provisionings[provisioning_id].steps}
+        # Step names are only unique within a website
+        steps += [Step(f'{provisioning_id}/{step.name}', step.func,
+                       requires=[f'{provisioning_id}/{name}' for name in step.requires]) for step in job_steps]
+
+    def set_status(provisioning_id, name, status, error=None):
+        states[provisioning_id][name]['status'] = status
+        states[provisioning_id][name]['error'] = error
+        provisionings[uuid.UUID(provisioning_id)].save(update_fields=['steps', 'updated'])
+
+    def on_change(step, status, error):
+        provisioning_id, name = step.name.split('/', 1)
+        set_status(provisioning_id, name, status, error)
+
+    Provisioning.objects.filter(pk__in=list(provisionings)).update(status='running')
+    with reloads.scheduler.hold():
+        pipeline.Pipeline(steps, workers=settings.FASTCP_PROVISIONING_WORKERS, on_change=on_change).run()
+        results = reloads.scheduler.flush()
+
+    success = {}
+    for provisioning_id, provisioning in provisionings.items():
+        state = states[str(provisioning_id)]
+        if any(state[name]['status'] != pipeline.COMPLETED for name in RELOAD_REQUIRES):
+            set_status(str(provisioning_id), 'reload', pipeline.SKIPPED)
+        else:
+            try:
+                _check_reload(provisioning.website, results)
+                set_status(str(provisioning_id), 'reload', pipeline.COMPLETED)
+            except OSError as e:
+                set_status(str(provisioning_id), 'reload', pipeline.FAILED, str(e))
+
+        success[provisioning_id] = all(step['status'] == pipeline.COMPLETED for step in state.values())
+        provisioning.status = 'completed' if success[provisioning_id] else 'failed'
+        provisioning.save(update_fields=['status', 'updated'])
+    return success
+
+
+def _step_states(steps: list) -> list:
+    """Returns the initial state of steps, as saved in Provisioning.steps."""
+    return [{
+        'name': step.name,
+        'requires': step.requires,
+        'status': pipeline.PENDING,
+        'error': None
+    } for step in steps]
+
+
+def _check_reload(website: object, results: dict) -> None:
+    """Raise an error if a service that serves a website couldn't be reloaded."""
+    for service in ['nginx', 'apache2', f'php{website.php}-fpm']:
+        if not results.get(service, True):
+            raise OSError(f'{service} cannot be reloaded, see error.log for details.')
+
+
+def _check(result, error: str) -> None:
+    """Turn the False result of a helper into an error of a step."""
+    if not result:
+        raise OSError(error)
+
+
 def rand_passwd(length: int = 20) -> str:
     """Generate a random password.
 
@@ -333,6 +617,141 @@ def delete_user_data(user: object) -> None:
     run_cmd(f'/usr/sbin/userdel {user.username}')
 
 
+def read_certificate(data: bytes) -> dict:
+    """Read the metadata of a certificate.
+
+    Args:
+        data (bytes): The certificate, or the chain with the certificate first, in PEM format.
+
+    Returns:
+        dict: The not_before and not_after dates of the certificate, its issuer, the type of its key
+              and the domains it's valid for.
+    """
+    cert = x509.load_pem_x509_certificate(data, default_backend())
+
+    key = cert.public_key()
+    if isinstance(key, rsa.RSAPublicKey):
+        key_type = f'RSA {key.key_size}'
+    elif isinstance(key, ec.EllipticCurvePublicKey):
+        key_type = f'EC {key.curve.name}'
+    else:
+        key_type = type(key).__name__
+
+    try:
+        domains = cert.extensions.get_extension_for_class(
+            x509.SubjectAlternativeName).value.get_values_for_type(x509.DNSName)
+    except x509.ExtensionNotFound:
+        domains = [attr.value for attr in cert.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)]
+
+    return {
+        'not_before': cert.not_valid_before_utc,
+        'not_after': cert.not_valid_after_utc,
+        'issuer': cert.issuer.rfc4514_string()[:255],
+        'key_type': key_type,
+        'domains': domains,
+    }
+
+
+def update_ssl_metadata(website: object) -> bool:
+    """Store the metadata of the certificate of a website.
+
+    Should be called whenever the certificate is written. The domains of the website are marked as
+    having SSL if the certificate is valid for them, and a random point early in the renewal window
+    of the certificate is picked for its renewal.
+
+    Args:
+        website (object): Website model object.
+
+    Returns:
+        bool: True if the metadata has been stored, False if the website has no certificate or it
+              cannot be read.
+    """
+    path = filesystem.get_website_paths(website).get('cert_chain_path')
+    try:
+        with open(path, 'rb') as f:
+            metadata = read_certificate(f.read())
+    except (OSError, ValueError):
+        return False
+
+    website.ssl_not_after = metadata['not_after']
+    website.ssl_issuer = metadata['issuer']
+    website.ssl_key_type = metadata['key_type']
+    website.ssl_domains = metadata['domains']
+    window = min(timedelta(days=SSL_RENEW_DAYS), (metadata['not_after'] - metadata['not_before']) / 3)
+    website.ssl_renew_at = metadata['not_after'] - window + window * SSL_RENEW_SPREAD * random.random()  # nosec B311 - not used for security
+    website.save(update_fields=['ssl_not_after', 'ssl_issuer', 'ssl_key_type', 'ssl_domains', 'ssl_renew_at'])
+
+    covered = {domain.lower() for domain in metadata['domains']}
+    for domain in website.domains.all():
+        if domain.ssl != (domain.domain.lower() in covered):
+            domain.ssl = not domain.ssl
+            domain.save(update_fields=['ssl'])
+    return True
+
+
+def ssl_renew_before() -> object:
+    """Returns the date before which a certificate expires soon enough to be renewed."""
+    return timezone.now() + timedelta(days=SSL_RENEW_DAYS)
+
+
+def expiring_websites() -> object:
+    """Returns the websites whose certificates have expired or expire within SSL_RENEW_DAYS days.
+
+    This is a query on the ssl_not_after index, no certificate file is read.
+    """
+    return Website.objects.filter(ssl_not_after__lte=ssl_renew_before())
+
+
+def ssl_renewal_due(website: object) -> bool:
+    """Check either the certificate of a website is due for renewal.
+
+    The metadata of a certificate that was written before the renewal date was stored is read once.
+
+    Args:
+        website (object): Website model object.
+
+    Returns:
+        bool: True if the renewal date has passed, False otherwise or if the website has no certificate.
+    """
+    if website.ssl_renew_at is None and website.has_ssl:
+        update_ssl_metadata(website)
+
+    return website.ssl_renew_at is not None and website.ssl_renew_at <= timezone.now()
+
+
+def ssl_retry_delay(retries: int) -> float:
+    """Returns the seconds before the next attempt of a domain that has failed this many times in a row.
+
+    The delay doubles with every failure up to FASTCP_SSL_RETRY_MAX, and a random half of it is
+    added so the domains that failed together are not attempted together again.
+    """
+    delay = min(settings.FASTCP_SSL_RETRY_MAX, settings.FASTCP_SSL_RETRY_BASE * 2 ** max(0, retries - 1))
+    return delay / 2 + random.uniform(0, delay / 2)  # nosec B311 - not used for security
+
+
+def record_ssl_attempt(domains: list, error: str = None) -> None:
+    """Record an attempt to get a certificate for domains.
+
+    A success resets the retries of the domains. A failure is counted and the next attempt of the
+    domains is put off, see ssl_retry_delay().
+
+    Args:
+        domains (list): Domain model objects.
+        error (str): Why the attempt failed, None on success.
+    """
+    now = timezone.now()
+    for domain in domains:
+        domain.ssl_attempted = now
+        domain.ssl_error = error
+        if error is None:
+            domain.ssl_retries = 0
+            domain.ssl_next_attempt = None
+        else:
+            domain.ssl_retries += 1
+            domain.ssl_next_attempt = now + timedelta(seconds=ssl_retry_delay(domain.ssl_retries))
+    Domain.objects.bulk_update(domains, ['ssl_attempted', 'ssl_error', 'ssl_retries', 'ssl_next_attempt'])
+
+
 def ssl_expiring(website: object) -> bool:
     """Check if SSL is expiring.
 
@@ -340,6 +759,9 @@ def ssl_expiring(website: object) -> bool:
     return True. FastCP uses this function to determine either an SSL certificate
     should be requested for a website or not.
 
+    The expiry is read from the database. The certificate file is only read, and its metadata stored,
+    for a website with SSL whose certificate was written before the metadata was stored.
+
     Args:
         website (object): Website model object.
 
@@ -347,26 +769,7 @@ def ssl_expiring(website: object) -> bool:
         bool: Returns True if it's expiring, and returns False if expiry is not near
         or if SSL cert file was not found.
     """
+    if website.ssl_not_after is None and website.has_ssl:
+        update_ssl_metadata(website)
 
-    paths = filesystem.get_website_paths(website)
-
-    if os.path.exists(paths.get('cert_chain_path')):
-        with open(paths.get('cert_chain_path')) as f:
-            certdata = f.read().encode()
-
-        cert = x509.load_pem_x509_certificate(certdata, default_backend())
-        expiry = cert.not_valid_after
-        curr_time = datetime.now()
-
-        # If expired
-        if expiry <= curr_time:
-            return True
-
-        # Time delta
-        delta = expiry - curr_time
-
-        # If <= 7 days left
-        if delta.days <= 30:
-            return True
-
-    return False
+    return website.ssl_not_after is not None and website.ssl_not_after <= ssl_renew_before()
@@ -0,0 +1,32 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+# Long running jobs (remote fetches, provisioning, etc.) are executed on this pool
+# so they don't hold the HTTP request open.
+_executor = ThreadPoolExecutor(
+    max_workers=settings.FASTCP_TASK_WORKERS, thread_name_prefix='fastcp-task')
+
+
+def run_in_background(func, *args, **kwargs) -> object:
+    """Run a function in the background.
+
+    Submits the function to the shared task pool of this process. The database connection used by
+    the worker thread is closed once the function returns.
+
+    Args:
+        func (callable): The function to execute.
+
+    Returns:
+        object: A concurrent.futures.Future for the submitted function.
+    """
+    def run():
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return _executor.submit(run)
@@ -0,0 +1,543 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+
+# inotify(7) flags
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Events watched on every directory, the events of the files in it are reported
+# with the file names, so a single watch covers the directory and its files
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+# Max number of undelivered messages kept for a subscriber, older ones are dropped
+MAX_PENDING = 1000
+
+# Max number of bytes read from a followed file at once
+READ_SIZE = 1024 * 1024
+
+
+def _event_kind(mask: int) -> str:
+    """Map an inotify mask to an event kind."""
+    if mask & (IN_CREATE | IN_MOVED_TO):
+        return 'add'
+    if mask & (IN_DELETE | IN_MOVED_FROM):
+        return 'remove'
+    if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+        return 'gone'
+    return 'modify'
+
+
+def _snapshot(path: str) -> dict:
+    """Snapshot a directory for the polling backend, None if it doesn't exist."""
+    try:
+        with os.scandir(path) as entries:
+            snapshot = {}
+            for entry in entries:
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                snapshot[entry.name] = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            return snapshot
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+class Inotify(object):
+    """A thin wrapper around the inotify syscalls of the C library."""
+
+    def __init__(self) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1() failed')
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self) -> list:
+        """Read the pending events as a list of (wd, mask, name) tuples."""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        pos = 0
+        while pos + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            name = data[pos:pos + length].rstrip(b'\0')
+            pos += length
+            events.append((wd, mask, os.fsdecode(name) if name else None))
+        return events
+
+
+class Watcher(object):
+    """Watcher.
+
+    Multiplexes the change notifications of directories over a single inotify instance and a single
+    thread, so any number of subscribers of the same directory cost one watch. Directories that
+    cannot be watched with inotify (inotify isn't available, the watch limit is reached, or the
+    polling backend is forced) are scanned periodically instead. The callbacks are called from the
+    watcher thread with the kind of the event (add, remove, modify, gone or overflow) and the name
+    of the entry in the directory.
+    """
+
+    def __init__(self, poll_interval: float = 2, polling: bool = False) -> None:
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        self._paths = {}
+        self._wds = {}
+        self._snapshots = {}
+        self._thread = None
+        self._last_poll = 0
+
+        self._inotify = None
+        if not polling:
+            try:
+                self._inotify = Inotify()
+            except (OSError, AttributeError):
+                pass
+
+    def watch(self, path: str, callback) -> None:
+        """Subscribe a callback to the events of a directory."""
+        with self._lock:
+            callbacks = self._callbacks.setdefault(path, [])
+            if not callbacks:
+                self._add(path)
+            callbacks.append(callback)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='fastcp-watcher', daemon=True)
+                self._thread.start()
+
+    def unwatch(self, path: str, callback) -> None:
+        """Unsubscribe a callback, the directory is no longer watched after the last one."""
+        with self._lock:
+            callbacks = self._callbacks.get(path, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks and path in self._callbacks:
+                del self._callbacks[path]
+                self._remove(path)
+
+    def _add(self, path: str) -> None:
+        wd = None
+        if self._inotify is not None:
+            try:
+                wd = self._inotify.add_watch(path, WATCH_MASK)
+                self._wds[wd] = path
+            except OSError:
+                # Out of watches, or the directory doesn't exist (yet)
+                pass
+        if wd is None:
+            self._snapshots[path] = _snapshot(path)
+        self._paths[path] = wd
+
+    def _remove(self, path: str) -> None:
+        wd = self._paths.pop(path, None)
+        if wd is not None:
+            self._wds.pop(wd, None)
+            self._inotify.rm_watch(wd)
+        self._snapshots.pop(path, None)
+
+    def _fall_back(self, path: str) -> None:
+        """Switch a directory that was removed or moved to polling, so it is noticed if recreated."""
+        wd = self._paths.get(path)
+        if wd is not None:
+            self._wds.pop(wd, None)
+            self._inotify.rm_watch(wd)
+        self._paths[path] = None
+        self._snapshots[path] = _snapshot(path)
+
+    def _dispatch(self, path: str, kind: str, name: str) -> None:
+        with self._lock:
+            callbacks = list(self._callbacks.get(path, []))
+        for callback in callbacks:
+            try:
+                callback(kind, name)
+            except Exception:
+                # A broken subscriber must not stop the events of the others
+                pass
+
+    def _read_inotify(self) -> None:
+        for wd, mask, name in self._inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                with self._lock:
+                    paths = list(self._callbacks)
+                for path in paths:
+                    self._dispatch(path, 'overflow', None)
+                continue
+
+            with self._lock:
+                path = self._wds.get(wd)
+                if path is not None and mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    self._fall_back(path)
+            if path is not None and not mask & IN_IGNORED:
+                self._dispatch(path, _event_kind(mask), name)
+
+    def _poll(self) -> None:
+        with self._lock:
+            paths = list(self._snapshots)
+
+        for path in paths:
+            current = _snapshot(path)
+            with self._lock:
+                if path not in self._snapshots:
+                    continue
+                previous = self._snapshots[path]
+                self._snapshots[path] = current
+
+            if previous is not None and current is None:
+                self._dispatch(path, 'gone', None)
+                continue
+            previous = previous or {}
+            current = current or {}
+            for name in previous.keys() - current.keys():
+                self._dispatch(path, 'remove', name)
+            for name, stat in current.items():
+                if name not in previous:
+                    self._dispatch(path, 'add', name)
+                elif stat != previous[name]:
+                    self._dispatch(path, 'modify', name)
+
+    def _run(self) -> None:
+        while True:
+            if self._inotify is not None:
+                ready, _, _ = select.select([self._inotify.fd], [], [], self.poll_interval)
+                if ready:
+                    self._read_inotify()
+            else:
+                time.sleep(self.poll_interval)
+
+            now = time.monotonic()
+            if now - self._last_poll >= self.poll_interval:
+                self._last_poll = now
+                self._poll()
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def get_watcher() -> Watcher:
+    """Returns the watcher of the process, it is created on the first use."""
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = Watcher(poll_interval=settings.FASTCP_WATCH_POLL_INTERVAL,
+                               polling=settings.FASTCP_WATCH_POLLING)
+        return _watcher
+
+
+class Subscription(object):
+    """Subscription.
+
+    Buffers the messages of a channel for a single consumer. Messages are pushed from the watcher
+    thread and consumed either with get() from a regular thread or with aget() from an event loop.
+    Slow consumers never block the others, the oldest messages are dropped instead and counted in
+    the dropped attribute.
+    """
+
+    def __init__(self, channel: object) -> None:
+        self.channel = channel
+        self.dropped = 0
+        # Position of the channel when subscribed, if it has one, e.g. the offset in a followed file
+        self.offset = None
+        self._items = deque(maxlen=MAX_PENDING)
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._loop = None
+        self._async_ready = None
+
+    def push(self, item, coalesce: bool = False) -> None:
+        """Queue a message, with coalesce it is skipped if the same message is still pending."""
+        with self._lock:
+            if coalesce and item in self._items:
+                return
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(item)
+            loop = self._loop
+        self._ready.set()
+        if loop is not None:
+            loop.call_soon_threadsafe(self._async_ready.set)
+
+    def _drain(self) -> list:
+        with self._lock:
+            items = list(self._items)
+            self._items.clear()
+            self._ready.clear()
+        return items
+
+    def get(self, timeout: float = None) -> list:
+        """Wait for messages and return all of the pending ones, an empty list on timeout."""
+        self._ready.wait(timeout)
+        return self._drain()
+
+    async def aget(self, timeout: float = None) -> list:
+        """Same as get() but waits without blocking the event loop."""
+        if self._loop is None:
+            self._async_ready = asyncio.Event()
+            with self._lock:
+                self._loop = asyncio.get_running_loop()
+                if self._items:
+                    self._async_ready.set()
+        try:
+            await asyncio.wait_for(self._async_ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._async_ready.clear()
+        return self._drain()
+
+    def close(self) -> None:
+        self.channel.unsubscribe(self)
+
+
+class LogFollower(object):
+    """Log follower.
+
+    Follows a file and pushes the lines appended to it to its subscribers. A single follower, and a
+    single file descriptor, is shared by all of the subscribers of a file. The follower reacts to
+    the events of the parent directory, which also reports the file being rotated: if the file is
+    replaced (its inode changes), the rest of the old file is read before the new one is opened,
+    and if it is truncated in place, reading restarts from the top.
+
+    Messages are tuples of an event and its data: ('lines', [str, ...], offset), ('rotate', None)
+    or ('truncate', None). The offset is the end of the lines in the file, and the offset of a new
+    subscription is the point its first lines start from, so a client can resume from it.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.key = ('follow', path)
+        self.path = path
+        self.dirname, self.name = os.path.split(path)
+        self.subscribers = set()
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._file = None
+        self._partial = b''
+
+    def start(self) -> None:
+        self._open(from_end=True)
+        get_watcher().watch(self.dirname, self._on_event)
+
+    def stop(self) -> None:
+        get_watcher().unwatch(self.dirname, self._on_event)
+        with self._lock:
+            self._stopped = True
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self)
+        with self._lock:
+            subscription.offset = self._position()
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        _release(self, subscription)
+
+    def _position(self) -> int:
+        """Returns the end of the lines that have been pushed, None if the file isn't open."""
+        if self._file is None:
+            return None
+        return self._file.tell() - len(self._partial)
+
+    def _open(self, from_end: bool = False) -> None:
+        try:
+            self._file = open(self.path, 'rb')
+        except OSError:
+            self._file = None
+            return
+        if from_end:
+            self._file.seek(0, os.SEEK_END)
+        self._partial = b''
+
+    def _broadcast(self, event: str, data=None, offset: int = None) -> None:
+        message = (event, data) if offset is None else (event, data, offset)
+        for subscription in list(self.subscribers):
+            subscription.push(message)
+
+    def _read_lines(self) -> None:
+        """Read the data appended to the open file and push the complete lines."""
+        while True:
+            data = self._file.read(READ_SIZE)
+            if not data:
+                break
+            lines = (self._partial + data).split(b'\n')
+            self._partial = lines.pop()
+            if lines:
+                self._broadcast('lines', [line.decode('utf-8', errors='replace') for line in lines],
+                                self._position())
+
+    def _on_event(self, kind: str, name: str) -> None:
+        if name is not None and name != self.name:
+            return
+
+        with self._lock:
+            if self._stopped:
+                return
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                stat = None
+
+            if self._file is None:
+                if stat is not None:
+                    self._open()
+                    self._broadcast('rotate')
+                    self._read_lines()
+                return
+
+            current = os.fstat(self._file.fileno())
+            if stat is not None and (stat.st_ino, stat.st_dev) != (current.st_ino, current.st_dev):
+                # Rotated, finish the old file first
+                self._read_lines()
+                self._file.close()
+                self._open()
+                self._broadcast('rotate')
+            elif stat is not None and stat.st_size < self._file.tell():
+                self._file.seek(0)
+                self._partial = b''
+                self._broadcast('truncate')
+
+            if self._file is not None:
+                self._read_lines()
+
+
+class DirectoryChannel(object):
+    """Directory channel.
+
+    Pushes the changes of the entries of a directory to its subscribers. A single watch is shared by
+    all of the subscribers of a directory, and repeated changes of the same entry that haven't been
+    delivered yet, e.g. the writes to a file that is being uploaded, are coalesced into one message.
+
+    Messages are ('change', {'event': str, 'name': str}) tuples, where the event is add, remove or
+    modify, or gone if the directory itself was removed, or overflow if changes were missed.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.key = ('directory', path)
+        self.path = path
+        self.subscribers = set()
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        get_watcher().watch(self.path, self._on_event)
+
+    def stop(self) -> None:
+        get_watcher().unwatch(self.path, self._on_event)
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self)
+        with self._lock:
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        _release(self, subscription)
+
+    def _on_event(self, kind: str, name: str) -> None:
+        with self._lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            subscription.push(('change', {'event': kind, 'name': name}), coalesce=True)
+
+
+_channels = {}
+_channels_lock = threading.Lock()
+
+
+def _release(channel: object, subscription: Subscription) -> None:
+    """Remove a subscriber of a shared channel, the channel is stopped after the last one."""
+    with _channels_lock:
+        with channel._lock:
+            channel.subscribers.discard(subscription)
+            idle = not channel.subscribers
+        if idle and _channels.get(channel.key) is channel:
+            del _channels[channel.key]
+        else:
+            idle = False
+    if idle:
+        channel.stop()
+
+
+def _acquire(key: tuple, factory) -> Subscription:
+    """Subscribe to a shared channel, the channel is created and started for the first subscriber."""
+    with _channels_lock:
+        channel = _channels.get(key)
+        if channel is None:
+            channel = factory()
+            channel.start()
+            _channels[key] = channel
+        return channel.subscribe()
+
+
+def follow(path: str) -> Subscription:
+    """Follow a file.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        Subscription: The subscription to the lines appended to the file from now on. It must be
+                      closed once it is no longer needed.
+    """
+    path = os.path.realpath(path)
+    return _acquire(('follow', path), lambda: LogFollower(path))
+
+
+def watch_directory(path: str) -> Subscription:
+    """Watch a directory.
+
+    Args:
+        path (str): The path of the directory.
+
+    Returns:
+        Subscription: The subscription to the changes of the entries of the directory. It must be
+                      closed once it is no longer needed.
+    """
+    path = os.path.realpath(path)
+    return _acquire(('directory', path), lambda: DirectoryChannel(path))
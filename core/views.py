@@ -1,12 +1,18 @@
+import mimetypes
 import os
+from urllib.parse import quote
 
 from django.conf import settings
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.http import FileResponse, Http404
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import redirect, render
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date
 
 from .forms import LoginForm
+from .utils import filesystem
+from .utils.http import RangeNotSatisfiable, parse_range_header
 
 
 @user_passes_test(lambda user: not user.is_authenticated, login_url='/', redirect_field_name=None)
@@ -31,8 +37,14 @@ def sign_out(request):
     logout(request)
     return redirect('/dashboard')
 
-@login_required
-def download_file(request):
+def get_download_path(request) -> str:
+    """Get download path.
+
+    Resolves the requested path and ensures that it is a file the user is allowed to access.
+
+    Returns:
+        str: The absolute path of the file or None if it's not allowed.
+    """
     path = request.GET.get('path')
     user = request.user
     if user.is_superuser:
@@ -41,29 +53,109 @@ def download_file(request):
         base_path = os.path.join(settings.FILE_MANAGER_ROOT, user.username)
 
     # Normalize base path to ensure it ends with separator
-    base_path = os.path.abspath(base_path)
+    base_path = os.path.realpath(base_path)
     if not base_path.endswith(os.sep):
         base_path += os.sep
 
     if path:
-        # Clean and validate the requested path
-        # Remove any leading slashes and dangerous sequences
-        path = path.lstrip('/').replace('..', '').replace('//', '/')
-
-        # Build full path and resolve any symlinks
-        full_path = os.path.abspath(os.path.join(base_path, path))
+        # Build full path (relative paths are relative to the base path) and
+        # resolve any symlinks and dot segments
+        full_path = os.path.realpath(os.path.join(base_path, path))
 
         # Ensure the resolved path is within the base directory
         if (full_path.startswith(base_path) and
-            os.path.exists(full_path) and
             os.path.isfile(full_path) and
-            os.path.commonpath([full_path, base_path]) == base_path):
-
-            try:
-                with open(full_path, 'rb') as f:
-                    response = FileResponse(f)
-                    return response
-            except (IOError, OSError):
-                pass
+            os.path.commonpath([full_path, base_path]) == base_path.rstrip(os.sep)):
+            return full_path
+    return None
+
+
+def accel_redirect_response(full_path: str) -> HttpResponse:
+    """Hand the file transfer over to NGINX.
+
+    NGINX serves the file from an internal location, including range and conditional requests, so
+    the worker is released as soon as this response is returned.
+    """
+    root = os.path.realpath(settings.FILE_MANAGER_ROOT)
+    rel_path = os.path.relpath(full_path, root)
+    content_type, encoding = mimetypes.guess_type(full_path)
+
+    response = HttpResponse(content_type=content_type or 'application/octet-stream')
+    response['X-Accel-Redirect'] = settings.FASTCP_DOWNLOAD_ACCEL_PREFIX.rstrip('/') + '/' + quote(rel_path)
+    response['Content-Disposition'] = content_disposition_header(False, os.path.basename(full_path))
+    return response
+
+
+def read_range(f, start: int, length: int, block_size: int = 64 * 1024):
+    """Yield the requested range of an open file and close it afterwards."""
+    try:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(block_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+def file_response(request, full_path: str) -> HttpResponse:
+    """Serve a file.
+
+    Answers conditional requests (If-None-Match, If-Modified-Since) with 304 and single byte
+    range requests with 206, so interrupted downloads can be resumed.
+    """
+    stat = os.stat(full_path)
+    etag = filesystem.file_etag(stat)
+    last_modified = int(stat.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
+
+    # A stale If-Range validator means the full file should be sent
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if not if_range or if_range in [etag, http_date(last_modified)]:
+        try:
+            byte_range = parse_range_header(request.headers.get('Range'), stat.st_size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+
+    f = open(full_path, 'rb')
+    if byte_range:
+        start, end = byte_range
+        content_type, encoding = mimetypes.guess_type(full_path)
+        response = StreamingHttpResponse(
+            read_range(f, start, end - start + 1),
+            status=206,
+            content_type=content_type or 'application/octet-stream'
+        )
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        response['Content-Disposition'] = content_disposition_header(False, os.path.basename(full_path))
+    else:
+        response = FileResponse(f)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+@login_required
+def download_file(request):
+    full_path = get_download_path(request)
+    if full_path:
+        if settings.FASTCP_DOWNLOAD_ACCEL_REDIRECT:
+            return accel_redirect_response(full_path)
+
+        try:
+            return file_response(request, full_path)
+        except (IOError, OSError):
+            pass
 
     raise Http404
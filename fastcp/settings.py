@@ -66,6 +66,11 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        'core': {
+            'handlers': ['file'],
+            'level': 'ERROR',
+            'propagate': True,
+        },
     },
 }
 
@@ -106,7 +111,9 @@ INSTALLED_APPS = [
 ]
 
 # CRON_CLASSES = [
-#     'core.crons.ProcessSsls'
+#     'core.crons.ProcessSsls',
+#     'core.crons.ReconcileConfigs',
+#     'core.crons.ScrapeFpmStatus'
 # ]
 # DJANGO_CRON_DELETE_LOGS_OLDER_THAN = 1
 
@@ -228,11 +235,83 @@ LOGIN_REDIRECT_URL = 'spa'
 FILE_MANAGER_ROOT = os.environ.get('FILE_MANAGER_ROOT', '/srv/users')
 PHP_INSTALL_PATH = os.environ.get('PHP_INSTALL_PATH', '/etc/php')
 NGINX_BASE_DIR = os.environ.get('NGINX_BASE_DIR', '/etc/nginx')
+# The proxy cache of each website is kept in a sub-directory of this directory
+NGINX_CACHE_ROOT = os.environ.get('NGINX_CACHE_ROOT', '/var/cache/nginx/fastcp')
+NGINX_CACHE_MAX_SIZE = os.environ.get('NGINX_CACHE_MAX_SIZE', '1g')
 NGINX_VHOSTS_ROOT = os.environ.get('NGINX_VHOSTS_ROOT', '/etc/nginx/vhosts.d')
 APACHE_VHOST_ROOT = os.environ.get('APACHE_VHOST_ROOT', '/etc/apache2/vhosts.d')
+# NGINX keeps up to NGINX_UPSTREAM_KEEPALIVE idle connections to Apache per worker process. A
+# connection is retired after NGINX_UPSTREAM_KEEPALIVE_REQUESTS requests or when it has been idle for
+# NGINX_UPSTREAM_KEEPALIVE_TIMEOUT seconds, which should stay below the MaxKeepAliveRequests (100)
+# and KeepAliveTimeout (5s) of Apache, so NGINX never reuses a connection that Apache is closing.
+NGINX_UPSTREAM_KEEPALIVE = int(os.environ.get('NGINX_UPSTREAM_KEEPALIVE', 32))
+NGINX_UPSTREAM_KEEPALIVE_REQUESTS = int(os.environ.get('NGINX_UPSTREAM_KEEPALIVE_REQUESTS', 99))
+NGINX_UPSTREAM_KEEPALIVE_TIMEOUT = int(os.environ.get('NGINX_UPSTREAM_KEEPALIVE_TIMEOUT', 4))
 FASTCP_VERSION = os.environ.get('FASTCP_VERSION', '1.0.1')
 LETSENCRYPT_IS_STAGING = os.environ.get('LETSENCRYPT_IS_STAGING') is not None
 SERVER_IP_ADDR = os.environ.get('SERVER_IP_ADDR', 'N/A')
 FASTCP_SQL_PASSWORD = os.environ.get('FASTCP_SQL_PASSWORD')
 FASTCP_SQL_USER = os.environ.get('FASTCP_SQL_USER')
 FASTCP_PHPMYADMIN_PATH = os.environ.get('FASTCP_PHPMYADMIN_PATH', '/var/fastcp/phpmyadmin')
+FASTCP_TASK_WORKERS = int(os.environ.get('FASTCP_TASK_WORKERS', 4))
+FASTCP_REMOTE_FETCH_CONNECTIONS = int(os.environ.get('FASTCP_REMOTE_FETCH_CONNECTIONS', 4))
+# If enabled, file downloads are handed over to NGINX with X-Accel-Redirect. NGINX should
+# map the prefix to FILE_MANAGER_ROOT with an internal location, e.g.:
+#   location /fastcp-internal-files/ { internal; alias /srv/users/; }
+FASTCP_DOWNLOAD_ACCEL_REDIRECT = os.environ.get('FASTCP_DOWNLOAD_ACCEL_REDIRECT') is not None
+FASTCP_DOWNLOAD_ACCEL_PREFIX = os.environ.get('FASTCP_DOWNLOAD_ACCEL_PREFIX', '/fastcp-internal-files/')
+# Change notifications use inotify, directories that cannot be watched with it (or all of them if
+# polling is forced, e.g. on network filesystems) are scanned every FASTCP_WATCH_POLL_INTERVAL seconds.
+FASTCP_WATCH_POLL_INTERVAL = float(os.environ.get('FASTCP_WATCH_POLL_INTERVAL', 2))
+FASTCP_WATCH_POLLING = os.environ.get('FASTCP_WATCH_POLLING') is not None
+# Seconds between keep-alive comments on idle event streams
+FASTCP_SSE_KEEPALIVE = int(os.environ.get('FASTCP_SSE_KEEPALIVE', 15))
+# Under WSGI, an event stream holds a worker, so it ends after this many seconds (below the 30s
+# timeout of the gunicorn workers) and the client reconnects
+FASTCP_SSE_WSGI_MAX_DURATION = float(os.environ.get('FASTCP_SSE_WSGI_MAX_DURATION', 25))
+# Service restarts and reloads requested within this many seconds are coalesced and run once in
+# the background. With 0 they are run immediately.
+FASTCP_RELOAD_DEBOUNCE = float(os.environ.get('FASTCP_RELOAD_DEBOUNCE', 1))
+# Max number of steps of a website provisioning that run at the same time
+FASTCP_PROVISIONING_WORKERS = int(os.environ.get('FASTCP_PROVISIONING_WORKERS', 4))
+# Downloads shared between installs (e.g. the WordPress archive) are kept here
+FASTCP_CACHE_DIR = os.environ.get('FASTCP_CACHE_DIR', '/var/cache/fastcp')
+# Number of threads that render and compare the configs of the websites in reconcile-configs
+FASTCP_RECONCILE_WORKERS = int(os.environ.get('FASTCP_RECONCILE_WORKERS', 8))
+# The auto PHP-FPM profile shares this fraction of the RAM between the pools of all websites,
+# assuming each PHP worker uses FASTCP_FPM_CHILD_MEMORY megabytes
+FASTCP_FPM_MEMORY_RATIO = float(os.environ.get('FASTCP_FPM_MEMORY_RATIO', 0.6))
+FASTCP_FPM_CHILD_MEMORY = int(os.environ.get('FASTCP_FPM_CHILD_MEMORY', 64))
+# The shared OPcache of a PHP version gets the memory of its websites added up, but never more than
+# FASTCP_OPCACHE_MEMORY_RATIO of the RAM or FASTCP_OPCACHE_MAX_MEMORY megabytes
+FASTCP_OPCACHE_MEMORY_RATIO = float(os.environ.get('FASTCP_OPCACHE_MEMORY_RATIO', 0.15))
+FASTCP_OPCACHE_MAX_MEMORY = int(os.environ.get('FASTCP_OPCACHE_MAX_MEMORY', 1024))
+# Requests slower than this many seconds get their stack trace written to the slowlog of the pool
+FASTCP_FPM_SLOWLOG_TIMEOUT = int(os.environ.get('FASTCP_FPM_SLOWLOG_TIMEOUT', 5))
+# The status of the PHP-FPM pools is scraped by the scrape-fpm-status command every
+# FASTCP_FPM_STATUS_INTERVAL seconds, rounded to minutes, and the last FASTCP_FPM_STATUS_SAMPLES
+# samples of each pool are kept in FASTCP_FPM_STATUS_DIR. While django_cron is disabled, the
+# command must be run from the system cron, see PRODUCTION_DEPLOYMENT.md
+FASTCP_FPM_STATUS_INTERVAL = float(os.environ.get('FASTCP_FPM_STATUS_INTERVAL', 60))
+FASTCP_FPM_STATUS_SAMPLES = int(os.environ.get('FASTCP_FPM_STATUS_SAMPLES', 120))
+FASTCP_FPM_STATUS_DIR = os.environ.get('FASTCP_FPM_STATUS_DIR', '/var/fastcp/fpm-status')
+# The Redis object caches of the websites are run by systemd units that FastCP writes to
+# SYSTEMD_UNIT_ROOT, with their configs in FASTCP_REDIS_CONF_ROOT
+FASTCP_REDIS_SERVER = os.environ.get('FASTCP_REDIS_SERVER', '/usr/bin/redis-server')
+FASTCP_REDIS_CONF_ROOT = os.environ.get('FASTCP_REDIS_CONF_ROOT', '/etc/fastcp/redis')
+SYSTEMD_UNIT_ROOT = os.environ.get('SYSTEMD_UNIT_ROOT', '/etc/systemd/system')
+# Domains are verified before an SSL certificate is requested, by up to FASTCP_SSL_VERIFY_WORKERS
+# concurrent probes. The domains that haven't answered after FASTCP_SSL_VERIFY_DEADLINE seconds
+# are left out of the certificate.
+FASTCP_SSL_VERIFY_WORKERS = int(os.environ.get('FASTCP_SSL_VERIFY_WORKERS', 8))
+FASTCP_SSL_VERIFY_DEADLINE = float(os.environ.get('FASTCP_SSL_VERIFY_DEADLINE', 10))
+# The activate-ssl command gets the certificates of up to FASTCP_SSL_RENEW_WORKERS websites at a
+# time, and places at most FASTCP_SSL_ORDERS_PER_WINDOW orders every FASTCP_SSL_ORDER_WINDOW
+# seconds, the new orders rate limit of a Let's Encrypt account.
+FASTCP_SSL_RENEW_WORKERS = int(os.environ.get('FASTCP_SSL_RENEW_WORKERS', 8))
+FASTCP_SSL_ORDERS_PER_WINDOW = int(os.environ.get('FASTCP_SSL_ORDERS_PER_WINDOW', 300))
+FASTCP_SSL_ORDER_WINDOW = int(os.environ.get('FASTCP_SSL_ORDER_WINDOW', 10800))
+# A domain that cannot get a certificate is attempted again after FASTCP_SSL_RETRY_BASE seconds,
+# and the delay doubles with every failure up to FASTCP_SSL_RETRY_MAX seconds
+FASTCP_SSL_RETRY_BASE = int(os.environ.get('FASTCP_SSL_RETRY_BASE', 600))
+FASTCP_SSL_RETRY_MAX = int(os.environ.get('FASTCP_SSL_RETRY_MAX', 86400))